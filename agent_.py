@@ -1,6 +1,9 @@
 from classes.keyboardmanager import keyboard_listener
+from classes.dashboard import ProgressDashboard
 from classes.statemanager import local_state
+from synthesis_ import SYNTHESIS_BATCH, ResearchNotes, synthesize
 from product_pricer_ import product_pricer_
+from web_tools_ import closing_connections
 from rich.prompt import Prompt, IntPrompt
 from utils import ensure_user_workspace
 from rich.console import Console
@@ -8,7 +11,7 @@ from rich.panel import Panel
 from rich.table import Table
 from rich.align import Align
 from rich.text import Text
-from typing import List
+from typing import List, Tuple
 import pandas as pd
 import asyncio
 import time
@@ -67,65 +70,6 @@ def create_welcome_panel():
     )
 
 
-def create_product_panel(product: str, index: int, total: int):
-    """product processing panel"""
-    progress_bar = "▓" * (index) + "░" * (total - index - 1)
-
-    content = Text.assemble(
-        ("◈ Product: ", "bright_yellow"),
-        (product, "bold white"),
-        "\n",
-        ("◈ Progress: ", "bright_yellow"),
-        (f"{index + 1}/{total}", "bold cyan"),
-        " ",
-        (progress_bar, "bright_blue"),
-        "\n",
-        ("◈ Status: ", "bright_yellow"),
-        ("Analyzing market data...", "bright_green"),
-    )
-
-    return Panel(
-        content,
-        title=f"╭─ processing product {index + 1} ─╮",
-        title_align="center",
-        border_style="bright_green",
-        padding=(1, 2),
-    )
-
-
-def format_progress_message(message: str, tool_name: str = "") -> Panel:
-    """progress msg formatter"""
-
-    tool_styles = {
-        "web_search": ("🔍", "bright_blue", "Web Discovery"),
-        "visit_url": ("🌐", "bright_green", "Page Analysis"),
-        "screenshot": ("📸", "bright_magenta", "Visual Intelligence"),
-        "find_on_page": ("🎯", "bright_yellow", "Content Search"),
-        "page_down": ("⬇️", "bright_cyan", "Navigation"),
-        "page_up": ("⬆️", "bright_cyan", "Navigation"),
-        "find_next": ("🔄", "bright_yellow", "Search Continue"),
-        "product_pricer": ("💰", "bright_green", "Price Analysis"),
-    }
-
-    icon, color, label = tool_styles.get(tool_name, ("⚡", "white", "Processing"))
-
-    timestamp = time.time()
-    dots = "●" * (int(timestamp * 2) % 4) + "○" * (3 - (int(timestamp * 2) % 4))
-
-    content = Text.assemble(
-        (f"{icon} ", color),
-        (label, f"bold {color}"),
-        "\n",
-        ("▸ ", "dim"),
-        (message, "white"),
-        "\n",
-        ("  ", ""),
-        (dots, color),
-    )
-
-    return Panel(content, border_style=color, padding=(0, 1), width=80)
-
-
 def save_results(cum_json: List[dict], user_id: str, save_format: str):
     """Save results in chosen format"""
     user_folder = ensure_user_workspace(user_id)
@@ -143,6 +87,7 @@ def save_results(cum_json: List[dict], user_id: str, save_format: str):
 
         flattened_data = []
         summary_data = []
+        usage_data = []
 
         for item in cum_json:
             product = item["product"]
@@ -171,15 +116,41 @@ def save_results(cum_json: List[dict], user_id: str, save_format: str):
 
             best_price = f"{min(prices):.2f} €" if prices else "N/A"
 
-            summary_data.append(
-                {
-                    "Product": product,
-                    "Sites_Searched": total_sites,
-                    "Success_Rate": success_rate,
-                    "Best_Price_Found": best_price,
-                    "Available_At": successful_sites,
-                }
-            )
+            summary_row = {
+                "Product": product,
+                "Sites_Searched": total_sites,
+                "Success_Rate": success_rate,
+                "Best_Price_Found": best_price,
+                "Available_At": successful_sites,
+            }
+            usage = item.get("usage")
+            if usage:
+                summary_row.update(
+                    {
+                        "Model_Calls": usage["calls"],
+                        "Input_Tokens": usage["input_tokens"],
+                        "Cached_Tokens": usage["cached_tokens"],
+                        "Output_Tokens": usage["output_tokens"],
+                        "Image_Tokens": usage["image_tokens"],
+                        "Cost_USD": round(usage["cost_usd"], 4),
+                    }
+                )
+                for row in usage["breakdown"]:
+                    usage_data.append(
+                        {
+                            "Product": product,
+                            "Tool": row["tool"],
+                            "Website": row["site"],
+                            "Model_Calls": row["calls"],
+                            "Input_Tokens": row["input_tokens"],
+                            "Cached_Tokens": row["cached_tokens"],
+                            "Output_Tokens": row["output_tokens"],
+                            "Reasoning_Tokens": row["reasoning_tokens"],
+                            "Image_Tokens": row["image_tokens"],
+                            "Cost_USD": round(row["cost_usd"], 4),
+                        }
+                    )
+            summary_data.append(summary_row)
 
             for website, data in item["data"].items():
                 flattened_data.append(
@@ -207,6 +178,10 @@ def save_results(cum_json: List[dict], user_id: str, save_format: str):
             failed_df = detailed_df[detailed_df["Status"] == "fail"]
             failed_df.to_excel(writer, sheet_name="Failed_Searches", index=False)
 
+            if usage_data:
+                usage_df = pd.DataFrame(usage_data)
+                usage_df.to_excel(writer, sheet_name="Usage", index=False)
+
             for sheet_name in writer.sheets:
                 worksheet = writer.sheets[sheet_name]
                 for column in worksheet.columns:
@@ -224,6 +199,56 @@ def save_results(cum_json: List[dict], user_id: str, save_format: str):
         return fpath
 
 
+def create_results_table(product: str, result_data: dict) -> Table:
+    table = Table(
+        title=f"Results for {product}",
+        show_header=True,
+        header_style="bold cyan",
+    )
+    table.add_column("Website", style="bright_blue", width=30)
+    table.add_column("Status", justify="center", width=10)
+    table.add_column("Price", justify="right", style="bright_green", width=15)
+    table.add_column("Availability", style="bright_yellow", width=20)
+
+    for website, data in result_data.items():
+        status_style = "bright_green" if data["status"] == "success" else "bright_red"
+        status_icon = "✓" if data["status"] == "success" else "✗"
+
+        table.add_row(
+            website,
+            f"[{status_style}]{status_icon}[/{status_style}]",
+            data.get("price", "N/A"),
+            data.get("availability", "N/A"),
+        )
+    return table
+
+
+async def _synthesize_pending(
+    pending_notes: List[Tuple[int, ResearchNotes]],
+    cum_json: List[dict],
+    dashboard: ProgressDashboard,
+):
+    """structure the collected research notes (with their dashboard row) in batched
+    calls and print the results"""
+    if not pending_notes:
+        return
+    results = await synthesize([notes for _, notes in pending_notes])
+    for (row, notes), result_data in zip(pending_notes, results):
+        dashboard.site_results(row, result_data)
+        dashboard.finish_product(row, "done")
+        console.print()
+        console.print(create_results_table(notes.product, result_data))
+        console.print()
+        cum_json.append(
+            {
+                "product": notes.product,
+                "data": result_data,
+                "usage": notes.usage.summary() if notes.usage else None,
+            }
+        )
+    pending_notes.clear()
+
+
 async def _agent_entry_():
     user_id = "localUser"
     stream_id = "test_"
@@ -276,71 +301,52 @@ async def _agent_entry_():
 
     console.print()
 
+    log_path = os.path.join(
+        ensure_user_workspace(user_id),
+        f"progress_{time.strftime('%Y%m%d_%H%M%S')}.log",
+    )
     keyboard_listener.start_listening(user_id)
     cum_json: List[dict] = []
+    pending_notes: List[Tuple[int, ResearchNotes]] = []
+    run_metrics: List[dict] = []
 
     try:
-        for index, product in enumerate(products):
-            console.print(create_product_panel(product, index, len(products)))
-            console.print()
-
-            async for out in product_pricer_(
-                product=product,
-                websites=websites,
-                no_turns=no_turns,
-                creds=None,
-                user_id=user_id,
-                stream_id=stream_id,
-            ):
-                if not local_state.get_state(user_id):
-                    console.print(
-                        Panel(
-                            "◆ Process stopped by user",
-                            style="bold red",
-                            title="╭─ Stopped ─╮",
+        with ProgressDashboard(products, websites, log_path, console) as dashboard:
+            for row, product in enumerate(products):
+                dashboard.start_product(row)
+
+                async for out in product_pricer_(
+                    product=product,
+                    websites=websites,
+                    no_turns=no_turns,
+                    creds=None,
+                    user_id=user_id,
+                    stream_id=stream_id,
+                    defer_synthesis=True,
+                ):
+                    dashboard.handle(row, out)
+                    if out["type"] == "endOfMessage":
+                        dashboard.finish_product(row, "stopped")
+                        console.print(
+                            Panel(
+                                "◆ Process stopped by user",
+                                style="bold red",
+                                title="╭─ Stopped ─╮",
+                            )
                         )
-                    )
-                    break
-
-                if out["type"] == "tool_progress":
-                    tool_name = out.get("toolName", "")
-                    progress_panel = format_progress_message(out["progress"], tool_name)
-                    console.print(progress_panel)
-                else:
-                    result_data = json.loads(out["content"])
-
-                    table = Table(
-                        title=f"Results for {product}",
-                        show_header=True,
-                        header_style="bold cyan",
-                    )
-                    table.add_column("Website", style="bright_blue", width=30)
-                    table.add_column("Status", justify="center", width=10)
-                    table.add_column(
-                        "Price", justify="right", style="bright_green", width=15
-                    )
-                    table.add_column("Availability", style="bright_yellow", width=20)
+                        break
 
-                    for website, data in result_data.items():
-                        status_style = (
-                            "bright_green"
-                            if data["status"] == "success"
-                            else "bright_red"
-                        )
-                        status_icon = "✓" if data["status"] == "success" else "✗"
+                    if out["type"] == "research_notes":
+                        dashboard.finish_product(row, "researched")
+                        pending_notes.append((row, out["content"]))
+                        run_metrics.append(out["metrics"])
+                    elif out["type"] == "tool_result":
+                        dashboard.finish_product(row, "failed")
 
-                        table.add_row(
-                            website,
-                            f"[{status_style}]{status_icon}[/{status_style}]",
-                            data.get("price", "N/A"),
-                            data.get("availability", "N/A"),
-                        )
+                if len(pending_notes) >= SYNTHESIS_BATCH:
+                    await _synthesize_pending(pending_notes, cum_json, dashboard)
 
-                    console.print()
-                    console.print(table)
-                    console.print()
-
-                    cum_json.append({"product": product, "data": result_data})
+            await _synthesize_pending(pending_notes, cum_json, dashboard)
 
     except KeyboardInterrupt:
         console.print(Panel("◆ Process interrupted", style="bold red"))
@@ -350,9 +356,24 @@ async def _agent_entry_():
 
         if cum_json:
             saved_path = save_results(cum_json, user_id, save_format)
+            turns_used = sum(m["turns_used"] for m in run_metrics)
+            turns_saved = sum(m["turns_saved"] for m in run_metrics)
+            early_stops = sum(
+                1 for m in run_metrics if m["stop_reason"] == "all_sites_resolved"
+            )
+            cost = sum(item["usage"]["cost_usd"] for item in cum_json if item["usage"])
+            tokens = sum(
+                item["usage"]["input_tokens"] + item["usage"]["output_tokens"]
+                for item in cum_json
+                if item["usage"]
+            )
             console.print(
                 Panel(
-                    f"◆ Results saved to: {saved_path}",
+                    f"◆ Results saved to: {saved_path}\n"
+                    f"◆ Progress log: {log_path}\n"
+                    f"◆ Turns used: {turns_used}, saved: {turns_saved} "
+                    f"({early_stops}/{len(run_metrics)} products stopped once all sites were resolved)\n"
+                    f"◆ Tokens: {tokens:,.0f}, estimated cost: ${cost:.4f}",
                     style="bright_green",
                     title="╭─ Complete ─╮",
                 )
@@ -360,4 +381,4 @@ async def _agent_entry_():
 
 
 if __name__ == "__main__":
-    asyncio.run(_agent_entry_())
+    asyncio.run(closing_connections(_agent_entry_()))
@@ -0,0 +1,379 @@
+from classes.statemanager import local_state
+from synthesis_ import SYNTHESIS_BATCH, ResearchNotes, synthesize
+from product_pricer_ import product_pricer_
+from web_tools_ import closing_connections
+from agent_ import save_results
+from typing import Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import signal
+import json
+import time
+import csv
+import sys
+import os
+
+load_dotenv()
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_BAD_INPUT = 2
+EXIT_STOPPED = 130
+
+
+############################################################################################################
+## input
+
+
+def _split_sites(value) -> List[str]:
+    if isinstance(value, list):
+        return [str(w).strip() for w in value if str(w).strip()]
+    return [w.strip() for w in str(value or "").split("|") if w.strip()]
+
+
+def _read_rows(path: str) -> Iterator[Dict]:
+    """Rows of a CSV (header required), JSONL (objects or plain strings) or text file"""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        if ext == ".csv":
+            reader = csv.DictReader(fh)
+            first = (reader.fieldnames or [""])[0]
+            for row in reader:
+                row = {
+                    k.strip().lower(): (v or "").strip()
+                    for k, v in row.items()
+                    if k is not None  # values past the header
+                }
+                row.setdefault("", row.get(first.strip().lower(), ""))
+                yield row
+        elif ext in (".jsonl", ".ndjson"):
+            for line_no, line in enumerate(fh, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{line_no}: {e}")
+                yield item if isinstance(item, dict) else {"": item}
+        else:
+            for line in fh:
+                if line.strip() and not line.lstrip().startswith("#"):
+                    yield {"": line.strip()}
+
+
+def _pick(row: Dict, *names: str) -> str:
+    for name in names:
+        if row.get(name):
+            return str(row[name]).strip()
+    return str(row.get("", "")).strip()
+
+
+def _looks_like_path(value: str) -> bool:
+    value = value.strip()
+    return "|" not in value and (
+        value.lower().endswith((".csv", ".jsonl", ".ndjson", ".txt"))
+        or value.startswith(("./", "../", "~", os.sep))
+    )
+
+
+def load_sites(value: str) -> List[str]:
+    """Websites from a file (one per row) or from a ' | ' separated list"""
+    if not os.path.isfile(value):
+        if _looks_like_path(value):
+            raise FileNotFoundError(f"sites file not found: {value}")
+        return _split_sites(value)
+    return [
+        site
+        for site in (_pick(row, "website", "site", "url") for row in _read_rows(value))
+        if site
+    ]
+
+
+def load_jobs(path: str, default_sites: List[str]) -> List[Tuple[str, List[str]]]:
+    """(product, websites) pairs; a row may bring its own websites ('|' separated in CSV)"""
+    jobs = []
+    for row in _read_rows(path):
+        product = _pick(row, "product", "name", "sku")
+        if not product:
+            continue
+        sites = _split_sites(row.get("websites") or row.get("sites")) or default_sites
+        if not sites:
+            raise ValueError(f"no websites for product {product!r}")
+        jobs.append((product, sites))
+    return jobs
+
+
+def _read_results(output: str) -> Iterator[Dict]:
+    """Result lines of an output file, skipping ones that don't parse"""
+    if not os.path.isfile(output):
+        return
+    with open(output, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                item = json.loads(line)
+            except ValueError:  # half-written last line of a killed run
+                continue
+            if isinstance(item, dict):
+                yield item
+
+
+def _finished_products(output: str) -> set:
+    """Products that already have a result line in output (for --resume)"""
+    return {item["product"] for item in _read_results(output) if "data" in item}
+
+
+############################################################################################################
+## run
+
+
+class BatchRun:
+    """Prices (product, websites) jobs with `concurrency` runs at a time and appends
+    one JSON line per product to `output` as soon as it is synthesized"""
+
+    def __init__(
+        self,
+        jobs: List[Tuple[str, List[str]]],
+        output: str,
+        *,
+        no_turns: int,
+        concurrency: int,
+        user_id: str,
+        append: bool,
+    ):
+        self.jobs = jobs
+        self.output = output
+        self.no_turns = no_turns
+        self.concurrency = max(1, concurrency)
+        self.user_id = user_id
+        self.stopping = False
+        self.pending: List[Tuple[ResearchNotes, Dict]] = []
+        self.stats = {
+            "products": len(jobs),
+            "done": 0,
+            "failed": 0,
+            "sites_found": 0,
+            "sites_searched": 0,
+            "turns_used": 0,
+            "turns_saved": 0,
+            "tokens": 0,
+            "cost_usd": 0.0,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        self._fh = open(output, "a" if append else "w", encoding="utf-8")
+
+    def stop(self) -> None:
+        if self.stopping:  # second signal: don't wait for the runs to wind down
+            os._exit(EXIT_STOPPED)
+        print("[batch]: stopping, finishing started products...", file=sys.stderr)
+        self.stopping = True
+        local_state.stop_streaming(self.user_id)
+
+    def _write(self, item: Dict) -> None:
+        self._fh.write(json.dumps(item, ensure_ascii=False) + "\n")
+        self._fh.flush()
+
+    def _fail(self, product: str, error: str) -> None:
+        self.stats["failed"] += 1
+        self._write({"product": product, "error": error})
+        print(f"[batch]: ✗ {product}: {error}", file=sys.stderr)
+
+    async def _flush(self) -> None:
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        try:
+            results = await synthesize([notes for notes, _ in pending])
+        except Exception as e:
+            for notes, _ in pending:
+                self._fail(notes.product, f"synthesis failed: {e}")
+            return
+        for (notes, metrics), data in zip(pending, results):
+            found = sum(1 for site in data.values() if site.get("status") == "success")
+            self.stats["done"] += 1
+            self.stats["sites_found"] += found
+            self.stats["sites_searched"] += len(data)
+            self.stats["turns_used"] += metrics["turns_used"]
+            self.stats["turns_saved"] += metrics["turns_saved"]
+            usage = notes.usage.summary() if notes.usage else None
+            if usage:
+                self.stats["tokens"] += usage["input_tokens"] + usage["output_tokens"]
+                self.stats["cost_usd"] += usage["cost_usd"]
+            self._write(
+                {
+                    "product": notes.product,
+                    "data": data,
+                    "metrics": metrics,
+                    "usage": usage,
+                }
+            )
+            print(f"[batch]: ✓ {notes.product} ({found}/{len(data)} sites)")
+
+    async def _price(self, slot: int, product: str, websites: List[str]) -> None:
+        notes = None
+        try:
+            async for out in product_pricer_(
+                product=product,
+                websites=websites,
+                no_turns=self.no_turns,
+                creds=None,
+                user_id=self.user_id,
+                stream_id=f"batch{slot}",
+                defer_synthesis=True,
+            ):
+                # progress events are not rendered in batch mode
+                if out["type"] == "research_notes":
+                    notes = (out["content"], out["metrics"])
+                elif out["type"] == "endOfMessage":
+                    return
+                elif out["type"] == "tool_result":
+                    self._fail(product, out["result"])
+                    return
+        except Exception as e:
+            self._fail(product, str(e))
+            return
+        if notes:
+            self.pending.append(notes)
+            if len(self.pending) >= SYNTHESIS_BATCH:
+                await self._flush()
+
+    async def run(self) -> Dict:
+        jobs = iter(self.jobs)
+
+        async def worker(slot: int) -> None:
+            # the runs share one iterator; next() never awaits, so no lock is needed
+            for product, websites in jobs:
+                if self.stopping:
+                    return
+                await self._price(slot, product, websites)
+
+        started = time.time()
+        try:
+            await asyncio.gather(*(worker(slot) for slot in range(self.concurrency)))
+            await self._flush()
+        finally:
+            self._fh.close()
+        self.stats["stopped"] = self.stopping
+        self.stats["elapsed_s"] = round(time.time() - started, 1)
+        return self.stats
+
+
+############################################################################################################
+## entry
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Price products non-interactively (e.g. from cron).",
+    )
+    parser.add_argument(
+        "products",
+        help="CSV (column 'product', optional 'websites'), JSONL or text file, one product per row",
+    )
+    parser.add_argument(
+        "--sites",
+        default=os.getenv("BATCH_SITES", ""),
+        help="file with one website per row, or websites separated by ' | '",
+    )
+    parser.add_argument(
+        "-o", "--output", default=None, help="JSONL results file, written as it goes"
+    )
+    parser.add_argument(
+        "--turns", type=int, default=int(os.getenv("BATCH_TURNS", "10"))
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("BATCH_CONCURRENCY", "4")),
+        help="products priced at the same time",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="append to --output and skip products that already have a result",
+    )
+    parser.add_argument(
+        "--excel", action="store_true", help="also save an Excel report at the end"
+    )
+    parser.add_argument("--user-id", default="batchUser")
+    return parser.parse_args(argv)
+
+
+def _print_summary(stats: Dict, output: str) -> None:
+    print(
+        f"[batch]: {stats['done']}/{stats['products']} products done, "
+        f"{stats['failed']} failed, {stats.get('skipped', 0)} skipped"
+        + (" (stopped)" if stats.get("stopped") else "")
+    )
+    print(
+        f"[batch]: sites found {stats['sites_found']}/{stats['sites_searched']}, "
+        f"turns used {stats['turns_used']}, saved {stats['turns_saved']}, "
+        f"{stats.get('elapsed_s', 0)}s"
+    )
+    print(
+        f"[batch]: tokens {stats['tokens']:,.0f}, estimated cost ${stats['cost_usd']:.4f}"
+    )
+    print(f"[batch]: results in {output}")
+
+
+def _batch_entry_(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    output = args.output or os.path.join(
+        "workspace", args.user_id, f"batch_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+    )
+    try:
+        jobs = load_jobs(args.products, load_sites(args.sites))
+    except (OSError, ValueError) as e:
+        print(f"[batch]: bad input: {e}", file=sys.stderr)
+        return EXIT_BAD_INPUT
+    if not jobs:
+        print(f"[batch]: no products in {args.products}", file=sys.stderr)
+        return EXIT_BAD_INPUT
+
+    skipped = 0
+    if args.resume:
+        finished = _finished_products(output)
+        skipped = sum(1 for product, _ in jobs if product in finished)
+        jobs = [job for job in jobs if job[0] not in finished]
+
+    batch = BatchRun(
+        jobs,
+        output,
+        no_turns=args.turns,
+        concurrency=args.concurrency,
+        user_id=args.user_id,
+        append=args.resume,
+    )
+
+    async def main() -> Dict:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, batch.stop)
+        return await batch.run()
+
+    stats = asyncio.run(closing_connections(main()))
+    stats["skipped"] = skipped
+    _print_summary(stats, output)
+
+    if args.excel:
+        cum_json = [
+            {
+                "product": item["product"],
+                "data": item["data"],
+                "usage": item.get("usage"),
+            }
+            for item in _read_results(output)
+            if "data" in item
+        ]
+        if cum_json:
+            print(
+                f"[batch]: excel report in {save_results(cum_json, args.user_id, 'excel')}"
+            )
+
+    if stats["stopped"]:
+        return EXIT_STOPPED
+    return EXIT_FAILURES if stats["failed"] else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(_batch_entry_())
@@ -1,12 +1,16 @@
 from urllib.parse import parse_qs, quote, unquote, urlparse, urlunparse
 from youtube_transcript_api.formatters import SRTFormatter
 from youtube_transcript_api import YouTubeTranscriptApi
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from classes.cancellation import current_token
+from pdfminer.layout import LTTextContainer
+from pdfminer.pdfpage import PDFPage
 from models_ import model_call
 from bs4 import BeautifulSoup
 import pdfminer.high_level
 import pandas as pd
 import markdownify
+import openpyxl
 import subprocess
 import puremagic
 import mimetypes
@@ -33,11 +37,22 @@ class _CustomMarkdownify(markdownify.MarkdownConverter):
     - Removing javascript hyperlinks.
     - Truncating images with large data:uri sources.
     - Ensuring URIs are properly escaped, and do not conflict with Markdown syntax
+    - Optionally replacing inline hrefs with numbered references ([3]) collected in `links`
     """
 
     def __init__(self, **options: Any):
         options["heading_style"] = options.get("heading_style", markdownify.ATX)
+        options["compact_links"] = options.get("compact_links", False)
         super().__init__(**options)
+        self.links: List[str] = []
+        self._link_refs: Dict[str, int] = {}
+
+    def _link_ref(self, href: str) -> int:
+        """Return the 1-based reference number for href, registering it if new."""
+        if href not in self._link_refs:
+            self.links.append(href)
+            self._link_refs[href] = len(self.links)
+        return self._link_refs[href]
 
     def convert_hn(self, n: int, el: Any, text: str, convert_as_inline: bool) -> str:
         """Same as usual, but be sure to start with a new line"""
@@ -71,6 +86,9 @@ class _CustomMarkdownify(markdownify.MarkdownConverter):
             except ValueError:  # It's not clear if this ever gets thrown
                 return "%s%s%s" % (prefix, text, suffix)
 
+        if href and self.options["compact_links"]:
+            return "%s%s[%d]%s" % (prefix, text, self._link_ref(href), suffix)
+
         if (
             self.options["autolinks"]
             and text.replace(r"\_", "_") == href
@@ -117,11 +135,41 @@ class _CustomMarkdownify(markdownify.MarkdownConverter):
 
 
 class DocumentConverterResult:
-    """The result of converting a document to text."""
+    """The result of converting a document to text.
+
+    Lazy converters put the first part of the document in `text_content` and
+    leave the rest in `chunks`, an iterator converted on demand. They may also
+    provide `scan(predicate, start_chunk)`, returning the index of the first
+    chunk at or after start_chunk with a line matching predicate, without
+    rendering the chunks in between (text_content is chunk 0)."""
 
-    def __init__(self, title: Union[str, None] = None, text_content: str = ""):
+    def __init__(
+        self,
+        title: Union[str, None] = None,
+        text_content: str = "",
+        links: Optional[List[str]] = None,
+        chunks: Optional[Iterator[str]] = None,
+        scan: Optional[Callable[[Callable[[str], bool], int], Optional[int]]] = None,
+    ):
         self.title: Union[str, None] = title
         self.text_content: str = text_content
+        self.links: List[str] = links or []
+        self.chunks: Optional[Iterator[str]] = chunks
+        self.scan = scan
+
+    def materialize(self) -> str:
+        """Convert any remaining chunks into text_content."""
+        if self.chunks is not None:
+            token = current_token()
+            parts = [self.text_content]
+            try:
+                for chunk in self.chunks:
+                    token.raise_if_cancelled()
+                    parts.append(chunk)
+                self.chunks = None
+            finally:
+                self.text_content = "".join(parts)
+        return self.text_content
 
 
 class DocumentConverter:
@@ -186,11 +234,15 @@ class HtmlConverter(DocumentConverter):
 
         result = None
         with open(local_path, "rt", encoding="utf-8") as fh:
-            result = self._convert(fh.read())
+            result = self._convert(
+                fh.read(), compact_links=kwargs.get("compact_links", False)
+            )
 
         return result
 
-    def _convert(self, html_content: str) -> Union[None, DocumentConverterResult]:
+    def _convert(
+        self, html_content: str, compact_links: bool = False
+    ) -> Union[None, DocumentConverterResult]:
         """Helper function that converts and HTML string."""
 
         soup = BeautifulSoup(html_content, "html.parser")
@@ -198,18 +250,20 @@ class HtmlConverter(DocumentConverter):
         for script in soup(["script", "style"]):
             script.extract()
 
+        md = _CustomMarkdownify(compact_links=compact_links)
         body_elm = soup.find("body")
         webpage_text = ""
         if body_elm:
-            webpage_text = _CustomMarkdownify().convert_soup(body_elm)
+            webpage_text = md.convert_soup(body_elm)
         else:
-            webpage_text = _CustomMarkdownify().convert_soup(soup)
+            webpage_text = md.convert_soup(soup)
 
         assert isinstance(webpage_text, str)
 
         return DocumentConverterResult(
             title=None if soup.title is None else soup.title.string,
             text_content=webpage_text,
+            links=md.links,
         )
 
 
@@ -238,21 +292,21 @@ class WikipediaConverter(DocumentConverter):
 
         webpage_text = ""
         main_title = None if soup.title is None else soup.title.string
+        md = _CustomMarkdownify(compact_links=kwargs.get("compact_links", False))
 
         if body_elm:
             if title_elm and len(title_elm) > 0:
                 main_title = title_elm.string  # type: ignore
                 assert isinstance(main_title, str)
 
-            webpage_text = f"# {main_title}\n\n" + _CustomMarkdownify().convert_soup(
-                body_elm
-            )
+            webpage_text = f"# {main_title}\n\n" + md.convert_soup(body_elm)
         else:
-            webpage_text = _CustomMarkdownify().convert_soup(soup)
+            webpage_text = md.convert_soup(soup)
 
         return DocumentConverterResult(
             title=main_title,
             text_content=webpage_text,
+            links=md.links,
         )
 
 
@@ -380,16 +434,62 @@ class PdfConverter(DocumentConverter):
     Converts PDFs to Markdown. Most style information is ignored, so the results are essentially plain-text.
     """
 
+    def __init__(self, conversion_service: Any = None, pages_per_job: int = 5):
+        self._conversion_service = conversion_service
+        self._pages_per_job = pages_per_job
+
     def convert(self, local_path, **kwargs) -> Union[None, DocumentConverterResult]:
         extension = kwargs.get("file_extension", "")
         if extension.lower() != ".pdf":
             return None
 
+        if self._conversion_service is not None:
+            pages = self._iter_pages_pooled(local_path)
+        else:
+            pages = self._iter_pages(local_path)
         return DocumentConverterResult(
             title=None,
-            text_content=pdfminer.high_level.extract_text(local_path),
+            text_content=next(pages, ""),
+            chunks=pages,
         )
 
+    def _iter_pages(self, local_path) -> Iterator[str]:
+        """Text of one page at a time; pdfminer lays out each page only when it is requested."""
+        for page_layout in pdfminer.high_level.extract_pages(local_path):
+            yield "".join(
+                element.get_text()
+                for element in page_layout
+                if isinstance(element, LTTextContainer)
+            ) + "\f"
+
+    def _iter_pages_pooled(self, local_path) -> Iterator[str]:
+        """Batches of pages converted in the process pool, keeping one batch in flight ahead of the reader."""
+        with open(local_path, "rb") as fh:
+            page_count = sum(1 for _ in PDFPage.get_pages(fh))
+        batches = [
+            list(range(start, min(start + self._pages_per_job, page_count)))
+            for start in range(0, page_count, self._pages_per_job)
+        ]
+
+        service = self._conversion_service
+        pending = None
+        try:
+            for i, batch in enumerate(batches):
+                future = pending or service.submit(_pdf_pages_text, local_path, batch)
+                pending = None
+                if i + 1 < len(batches):
+                    pending = service.submit(_pdf_pages_text, local_path, batches[i + 1])
+                yield service.result(future)
+        finally:
+            # the reader left early (navigated away, browser evicted): free the worker
+            if pending is not None:
+                pending.abandon()
+
+
+def _pdf_pages_text(local_path: str, page_numbers: List[int]) -> str:
+    """Module-level so it can run in a worker process."""
+    return pdfminer.high_level.extract_text(local_path, page_numbers=page_numbers)
+
 
 class DocxConverter(HtmlConverter):
     """
@@ -410,9 +510,75 @@ class DocxConverter(HtmlConverter):
         return result
 
 
+class XlsxRowStream:
+    """
+    Streams an .xlsx workbook (openpyxl read-only mode) as Markdown table chunks of
+    `rows_per_chunk` rows, so huge catalogs are never loaded or rendered at once.
+    """
+
+    def __init__(self, local_path: str, rows_per_chunk: int = 100):
+        self.local_path = local_path
+        self.rows_per_chunk = rows_per_chunk
+
+    def _iter_row_batches(self) -> Iterator[Tuple[str, tuple, List[tuple], bool]]:
+        """(sheet title, header row, rows, first batch of the sheet)"""
+        workbook = openpyxl.load_workbook(
+            self.local_path, read_only=True, data_only=True
+        )
+        try:
+            for sheet in workbook.worksheets:
+                rows = sheet.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    continue
+                batch: List[tuple] = []
+                first = True
+                for row in rows:
+                    if all(cell is None for cell in row):
+                        continue
+                    batch.append(row)
+                    if len(batch) == self.rows_per_chunk:
+                        yield sheet.title, header, batch, first
+                        batch = []
+                        first = False
+                if batch or first:
+                    yield sheet.title, header, batch, first
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def _cells(row: tuple) -> List[str]:
+        return [
+            "" if cell is None else str(cell).replace("|", "\\|").replace("\n", " ")
+            for cell in row
+        ]
+
+    def chunks(self) -> Iterator[str]:
+        for title, header, rows, first in self._iter_row_batches():
+            header_cells = self._cells(header)
+            md_content = f"## {title}\n" if first else ""
+            md_content += "| " + " | ".join(header_cells) + " |\n"
+            md_content += "| " + " | ".join("---" for _ in header_cells) + " |\n"
+            for row in rows:
+                md_content += "| " + " | ".join(self._cells(row)) + " |\n"
+            yield md_content + "\n"
+
+    def scan(
+        self, predicate: Callable[[str], bool], start_chunk: int = 0
+    ) -> Optional[int]:
+        """Index of the first chunk from start_chunk with a row matching predicate, checked on raw cell values."""
+        for index, (_, _, rows, _) in enumerate(self._iter_row_batches()):
+            if index < start_chunk:
+                continue
+            if any(predicate(" | ".join(self._cells(row))) for row in rows):
+                return index
+        return None
+
+
 class XlsxConverter(HtmlConverter):
     """
     Converts XLSX files to Markdown, with each sheet presented as a separate Markdown table.
+    .xlsx workbooks are streamed lazily in row chunks; legacy .xls files are converted whole.
     """
 
     def convert(self, local_path, **kwargs) -> Union[None, DocumentConverterResult]:
@@ -420,6 +586,16 @@ class XlsxConverter(HtmlConverter):
         if extension.lower() not in [".xlsx", ".xls"]:
             return None
 
+        if extension.lower() == ".xlsx":
+            stream = XlsxRowStream(local_path)
+            chunks = stream.chunks()
+            return DocumentConverterResult(
+                title=None,
+                text_content=next(chunks, ""),
+                chunks=chunks,
+                scan=stream.scan,
+            )
+
         sheets = pd.read_excel(local_path, sheet_name=None)
         md_content = ""
         for s in sheets:
@@ -443,14 +619,20 @@ class PptxConverter(HtmlConverter):
         if extension.lower() != ".pptx":
             return None
 
-        md_content = ""
+        slides = self._iter_slides(pptx.Presentation(local_path))
+        return DocumentConverterResult(
+            title=None,
+            text_content=next(slides, ""),
+            chunks=slides,
+        )
 
-        presentation = pptx.Presentation(local_path)
+    def _iter_slides(self, presentation) -> Iterator[str]:
+        """Markdown of one slide at a time."""
         slide_num = 0
         for slide in presentation.slides:
             slide_num += 1
 
-            md_content += f"\n\n<!-- Slide number: {slide_num} -->\n"
+            md_content = f"<!-- Slide number: {slide_num} -->\n"
 
             title = slide.shapes.title
             for shape in slide.shapes:
@@ -502,10 +684,7 @@ class PptxConverter(HtmlConverter):
                     md_content += notes_frame.text
                 md_content = md_content.strip()
 
-        return DocumentConverterResult(
-            title=None,
-            text_content=md_content.strip(),
-        )
+            yield md_content if slide_num == 1 else "\n\n" + md_content
 
     def _is_picture(self, shape):
         if shape.shape_type == pptx.enum.shapes.MSO_SHAPE_TYPE.PICTURE:
@@ -607,10 +786,15 @@ class MarkdownConverter:
     """(In preview) An extremely simple text-based document reader, suitable for LLM use.
     This reader will convert common file-types or webpages to Markdown."""
 
+    # Converted whole in a worker process when a conversion service is configured
+    _POOLED_EXTENSIONS = {".docx", ".xls"}
+
     def __init__(
         self,
         requests_session: Optional[requests.Session] = None,
+        conversion_service: Any = None,
     ):
+        self._conversion_service = conversion_service
         if requests_session is None:
             self._requests_session = requests.Session()
         else:
@@ -620,7 +804,7 @@ class MarkdownConverter:
 
         # Register converters in order of specificity (most specific first)
         # Special format converters
-        self.register_page_converter(PdfConverter())
+        self.register_page_converter(PdfConverter(conversion_service))
         self.register_page_converter(DocxConverter())
         self.register_page_converter(XlsxConverter())
         self.register_page_converter(PptxConverter())
@@ -698,8 +882,9 @@ class MarkdownConverter:
             # Use puremagic to check for more extension options
             self._append_ext(extensions, self._guess_ext_magic(temp_path))
 
-            # Convert
+            # Convert (the temporary file is about to go away, so nothing can stay lazy)
             result = self._convert(temp_path, extensions, **kwargs)
+            result.materialize()
         # Clean up
         finally:
             try:
@@ -750,7 +935,9 @@ class MarkdownConverter:
         result = None
         try:
             # Download the file
+            token = current_token()
             for chunk in response.iter_content(chunk_size=512):
+                token.raise_if_cancelled()
                 fh.write(chunk)
             fh.close()
 
@@ -758,7 +945,13 @@ class MarkdownConverter:
             self._append_ext(extensions, self._guess_ext_magic(temp_path))
 
             # Convert
-            result = self._convert(temp_path, extensions, url=response.url)
+            result = self._convert(
+                temp_path,
+                extensions,
+                url=response.url,
+                compact_links=kwargs.get("compact_links", False),
+            )
+            result.materialize()
         except Exception as e:
             print(f"Error in converting: {e}")
 
@@ -775,6 +968,11 @@ class MarkdownConverter:
     def _convert(
         self, local_path: str, extensions: List[Union[str, None]], **kwargs
     ) -> DocumentConverterResult:
+        if self._conversion_service is not None and any(
+            ext and ext.lower() in self._POOLED_EXTENSIONS for ext in extensions
+        ):
+            return self._conversion_service.convert(local_path, extensions, **kwargs)
+
         error_trace = ""
         for ext in extensions + [None]:  # Try last with no extension
             for converter in self._page_converters:
@@ -797,10 +995,9 @@ class MarkdownConverter:
 
                 if res is not None:
                     # Normalize the content
-                    res.text_content = "\n".join(
-                        [line.rstrip() for line in re.split(r"\r?\n", res.text_content)]
-                    )
-                    res.text_content = re.sub(r"\n{3,}", "\n\n", res.text_content)
+                    res.text_content = self._normalize(res.text_content)
+                    if res.chunks is not None:
+                        res.chunks = (self._normalize(c) for c in res.chunks)
 
                     # Todo
                     return res
@@ -816,6 +1013,11 @@ class MarkdownConverter:
             f"Could not convert '{local_path}' to Markdown. The formats {extensions} are not supported."
         )
 
+    def _normalize(self, text: str) -> str:
+        """Strip trailing whitespace from lines and collapse runs of blank lines."""
+        text = "\n".join([line.rstrip() for line in re.split(r"\r?\n", text)])
+        return re.sub(r"\n{3,}", "\n\n", text)
+
     def _append_ext(self, extensions, ext):
         """Append a unique non-None, non-empty extension to a list of extensions."""
         if ext is None:
@@ -1,34 +1,190 @@
+from classes.conversion_service import conversion_service
+from classes.cancellation import current_token
+from classes.screenshot_client import ScreenshotClient
 from classes.simpletextbrowser import SimpleTextBrowser
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 from utils import ensure_user_workspace
+from collections import OrderedDict
+from contextlib import contextmanager
 from dotenv import load_dotenv
+import threading
+import json
+import time
 import os
 
 load_dotenv()
 
+BrowserKey = Union[str, Tuple[str, str]]
+EvictCallback = Callable[[BrowserKey, SimpleTextBrowser], None]
+
 
 class BrowserManager:
-    def __init__(self):
-        self.browsers = {}
-
-    def get_browser(self, user_id):
-        if user_id not in self.browsers:
-            default_request_kwargs = {
-                "timeout": (10, 10),
-                "headers": {
-                    "User-Agent": (
-                        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/120.0 Safari/537.36"
+    """LRU pool of browsers keyed by user (or user + stream), bounded by count, idle time and approximate memory"""
+
+    def __init__(
+        self,
+        max_browsers: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        max_memory_bytes: Optional[int] = None,
+        persist_history: Optional[bool] = None,
+    ):
+        self.browsers: "OrderedDict[BrowserKey, SimpleTextBrowser]" = OrderedDict()
+        self._last_used: Dict[BrowserKey, float] = {}
+        self.max_browsers = max_browsers or int(os.getenv("MAX_BROWSERS", "64"))
+        self.idle_ttl = idle_ttl or float(os.getenv("BROWSER_IDLE_TTL", "1800"))
+        self.max_memory_bytes = max_memory_bytes or int(
+            os.getenv("BROWSER_MEMORY_LIMIT", str(512 * 1024 * 1024))
+        )
+        self.persist_history = (
+            persist_history
+            if persist_history is not None
+            else os.getenv("PERSIST_BROWSER_HISTORY", "0") == "1"
+        )
+        self._evict_callbacks: List[EvictCallback] = []
+        self._lock = threading.RLock()
+        self.screenshot_client = ScreenshotClient(
+            token=os.getenv("BROWSERLESS_TOKEN"),
+            max_concurrency=int(os.getenv("SCREENSHOT_CONCURRENCY", "4")),
+        )
+
+    def on_evict(self, callback: EvictCallback) -> None:
+        """Register callback(key, browser) run whenever a browser is dropped"""
+        self._evict_callbacks.append(callback)
+
+    def get_browser(self, user_id, stream_id: Optional[str] = None):
+        """Browser for the user, or for one task of the user when stream_id is given.
+        Task browsers are forked from a live browser of the same user, so they
+        share cookies and caches but not history, viewport or find state."""
+        key = (user_id, stream_id) if stream_id else user_id
+        with self._lock:
+            self.evict_idle()
+            if key not in self.browsers:
+                sibling = next(
+                    (b for b in self.browsers.values() if b.user_id == user_id), None
+                )
+                self.browsers[key] = (
+                    sibling.fork() if sibling else self._new_browser(user_id)
+                )
+            self.browsers.move_to_end(key)
+            self._last_used[key] = time.monotonic()
+            self._enforce_limits(keep=key)
+            return self.browsers[key]
+
+    @contextmanager
+    def session(
+        self, user_id, stream_id: Optional[str] = None
+    ) -> Iterator[SimpleTextBrowser]:
+        """get_browser, held by one tool call at a time. A call abandoned at its
+        deadline keeps holding the browser until its thread has unwound, so the
+        next call waits for it instead of racing it on the same page state."""
+        browser = self.get_browser(user_id, stream_id)
+        token = current_token()
+        while not browser.lock.acquire(timeout=0.25):
+            token.raise_if_cancelled()
+        try:
+            yield browser
+        finally:
+            browser.lock.release()
+
+    def _new_browser(self, user_id) -> SimpleTextBrowser:
+        default_request_kwargs = {
+            "timeout": (10, 10),
+            "headers": {
+                "User-Agent": (
+                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                    "AppleWebKit/537.36 (KHTML, like Gecko) "
+                    "Chrome/120.0 Safari/537.36"
+                )
+            },
+        }
+        return SimpleTextBrowser(
+            start_page="about:blank",
+            viewport_size=1024 * 8,
+            viewport_tokens=int(os.getenv("VIEWPORT_TOKENS", "3000")),
+            compact_links=os.getenv("COMPACT_LINKS", "1") == "1",
+            downloads_folder=ensure_user_workspace(user_id),
+            serpapi_key=os.getenv("SERPAPI_KEY"),
+            browserless_token=os.getenv("BROWSERLESS_TOKEN"),
+            request_kwargs=default_request_kwargs,
+            user_id=user_id,
+            screenshot_client=self.screenshot_client,
+            conversion_service=(
+                conversion_service if os.getenv("CONVERSION_WORKERS") != "0" else None
+            ),
+        )
+
+    def evict(self, key: BrowserKey) -> None:
+        """Drop a browser, persisting its history first if enabled"""
+        with self._lock:
+            browser = self.browsers.pop(key, None)
+            self._last_used.pop(key, None)
+        if browser is None:
+            return
+        if self.persist_history:
+            self._persist_history(browser)
+        for callback in self._evict_callbacks:
+            try:
+                callback(key, browser)
+            except Exception as e:
+                print(f"[browser_manager]: evict callback failed: {e}")
+
+    def release(self, user_id, stream_id: Optional[str] = None) -> None:
+        """Drop the browser of a finished task; the user's own browser (no stream_id)
+        is shared with later tasks and left to the idle timeout"""
+        if stream_id:
+            self.evict((user_id, stream_id))
+
+    def _evictable(self, key: BrowserKey, now: float) -> bool:
+        """Not held by a tool call, and either a user's shared browser or the
+        browser of a task that has gone idle (running tasks release() theirs)"""
+        if self.browsers[key].lock.locked():
+            return False
+        return not isinstance(key, tuple) or now - self._last_used[key] > self.idle_ttl
+
+    def evict_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                key
+                for key, last_used in self._last_used.items()
+                if now - last_used > self.idle_ttl and self._evictable(key, now)
+            ]
+        for key in idle:
+            self.evict(key)
+
+    def _enforce_limits(self, keep) -> None:
+        """Evict least recently used browsers while over the count or memory limit.
+        Browsers of running tasks are never picked; when only those are left the
+        pool stays over the limit rather than pulling a page from under a run."""
+        with self._lock:
+            now = time.monotonic()
+            usage = self.memory_usage()
+            total = sum(usage.values())
+            count = len(self.browsers)
+            for key in list(self.browsers):
+                if count <= self.max_browsers and total <= self.max_memory_bytes:
+                    break
+                if key == keep or not self._evictable(key, now):
+                    continue
+                count -= 1
+                total -= usage.get(key, 0)
+                self.evict(key)
+
+    def memory_usage(self) -> Dict[BrowserKey, int]:
+        """Approximate bytes held per browser"""
+        with self._lock:
+            return {key: b.memory_usage() for key, b in self.browsers.items()}
+
+    def _persist_history(self, browser: SimpleTextBrowser) -> None:
+        fpath = os.path.join(browser.downloads_folder, "browser_history.jsonl")
+        try:
+            with open(fpath, "a", encoding="utf-8") as fh:
+                for url, visited_at in browser.history:
+                    fh.write(
+                        json.dumps(
+                            {"user_id": browser.user_id, "url": url, "time": visited_at}
+                        )
+                        + "\n"
                     )
-                },
-            }
-            self.browsers[user_id] = SimpleTextBrowser(
-                start_page="about:blank",
-                viewport_size=1024 * 8,
-                downloads_folder=ensure_user_workspace(user_id),
-                serpapi_key=os.getenv("SERPAPI_KEY"),
-                browserless_token=os.getenv("BROWSERLESS_TOKEN"),
-                request_kwargs=default_request_kwargs,
-                user_id=user_id,
-            )
-        return self.browsers[user_id]
+        except OSError as e:
+            print(f"[browser_manager]: could not persist history: {e}")
@@ -0,0 +1,89 @@
+from typing import Callable, List, Optional
+from contextvars import ContextVar
+import threading
+import time
+
+
+class ToolCancelled(BaseException):
+    """Raised inside a tool once its call was stopped or ran past its deadline"""
+
+
+class CancellationToken:
+    """Cooperative cancellation for one tool call. Blocking code checks it between
+    units of work (download chunks, converted pages) and registers callbacks that
+    unblock it (closing a response) when the call is cancelled."""
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[cancellation]: callback failed: {e}")
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.remaining() == 0:
+            self.cancel("deadline exceeded")
+        return self._event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline, None without one"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, default: float) -> float:
+        """`default` capped by the time left, for blocking calls that take a timeout"""
+        remaining = self.remaining()
+        return default if remaining is None else max(0.1, min(default, remaining))
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise ToolCancelled(self.reason)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run callback when cancelled (right away if already); returns an unregister function"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+_NEVER = CancellationToken()
+_current_token: ContextVar[CancellationToken] = ContextVar(
+    "cancellation_token", default=_NEVER
+)
+
+
+def current_token() -> CancellationToken:
+    """Token of the tool call running in this thread; one that never fires outside of tool calls"""
+    return _current_token.get()
+
+
+def run_with_token(token: CancellationToken, func: Callable, *args, **kwargs):
+    """Call func with token as the current token (used as the target of asyncio.to_thread)"""
+    handle = _current_token.set(token)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _current_token.reset(handle)
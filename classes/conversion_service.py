@@ -0,0 +1,237 @@
+from concurrent.futures import CancelledError, Future, TimeoutError
+from classes._md_convert import FileConversionException, MarkdownConverter
+from classes.cancellation import ToolCancelled, current_token
+from typing import Any, Callable, Dict, List, Optional
+import multiprocessing
+import threading
+import asyncio
+import queue
+import time
+import os
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _limit_memory(memory_limit_bytes: Optional[int]) -> None:
+    """Cap the worker's address space so one huge file can't take the host down"""
+    if resource is not None and memory_limit_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+
+
+# seconds a new worker may take to import the converters before its first job
+_WORKER_START_TIMEOUT = 60
+
+_worker_converter: Optional[MarkdownConverter] = None
+
+
+def _convert_in_worker(local_path: str, extensions: List[Optional[str]], kwargs: Dict):
+    """Runs inside a worker process: full (non-lazy) conversion of a local file"""
+    global _worker_converter
+    if _worker_converter is None:
+        _worker_converter = MarkdownConverter()
+    result = _worker_converter._convert(local_path, extensions, **kwargs)
+    result.materialize()
+    return result
+
+
+def _worker_main(conn, memory_limit_bytes: Optional[int]) -> None:
+    """Loop of one worker process: run (fn, args) jobs received over conn"""
+    _limit_memory(memory_limit_bytes)
+    conn.send(None)  # ready: imports done, jobs' deadlines can start
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        fn, args = job
+        try:
+            conn.send((True, fn(*args)))
+        except BaseException as e:
+            try:
+                conn.send((False, e))
+            except Exception:  # exception that doesn't pickle
+                conn.send((False, FileConversionException(f"{type(e).__name__}: {e}")))
+
+
+class _Job(Future):
+    """Future of one conversion job; abandon() stops it even while it runs"""
+
+    def __init__(self, fn: Callable, args: tuple, timeout: float):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.timeout = timeout
+        self.abandoned = threading.Event()
+
+    def abandon(self) -> None:
+        if not self.cancel():
+            self.abandoned.set()
+
+
+class _Worker:
+    """One worker process and the thread that feeds it jobs. The thread owns the
+    process, so an overdue or abandoned job costs only this worker a restart."""
+
+    def __init__(self, service: "ConversionService"):
+        self.service = service
+        self.process = None
+        self.conn = None
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _start_process(self) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.service.memory_limit_bytes),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        if not self.conn.poll(_WORKER_START_TIMEOUT):
+            self._kill_process()
+            raise FileConversionException("Conversion worker failed to start.")
+        self.conn.recv()
+
+    def _kill_process(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(timeout=5)
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def _loop(self) -> None:
+        while True:
+            job = self.service._jobs.get()
+            if job is None:
+                self._kill_process()
+                return
+            if not job.set_running_or_notify_cancel():
+                continue
+            try:
+                ok, value = self._run(job)
+            except BaseException as e:
+                ok, value = False, e
+            if ok:
+                job.set_result(value)
+            else:
+                job.set_exception(value)
+
+    def _run(self, job: _Job):
+        if self.process is None or not self.process.is_alive():
+            self._kill_process()
+            self._start_process()
+        self.conn.send((job.fn, job.args))
+        # the deadline starts now that the job runs, not when it was queued
+        deadline = time.monotonic() + job.timeout
+        while not self.conn.poll(min(0.25, max(0.0, deadline - time.monotonic()))):
+            if job.abandoned.is_set():
+                self._kill_process()
+                return False, ToolCancelled("conversion abandoned")
+            if time.monotonic() >= deadline or not self.process.is_alive():
+                overdue = self.process.is_alive()
+                self._kill_process()
+                if overdue:
+                    return False, FileConversionException(
+                        f"Conversion timed out after {job.timeout} seconds."
+                    )
+                return False, FileConversionException("Conversion worker died.")
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self._kill_process()
+            return False, FileConversionException("Conversion worker died.")
+
+
+class ConversionService:
+    """Worker processes for CPU-bound document conversion (PDF, DOCX, XLS) so it
+    doesn't hold the GIL of the process running the agents. Jobs beyond
+    `max_workers + max_pending` wait for a slot; every worker has a memory cap.
+    A job's timeout counts from when a worker starts it; an overdue job (or one
+    whose tool call was cancelled) is stopped by restarting only its worker."""
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        job_timeout: Optional[float] = None,
+        memory_limit_mb: Optional[int] = None,
+    ):
+        self.max_workers = max_workers or int(
+            os.getenv("CONVERSION_WORKERS", str(min(4, os.cpu_count() or 1)))
+        )
+        self.max_pending = max_pending or int(os.getenv("CONVERSION_QUEUE", "16"))
+        self.job_timeout = job_timeout or float(os.getenv("CONVERSION_TIMEOUT", "120"))
+        self.memory_limit_bytes = (
+            memory_limit_mb or int(os.getenv("CONVERSION_MEMORY_MB", "1024"))
+        ) * (1024 * 1024)
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._jobs: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+
+    def _start_workers(self) -> None:
+        # started lazily; each worker spawns its process on its first job
+        with self._lock:
+            while len(self._workers) < self.max_workers:
+                self._workers.append(_Worker(self))
+
+    def submit(self, fn: Callable, *args: Any, timeout: Optional[float] = None) -> _Job:
+        """Queue a job, waiting up to job_timeout for a free slot"""
+        if not self._slots.acquire(timeout=self.job_timeout):
+            raise FileConversionException("Conversion queue is full, try again later.")
+        self._start_workers()
+        job = _Job(fn, args, timeout or self.job_timeout)
+        job.add_done_callback(lambda _: self._slots.release())
+        self._jobs.put(job)
+        return job
+
+    def result(self, future: _Job) -> Any:
+        """Wait for a job. The wait also ends when the calling tool call is cancelled:
+        the job is dropped if it hasn't started, otherwise its worker is restarted."""
+        token = current_token()
+        unregister = token.on_cancel(future.abandon)
+        try:
+            while True:
+                try:
+                    return future.result(timeout=0.25)
+                except TimeoutError:
+                    token.raise_if_cancelled()
+        except CancelledError:
+            raise ToolCancelled(token.reason)
+        finally:
+            unregister()
+
+    def run(self, fn: Callable, *args: Any, timeout: Optional[float] = None) -> Any:
+        return self.result(self.submit(fn, *args, timeout=timeout))
+
+    async def run_async(
+        self, fn: Callable, *args: Any, timeout: Optional[float] = None
+    ) -> Any:
+        future = await asyncio.to_thread(self.submit, fn, *args, timeout=timeout)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.abandon()
+            raise
+
+    def convert(self, local_path: str, extensions: List[Optional[str]], **kwargs: Any):
+        return self.run(_convert_in_worker, local_path, extensions, kwargs)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._jobs.put(None)
+        for worker in workers:
+            worker.thread.join(timeout=10)
+
+
+conversion_service = ConversionService()
@@ -0,0 +1,286 @@
+from classes.findings_store import SiteFindings
+from rich.console import Console, Group
+from rich.table import Table
+from rich.live import Live
+from rich.text import Text
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+import threading
+import json
+import time
+import os
+
+load_dotenv()
+
+DASHBOARD_REFRESH = float(os.getenv("DASHBOARD_REFRESH", "4"))
+DASHBOARD_ROWS = int(os.getenv("DASHBOARD_ROWS", "20"))
+
+# tools whose `url` argument tells which site the agent is working on
+_SITE_TOOLS = ("visit_url", "screenshot")
+
+
+def _one_line(text: str, width: int = 60) -> str:
+    line = " ".join(str(text).split())
+    return line if len(line) <= width else line[: width - 1] + "…"
+
+
+class _SiteProgress:
+    __slots__ = ("calls", "status", "price")
+
+    def __init__(self):
+        self.calls = 0
+        self.status = "pending"
+        self.price = ""
+
+
+class _ProductProgress:
+    def __init__(self, product: str, websites: List[str]):
+        self.product = product
+        self.status = "queued"
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.turns = 0
+        self.tool_calls = 0
+        self.last_action = ""
+        self.current_site: Optional[str] = None
+        self.finder = SiteFindings(websites)
+        self.sites: Dict[str, _SiteProgress] = {w: _SiteProgress() for w in websites}
+
+    def elapsed(self) -> str:
+        if self.started is None:
+            return ""
+        return f"{(self.finished or time.time()) - self.started:.0f}s"
+
+
+class ProgressDashboard:
+    """Live console view of the product runs: one row per entry of `products`
+    (addressed by its index, so a product listed twice keeps two rows) with
+    per-site state, refreshed at most `refresh_per_second` times. Events only
+    update counters; every event is written in full to the log file."""
+
+    def __init__(
+        self,
+        products: List[str],
+        websites: List[str],
+        log_path: str,
+        console: Optional[Console] = None,
+        refresh_per_second: float = DASHBOARD_REFRESH,
+    ):
+        self.console = console or Console()
+        self.log_path = log_path
+        self.refresh_per_second = refresh_per_second
+        self.rows: List[_ProductProgress] = [
+            _ProductProgress(product, websites) for product in products
+        ]
+        self._lock = threading.Lock()
+        self._live: Optional[Live] = None
+        self._log = None
+
+    def __enter__(self) -> "ProgressDashboard":
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        self._live = Live(
+            self,
+            console=self.console,
+            refresh_per_second=self.refresh_per_second,
+            redirect_stdout=True,
+            redirect_stderr=True,
+        )
+        self._live.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._live.stop()
+        self._log.close()
+
+    def log(self, row: int, kind: str, message: str) -> None:
+        if self._log is None:
+            return
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        product = self.rows[row].product
+        self._log.write(f"{stamp} [{row + 1}: {product}] {kind}: {message}\n")
+        self._log.flush()
+
+    ############################################################################################################
+    ## updates
+
+    def start_product(self, row: int) -> None:
+        with self._lock:
+            progress = self.rows[row]
+            progress.status = "running"
+            progress.started = time.time()
+        self.log(row, "start", "")
+
+    def finish_product(self, row: int, status: str) -> None:
+        """status: 'researched', 'done', 'stopped' or 'failed'"""
+        with self._lock:
+            progress = self.rows[row]
+            progress.status = status
+            progress.current_site = None
+            if progress.finished is None or status == "done":
+                progress.finished = time.time()
+        self.log(row, status, "")
+
+    def site_results(self, row: int, data: Dict[str, Dict]) -> None:
+        """Per-site outcome from synthesis, for the sites the agent didn't record itself"""
+        with self._lock:
+            progress = self.rows[row]
+            for website, result in data.items():
+                site = progress.sites.setdefault(website, _SiteProgress())
+                site.status = (
+                    "found" if result.get("status") == "success" else "not found"
+                )
+                site.price = result.get("price", "") or ""
+
+    def handle(self, row: int, event: Dict) -> None:
+        """Aggregate one product_pricer_ event"""
+        tool_name = event.get("toolName", "")
+        message = event.get("progress") or event.get("result") or ""
+        args = event.get("args")
+        self.log(
+            row,
+            tool_name or event.get("type", ""),
+            message + (f" {args}" if args else ""),
+        )
+        if event.get("type") != "tool_progress":
+            return
+
+        try:
+            args = json.loads(args) if args else {}
+        except ValueError:
+            args = {}
+        with self._lock:
+            progress = self.rows[row]
+            if tool_name == "product_pricer" and "content" in event:
+                progress.turns += 1
+                progress.last_action = "thinking: " + _one_line(event["content"])
+                return
+            if "args" not in event:  # progress of a running tool
+                progress.last_action = f"{tool_name}: " + _one_line(message)
+                return
+
+            progress.tool_calls += 1
+            if tool_name == "record_finding":
+                listed = progress.finder.match(args.get("website", ""))
+                if listed:
+                    site = progress.sites[listed]
+                    site.status = (
+                        "found" if args.get("price", "").strip() else "not found"
+                    )
+                    site.price = args.get("price", "").strip()
+                progress.last_action = f"recorded {args.get('website', '')}"
+                return
+            if tool_name in _SITE_TOOLS and args.get("url"):
+                listed = progress.finder.match(args["url"])
+                if listed:
+                    progress.current_site = listed
+            if progress.current_site:
+                site = progress.sites[progress.current_site]
+                site.calls += 1
+                if site.status == "pending":
+                    site.status = "searching"
+            detail = args.get("url") or args.get("query") or args.get("product") or ""
+            progress.last_action = f"{tool_name} " + _one_line(detail, 50)
+
+    ############################################################################################################
+    ## rendering
+
+    _STATUS_STYLES = {
+        "queued": "dim",
+        "running": "bright_cyan",
+        "researched": "bright_yellow",
+        "done": "bright_green",
+        "stopped": "bright_red",
+        "failed": "bright_red",
+    }
+    _SITE_ICONS = {
+        "pending": ("·", "dim"),
+        "searching": ("…", "bright_cyan"),
+        "found": ("✓", "bright_green"),
+        "not found": ("✗", "bright_red"),
+    }
+
+    def _site_cell(self, progress: _ProductProgress) -> Text:
+        text = Text()
+        for website, site in progress.sites.items():
+            icon, style = self._SITE_ICONS[site.status]
+            if website == progress.current_site:
+                style = "bold " + style
+            text.append(f"{icon} ", style=style)
+        return text
+
+    def _products_table(self) -> Table:
+        table = Table(show_header=True, header_style="bold cyan", expand=True)
+        table.add_column("Product", style="bold white", ratio=3, no_wrap=True)
+        table.add_column("Status", width=11)
+        table.add_column("Sites", ratio=2, no_wrap=True)
+        table.add_column("Turns", justify="right", width=5)
+        table.add_column("Tools", justify="right", width=5)
+        table.add_column("Time", justify="right", width=6)
+        table.add_column("Last action", ratio=4, no_wrap=True, style="dim")
+        # running products first, then the latest finished ones, then the queue
+        rows = sorted(
+            self.rows,
+            key=lambda progress: (
+                progress.status != "running",
+                progress.status == "queued",
+                -(progress.finished or 0),
+            ),
+        )
+        for progress in rows[:DASHBOARD_ROWS]:
+            table.add_row(
+                progress.product,
+                Text(progress.status, style=self._STATUS_STYLES[progress.status]),
+                self._site_cell(progress),
+                str(progress.turns or ""),
+                str(progress.tool_calls or ""),
+                progress.elapsed(),
+                progress.last_action,
+            )
+        if len(rows) > DASHBOARD_ROWS:
+            table.add_row(Text(f"… {len(rows) - DASHBOARD_ROWS} more", style="dim"))
+        return table
+
+    def _sites_table(self, progress: _ProductProgress) -> Table:
+        table = Table(
+            title=f"▸ {progress.product}",
+            title_justify="left",
+            show_header=True,
+            expand=True,
+        )
+        table.add_column("Website", style="bright_blue", ratio=3, no_wrap=True)
+        table.add_column("State", width=10)
+        table.add_column("Calls", justify="right", width=5)
+        table.add_column("Price", justify="right", style="bright_green", ratio=1)
+        for website, site in progress.sites.items():
+            icon, style = self._SITE_ICONS[site.status]
+            table.add_row(
+                website,
+                Text(f"{icon} {site.status}", style=style),
+                str(site.calls or ""),
+                site.price,
+            )
+        return table
+
+    def __rich__(self) -> Group:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for progress in self.rows:
+                counts[progress.status] = counts.get(progress.status, 0) + 1
+            header = Text.assemble(
+                ("◈ ", "bright_yellow"),
+                (f"{counts.get('done', 0)}/{len(self.rows)} done", "bold"),
+                "  ",
+                *(
+                    (f"{status}: {count}  ", self._STATUS_STYLES[status])
+                    for status, count in counts.items()
+                    if status != "done"
+                ),
+                (f"log: {self.log_path}", "dim"),
+            )
+            parts = [header, self._products_table()]
+            parts.extend(
+                self._sites_table(progress)
+                for progress in self.rows
+                if progress.status == "running"
+            )
+            return Group(*parts)
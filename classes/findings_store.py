@@ -0,0 +1,79 @@
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import threading
+
+StoreKey = Tuple[str, Optional[str]]
+
+
+def site_host(website: str) -> str:
+    """'https://www.shop.at/de/' / 'shop.at' -> 'shop.at'"""
+    website = website.strip().lower()
+    netloc = urlparse(website if "//" in website else "//" + website).netloc
+    return netloc.removeprefix("www.")
+
+
+class SiteFindings:
+    """What the agent recorded for the websites of one product run"""
+
+    def __init__(self, websites: List[str]):
+        self.websites = list(websites)
+        self._hosts = {site_host(w): w for w in self.websites}
+        self.results: Dict[str, Dict[str, str]] = {}
+
+    def match(self, website: str) -> Optional[str]:
+        """The expected website that `website` (url, host or as listed) refers to"""
+        if website in self.websites:
+            return website
+        host = site_host(website)
+        if host in self._hosts:
+            return self._hosts[host]
+        # subdomain of a listed site, or the bare domain of a listed subdomain
+        related = [
+            listed
+            for known, listed in self._hosts.items()
+            if host.endswith("." + known) or known.endswith("." + host)
+        ]
+        return related[0] if len(related) == 1 else None
+
+    def missing(self) -> List[str]:
+        return [w for w in self.websites if w not in self.results]
+
+
+class FindingsStore:
+    """Per-site findings recorded through the record_finding tool, keyed by (user, stream)"""
+
+    def __init__(self):
+        self._runs: Dict[StoreKey, SiteFindings] = {}
+        self._lock = threading.Lock()
+
+    def start(self, user_id: str, stream_id: Optional[str], websites: List[str]):
+        with self._lock:
+            self._runs[(user_id, stream_id)] = SiteFindings(websites)
+
+    def get(self, user_id: str, stream_id: Optional[str]) -> Optional[SiteFindings]:
+        with self._lock:
+            return self._runs.get((user_id, stream_id))
+
+    def record(
+        self,
+        user_id: str,
+        stream_id: Optional[str],
+        website: str,
+        finding: Dict[str, str],
+    ) -> Optional[str]:
+        """Store the finding; returns the website it was filed under, None if unknown"""
+        with self._lock:
+            run = self._runs.get((user_id, stream_id))
+            if run is None:
+                return None
+            listed = run.match(website)
+            if listed is not None:
+                run.results[listed] = finding
+            return listed
+
+    def pop(self, user_id: str, stream_id: Optional[str]) -> Optional[SiteFindings]:
+        with self._lock:
+            return self._runs.pop((user_id, stream_id), None)
+
+
+findings_store = FindingsStore()
@@ -0,0 +1,92 @@
+from typing import Deque, Dict, Iterator, Optional, Tuple, Union
+from collections import deque
+
+
+class Visit:
+    """One history entry; unpacks like the old (url, time) tuple"""
+
+    __slots__ = ("url", "time")
+
+    def __init__(self, url: str, time: float):
+        self.url = url
+        self.time = time
+
+    def __iter__(self):
+        yield self.url
+        yield self.time
+
+    def __getitem__(self, index: int):
+        return (self.url, self.time)[index]
+
+    def __repr__(self) -> str:
+        return f"Visit({self.url!r}, {self.time})"
+
+
+class _UrlIndexEntry:
+    __slots__ = ("last", "previous", "count")
+
+    def __init__(self):
+        self.last: Optional[float] = None
+        self.previous: Optional[float] = None
+        self.count = 0
+
+
+class BrowserHistory:
+    """Ring buffer of the last `maxlen` visits plus a url -> last-visit index,
+    so "previously visited" lookups are O(1) instead of a backwards scan."""
+
+    def __init__(self, maxlen: int = 1000):
+        self._visits: Deque[Visit] = deque(maxlen=maxlen)
+        self._index: Dict[str, _UrlIndexEntry] = {}
+
+    def append(self, visit: Union[Visit, Tuple[str, float]]) -> None:
+        if not isinstance(visit, Visit):
+            visit = Visit(*visit)
+
+        if len(self._visits) == self._visits.maxlen:
+            dropped = self._visits[0]
+            entry = self._index[dropped.url]
+            entry.count -= 1
+            if entry.count == 0:
+                del self._index[dropped.url]
+
+        self._visits.append(visit)
+        entry = self._index.setdefault(visit.url, _UrlIndexEntry())
+        entry.previous, entry.last = entry.last, visit.time
+        entry.count += 1
+
+    @property
+    def maxlen(self) -> int:
+        return self._visits.maxlen
+
+    def last_visit(self, url: str) -> Optional[float]:
+        """Time of the most recent visit to url"""
+        entry = self._index.get(url)
+        return entry.last if entry else None
+
+    def previous_visit(self, url: str) -> Optional[float]:
+        """Time of the visit to url before the most recent one"""
+        entry = self._index.get(url)
+        return entry.previous if entry else None
+
+    def __len__(self) -> int:
+        return len(self._visits)
+
+    def __getitem__(self, index: int) -> Visit:
+        return self._visits[index]
+
+    def __iter__(self) -> Iterator[Visit]:
+        return iter(self._visits)
+
+    def pop(self) -> Visit:
+        """Remove the latest visit (a navigation that didn't complete)"""
+        visit = self._visits.pop()
+        entry = self._index[visit.url]
+        entry.count -= 1
+        if entry.count == 0:
+            del self._index[visit.url]
+            return visit
+        times = (v.time for v in reversed(self._visits) if v.url == visit.url)
+        entry.last = next(times, None)
+        entry.previous = next(times, None)
+        return visit
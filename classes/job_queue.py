@@ -0,0 +1,295 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from classes.redis_state import redis_client
+import json
+import time
+import uuid
+
+
+class Job:
+    """One leased (product, website) job"""
+
+    __slots__ = ("id", "payload", "attempts", "lease_token")
+
+    def __init__(
+        self, id: str, payload: Dict[str, Any], attempts: int, lease_token: str
+    ):
+        self.id = id
+        self.payload = payload
+        self.attempts = attempts
+        self.lease_token = lease_token
+
+    def __repr__(self) -> str:
+        return f"Job({self.id!r}, {self.payload!r}, attempts={self.attempts})"
+
+
+class RedisJobQueue:
+    """Work queue of pricing jobs shared by any number of workers.
+
+    Keys (under `name`):
+      :pending     list of job ids waiting for a worker
+      :processing  list of leased job ids (moved there atomically by lease())
+      :leases      zset job id -> lease expiry
+      :job:<id>    hash with payload, attempts, lease token and last error
+      :results     hash job id -> result json (also published on :results)
+      :dead        list of job ids that failed max_attempts times
+
+    A job whose lease runs out (worker crashed or hung) goes back to pending
+    on a later lease()/requeue_expired() call, until max_attempts is reached.
+    Ownership checks and the writes that depend on them run in one WATCH/MULTI
+    transaction, so a worker whose lease expired can't complete or fail the job
+    after another worker took it over."""
+
+    def __init__(
+        self,
+        client: Any = None,
+        name: str = "pricer:jobs",
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+    ):
+        self.client = client or redis_client()
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.requeue_interval = max(1.0, lease_seconds / 10)
+        self._next_requeue = 0.0
+        self._next_orphan_sweep = 0.0
+        self.pending_key = f"{name}:pending"
+        self.processing_key = f"{name}:processing"
+        self.leases_key = f"{name}:leases"
+        self.results_key = f"{name}:results"
+        self.dead_key = f"{name}:dead"
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.name}:job:{job_id}"
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        return self.enqueue_many([payload])[0]
+
+    def enqueue_many(self, payloads: Iterable[Dict[str, Any]]) -> List[str]:
+        job_ids = []
+        pipe = self.client.pipeline()
+        for payload in payloads:
+            job_id = uuid.uuid4().hex
+            pipe.hset(
+                self._job_key(job_id),
+                mapping={"payload": json.dumps(payload), "attempts": 0},
+            )
+            pipe.lpush(self.pending_key, job_id)
+            job_ids.append(job_id)
+        pipe.execute()
+        return job_ids
+
+    def enqueue_products(
+        self, products: List[str], websites: List[str], **options: Any
+    ) -> List[str]:
+        """One job per (product, website) pair; options (e.g. no_turns) go into every payload"""
+        return self.enqueue_many(
+            {"product": product, "website": website, **options}
+            for product in products
+            for website in websites
+        )
+
+    def lease(self, timeout: float = 0) -> Optional[Job]:
+        """Take the oldest pending job for lease_seconds; waits up to `timeout` seconds for one"""
+        if time.monotonic() >= self._next_requeue:
+            self.requeue_expired()
+        if timeout:
+            job_id = self.client.blmove(
+                self.pending_key, self.processing_key, timeout, "RIGHT", "LEFT"
+            )
+        else:
+            job_id = self.client.lmove(
+                self.pending_key, self.processing_key, "RIGHT", "LEFT"
+            )
+        if job_id is None:
+            return None
+
+        lease_token = uuid.uuid4().hex
+        pipe = self.client.pipeline()
+        pipe.zadd(self.leases_key, {job_id: time.time() + self.lease_seconds})
+        pipe.hincrby(self._job_key(job_id), "attempts", 1)
+        pipe.hset(self._job_key(job_id), "lease_token", lease_token)
+        pipe.hget(self._job_key(job_id), "payload")
+        _, attempts, _, payload = pipe.execute()
+        return Job(job_id, json.loads(payload), int(attempts), lease_token)
+
+    def _if_owned(self, job: Job, write: Callable[[Any], None]) -> bool:
+        """Queue write(pipe) in one MULTI, only while `job` still holds its lease.
+        WATCH on the job hash makes the ownership check and the writes atomic: a
+        release or re-lease by someone else in between aborts and re-checks."""
+
+        def attempt(pipe) -> bool:
+            if pipe.hget(self._job_key(job.id), "lease_token") != job.lease_token:
+                return False
+            pipe.multi()
+            write(pipe)
+            return True
+
+        return self.client.transaction(
+            attempt, self._job_key(job.id), value_from_callable=True
+        )
+
+    def extend(self, job: Job) -> bool:
+        """Renew the lease of a job that is still being worked on"""
+        return self._if_owned(
+            job,
+            lambda pipe: pipe.zadd(
+                self.leases_key, {job.id: time.time() + self.lease_seconds}, xx=True
+            ),
+        )
+
+    def complete(self, job: Job, result: Dict[str, Any]) -> bool:
+        """Store and publish the result; False if the lease was lost to another worker"""
+        data = json.dumps({"job_id": job.id, "payload": job.payload, "result": result})
+
+        def write(pipe) -> None:
+            pipe.hset(self.results_key, job.id, data)
+            pipe.lrem(self.processing_key, 1, job.id)
+            pipe.zrem(self.leases_key, job.id)
+            pipe.hdel(self._job_key(job.id), "lease_token")
+            pipe.publish(self.results_key, data)
+
+        return self._if_owned(job, write)
+
+    def fail(self, job: Job, error: str) -> bool:
+        """Give the job back for a retry, or dead-letter it after max_attempts"""
+        return self._if_owned(
+            job, lambda pipe: self._release(pipe, job.id, job.attempts, error)
+        )
+
+    def release(self, job: Job) -> bool:
+        """Hand an unfinished job back (its worker was stopped) at the front of the
+        queue; unlike fail() this doesn't count as an attempt"""
+
+        def write(pipe) -> None:
+            pipe.lrem(self.processing_key, 1, job.id)
+            pipe.zrem(self.leases_key, job.id)
+            pipe.hincrby(self._job_key(job.id), "attempts", -1)
+            pipe.hdel(self._job_key(job.id), "lease_token")
+            pipe.rpush(self.pending_key, job.id)
+
+        return self._if_owned(job, write)
+
+    def _release(self, pipe, job_id: str, attempts: int, error: str) -> None:
+        pipe.lrem(self.processing_key, 1, job_id)
+        pipe.zrem(self.leases_key, job_id)
+        pipe.hset(self._job_key(job_id), "error", error)
+        pipe.hdel(self._job_key(job_id), "lease_token")
+        if attempts >= self.max_attempts:
+            pipe.hset(self._job_key(job_id), "dead", 1)
+            pipe.lpush(self.dead_key, job_id)
+        else:
+            pipe.lpush(self.pending_key, job_id)
+
+    def requeue_expired(self) -> int:
+        """Release jobs whose lease ran out; returns how many.
+        lease() calls this at most every requeue_interval seconds; the expired leases
+        come from one range query, the scan for lease-less jobs runs once per lease_seconds.
+        """
+        now = time.time()
+        self._next_requeue = time.monotonic() + self.requeue_interval
+        if time.monotonic() >= self._next_orphan_sweep:
+            self._next_orphan_sweep = time.monotonic() + self.lease_seconds
+            self._lease_orphans(now)
+
+        expired = self.client.zrangebyscore(self.leases_key, 0, now)
+        released = 0
+        for job_id in expired:
+            job_key = self._job_key(job_id)
+
+            def release(pipe) -> bool:
+                # re-check under WATCH: the job may have been completed or extended meanwhile
+                score = pipe.zscore(self.leases_key, job_id)
+                if score is None or score > now:
+                    return False
+                attempts = int(pipe.hget(job_key, "attempts") or 0)
+                pipe.multi()
+                self._release(pipe, job_id, attempts, "lease expired")
+                return True
+
+            if self.client.transaction(
+                release, self.leases_key, job_key, value_from_callable=True
+            ):
+                released += 1
+        return released
+
+    def _lease_orphans(self, now: float) -> None:
+        """A worker that died between lmove and zadd left its job without a lease; give it one"""
+        job_ids = self.client.lrange(self.processing_key, 0, -1)
+        if not job_ids:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.zscore(self.leases_key, job_id)
+        orphans = [
+            job_id for job_id, score in zip(job_ids, pipe.execute()) if score is None
+        ]
+        if orphans:
+            self.client.zadd(
+                self.leases_key,
+                {job_id: now + self.lease_seconds for job_id in orphans},
+                nx=True,
+            )
+
+    def results(self, job_ids: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Stored results, of all jobs or of the given ones (those that are done)"""
+        if job_ids is None:
+            return {
+                job_id: json.loads(data)
+                for job_id, data in self.client.hgetall(self.results_key).items()
+            }
+        if not job_ids:
+            return {}
+        values = self.client.hmget(self.results_key, job_ids)
+        return {
+            job_id: json.loads(data)
+            for job_id, data in zip(job_ids, values)
+            if data is not None
+        }
+
+    def remaining(self, job_ids: List[str]) -> int:
+        """How many of job_ids are neither done nor dead"""
+        if not job_ids:
+            return 0
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hmget(self.results_key, job_ids)
+        for job_id in job_ids:
+            pipe.hget(self._job_key(job_id), "dead")
+        done, *dead = pipe.execute()
+        return sum(
+            result is None and not is_dead for result, is_dead in zip(done, dead)
+        )
+
+    def dead_jobs(self) -> List[Dict[str, Any]]:
+        jobs = []
+        for job_id in self.client.lrange(self.dead_key, 0, -1):
+            job = self.client.hgetall(self._job_key(job_id))
+            jobs.append(
+                {
+                    "job_id": job_id,
+                    "payload": json.loads(job.get("payload", "null")),
+                    "attempts": int(job.get("attempts", 0)),
+                    "error": job.get("error", ""),
+                }
+            )
+        return jobs
+
+    def stats(self) -> Dict[str, int]:
+        pipe = self.client.pipeline()
+        pipe.llen(self.pending_key)
+        pipe.llen(self.processing_key)
+        pipe.hlen(self.results_key)
+        pipe.llen(self.dead_key)
+        pending, processing, done, dead = pipe.execute()
+        return {
+            "pending": pending,
+            "processing": processing,
+            "done": done,
+            "dead": dead,
+        }
+
+    def clear(self) -> None:
+        """Delete every key of this queue"""
+        keys = list(self.client.scan_iter(f"{self.name}:*"))
+        if keys:
+            self.client.delete(*keys)
@@ -0,0 +1,222 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import threading
+import os
+import re
+
+TABULAR_EXTENSIONS = (".csv", ".tsv", ".xlsx", ".xls")
+
+_NAME_HINTS = (
+    "product",
+    "produkt",
+    "artikel",
+    "article",
+    "item",
+    "name",
+    "bezeichnung",
+    "description",
+    "beschreibung",
+    "title",
+)
+_PRICE_HINTS = ("price", "preis", "prix", "prezzo", "cost", "eur", "usd", "€", "$")
+# header words of article numbers / codes, which are never the name or price column
+_ID_WORDS = ("id", "nr", "no", "sku", "ean", "gtin", "upc", "isbn", "code")
+_ID_SUFFIXES = ("nummer", "number", "nr", "id", "code")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.findall(r"\w+", str(text).lower()))
+
+
+def _trigrams(text: str) -> List[str]:
+    padded = f"  {text} "
+    return list({padded[i : i + 3] for i in range(len(padded) - 2)})
+
+
+def _is_id_column(column: str) -> bool:
+    """'Artikelnummer', 'Art.-Nr.', 'SKU', 'Produkt-ID', ..."""
+    words = _normalize(column).split()
+    return any(w in _ID_WORDS or w.endswith(_ID_SUFFIXES) for w in words)
+
+
+def _parse_price(value) -> float:
+    """'1.299,00 €' / '$1,299.00' / 12.5 -> float, NaN when there is no number"""
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    match = re.search(r"\d[\d.,\s]*", str(value))
+    if not match:
+        return np.nan
+    number = match.group().strip().replace(" ", "")
+    if "," in number and "." in number:
+        if number.rfind(",") > number.rfind("."):
+            number = number.replace(".", "").replace(",", ".")
+        else:
+            number = number.replace(",", "")
+    elif "," in number:
+        head, _, tail = number.rpartition(",")
+        number = (
+            f"{head.replace(',', '')}.{tail}"
+            if len(tail) != 3
+            else number.replace(",", "")
+        )
+    elif "." in number:
+        head, _, tail = number.rpartition(".")
+        number = (
+            f"{head.replace('.', '')}.{tail}"
+            if len(tail) != 3
+            else number.replace(".", "")
+        )
+    try:
+        return float(number)
+    except ValueError:
+        return np.nan
+
+
+class PriceTable:
+    """A tabular price list held as one pandas frame (all sheets stacked) with a
+    character-trigram index over the product-name column for fuzzy lookups."""
+
+    def __init__(self, frame: pd.DataFrame, source: str = ""):
+        self.source = source
+        self.frame = frame.reset_index(drop=True)
+        self.name_column = self._pick_column(_NAME_HINTS, text=True)
+        self.price_column = self._pick_column(_PRICE_HINTS, text=False)
+        self.prices = (
+            self.frame[self.price_column].map(_parse_price).to_numpy(dtype=float)
+            if self.price_column is not None
+            else np.full(len(self.frame), np.nan)
+        )
+        self._names = [
+            _normalize(v) for v in self.frame[self.name_column].fillna("").tolist()
+        ]
+        self._index = self._build_index(self._names)
+
+    @classmethod
+    def load(cls, local_path: str) -> "PriceTable":
+        extension = os.path.splitext(local_path)[1].lower()
+        if extension in (".xlsx", ".xls"):
+            sheets = pd.read_excel(local_path, sheet_name=None, dtype=object)
+            frames = []
+            for sheet, frame in sheets.items():
+                frame = frame.dropna(how="all")
+                frame.insert(0, "sheet", sheet)
+                frames.append(frame)
+            frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        else:
+            frame = pd.read_csv(
+                local_path,
+                sep=None if extension != ".tsv" else "\t",
+                engine="python",
+                dtype=object,
+                on_bad_lines="skip",
+            )
+        if frame.empty:
+            raise ValueError(f"No rows found in {local_path}")
+        frame.columns = [str(c).strip() for c in frame.columns]
+        return cls(frame, source=local_path)
+
+    def _pick_column(self, hints: Tuple[str, ...], text: bool) -> Optional[str]:
+        """Header equal to a hint, else one containing a hint, else the column that
+        looks most like names / prices; article number columns are skipped"""
+        columns = [
+            c for c in self.frame.columns if c != "sheet" and not _is_id_column(c)
+        ] or [c for c in self.frame.columns if c != "sheet"]
+        headers = {c: _normalize(c) for c in columns}
+        for hint in hints:
+            for column in columns:
+                if headers[column] == hint:
+                    return column
+        for hint in hints:
+            for column in columns:
+                if hint in column.lower():
+                    return column
+        sample = self.frame[columns].head(200)
+        if text:
+            lengths = {c: sample[c].astype(str).str.len().mean() for c in columns}
+            return max(lengths, key=lengths.get) if lengths else self.frame.columns[0]
+        numeric = {c: sample[c].map(_parse_price).notna().mean() for c in columns}
+        best = max(numeric, key=numeric.get, default=None)
+        return best if best is not None and numeric[best] > 0.5 else None
+
+    @staticmethod
+    def _build_index(names: List[str]) -> Dict[str, np.ndarray]:
+        postings: Dict[str, List[int]] = {}
+        for row, name in enumerate(names):
+            for gram in _trigrams(name):
+                postings.setdefault(gram, []).append(row)
+        return {
+            gram: np.asarray(rows, dtype=np.int32) for gram, rows in postings.items()
+        }
+
+    def lookup(self, query: str, limit: int = 10, min_score: float = 0.3):
+        """Rows whose product name best matches query, as (score, row) pairs"""
+        grams = _trigrams(_normalize(query))
+        if not grams or not self._names:
+            return []
+        hits = np.zeros(len(self._names), dtype=np.int32)
+        for gram in grams:
+            rows = self._index.get(gram)
+            if rows is not None:
+                hits[rows] += 1
+        candidates = np.flatnonzero(hits)
+        if candidates.size == 0:
+            return []
+        # how much of the query the name covers, slightly favouring shorter names
+        name_grams = np.array([len(self._names[i]) + 1 for i in candidates])
+        scores = hits[candidates] / len(grams)
+        scores = scores - 0.1 * (1 - hits[candidates] / np.maximum(name_grams, 1))
+        order = np.argsort(-scores)[:limit]
+        return [
+            (float(scores[i]), int(candidates[i]))
+            for i in order
+            if scores[i] >= min_score
+        ]
+
+    def format_matches(self, query: str, limit: int = 10) -> str:
+        matches = self.lookup(query, limit=limit)
+        header = (
+            f"Price list: {self.source} ({len(self.frame)} rows, "
+            f"name column '{self.name_column}', price column '{self.price_column}')"
+        )
+        if not matches:
+            return f"{header}\nNo rows match '{query}'."
+        columns = ["row", "match", "price"] + list(self.frame.columns)
+        lines = [
+            "| " + " | ".join(columns) + " |",
+            "| " + " | ".join("---" for _ in columns) + " |",
+        ]
+        for score, row in matches:
+            values = [row + 1, round(score, 2), self.prices[row]]
+            values += self.frame.iloc[row].fillna("").tolist()
+            lines.append(
+                "| " + " | ".join(str(v).replace("|", "/") for v in values) + " |"
+            )
+        return header + "\n\n" + "\n".join(lines)
+
+
+class PriceTableCache:
+    """Loaded price tables keyed by (path, mtime), so repeated lookups skip parsing"""
+
+    def __init__(self, max_tables: int = 8):
+        self.max_tables = max_tables
+        self._tables: "OrderedDict[Tuple[str, float], PriceTable]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, local_path: str) -> PriceTable:
+        key = (os.path.abspath(local_path), os.path.getmtime(local_path))
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                return table
+        table = PriceTable.load(local_path)
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        return table
+
+
+price_tables = PriceTableCache()
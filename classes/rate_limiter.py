@@ -0,0 +1,45 @@
+from typing import Optional
+import multiprocessing
+import asyncio
+import time
+
+
+class SharedRateLimiter:
+    """Token bucket whose state lives in shared memory, so every worker process
+    draws from the same budget (e.g. model requests per minute). Pass it to the
+    processes as an argument; it pickles across spawn."""
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        burst: Optional[int] = None,
+        ctx: Optional[multiprocessing.context.BaseContext] = None,
+    ):
+        ctx = ctx or multiprocessing.get_context("spawn")
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst or max(1, int(self.rate * 5))
+        self._tokens = ctx.Value("d", float(self.burst), lock=False)
+        self._updated = ctx.Value("d", time.time(), lock=False)
+        self._lock = ctx.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token (possibly in advance); seconds to wait before using it"""
+        with self._lock:
+            now = time.time()
+            tokens = min(
+                float(self.burst),
+                self._tokens.value + (now - self._updated.value) * self.rate,
+            )
+            self._tokens.value = tokens - 1
+            self._updated.value = now
+        return max(0.0, (1 - tokens) / self.rate)
+
+    async def acquire(self) -> None:
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self) -> None:
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
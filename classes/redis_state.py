@@ -0,0 +1,75 @@
+from classes.statemanager import LocalStateManager
+from typing import Any, Optional
+from dotenv import load_dotenv
+import redis
+import json
+import os
+
+load_dotenv()
+
+
+def redis_client(url: Optional[str] = None) -> "redis.Redis":
+    """Client for REDIS_URL (default localhost)"""
+    return redis.Redis.from_url(
+        url or os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        decode_responses=True,
+    )
+
+
+class RedisStateManager(LocalStateManager):
+    """LocalStateManager whose streaming state lives in Redis, so a stop issued in
+    one process (or machine) reaches the workers running that user's stream.
+
+    State is a hash `{prefix}:streaming`; every change is published on
+    `{prefix}:state` and a listener thread replays it into the local events
+    and subscribers of this process. `client` can be any redis-py compatible
+    client (e.g. fakeredis in tests)."""
+
+    def __init__(self, client: Any = None, prefix: str = "pricer"):
+        super().__init__()
+        self.client = client or redis_client()
+        self.state_key = f"{prefix}:streaming"
+        self.channel = f"{prefix}:state"
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: self._on_message})
+        self._listener = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
+    def start_streaming(self, user_id: str):
+        """Start streaming for a user"""
+        self.client.hset(self.state_key, user_id, "1")
+        self.client.publish(self.channel, json.dumps([user_id, True]))
+        super().start_streaming(user_id)
+
+    def stop_streaming(self, user_id: str):
+        """Stop streaming for a user"""
+        self.client.hset(self.state_key, user_id, "0")
+        self.client.publish(self.channel, json.dumps([user_id, False]))
+        super().stop_streaming(user_id)
+
+    def get_state(self, user_id: str) -> bool:
+        """Get streaming state for a user"""
+        return self.client.hget(self.state_key, user_id) == "1"
+
+    def _on_message(self, message) -> None:
+        try:
+            user_id, streaming = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+        # our own publishes come back too; only act when the local view is out of date
+        if super().get_state(user_id) == streaming:
+            return
+        if streaming:
+            super().start_streaming(user_id)
+        else:
+            super().stop_streaming(user_id)
+
+    def stop_event(self, user_id: str):
+        """Event (bound to the running loop) that is set once the user's stream stops"""
+        # a worker that never saw the start message still follows the shared state
+        if self.get_state(user_id) and not super().get_state(user_id):
+            super().start_streaming(user_id)
+        return super().stop_event(user_id)
+
+    def close(self) -> None:
+        self._listener.stop()
+        self._pubsub.close()
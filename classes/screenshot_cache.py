@@ -0,0 +1,113 @@
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+import threading
+import time
+import re
+
+
+class CachedScreenshot:
+    """One rendered screenshot plus what the vision model said about it"""
+
+    __slots__ = ("url", "intent", "img_path", "phash", "vision_text", "created")
+
+    def __init__(
+        self, url: str, intent: str, img_path: str, phash: int, vision_text: str
+    ):
+        self.url = url
+        self.intent = intent
+        self.img_path = img_path
+        self.phash = phash
+        self.vision_text = vision_text
+        self.created = time.time()
+
+
+class ScreenshotCache:
+    """Screenshot + vision answer cache keyed by (url, query intent, render time bucket).
+    A fresh render of the same url that is perceptually identical to an earlier
+    one (256-bit dhash within `phash_distance` bits) reuses its vision answer for
+    the same intent. Renders of other urls never match: two shops' pages can
+    look alike at hash resolution while showing different prices."""
+
+    _STOPWORDS = set("the a an of for on in is and what find der die das und".split())
+
+    def __init__(
+        self,
+        bucket_seconds: int = 900,
+        max_entries: int = 512,
+        phash_distance: int = 6,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.max_entries = max_entries
+        self.phash_distance = phash_distance
+        self._entries: "OrderedDict[Tuple[str, str, int], CachedScreenshot]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def intent(cls, query: str) -> str:
+        """Order- and filler-insensitive form of the query"""
+        words = {
+            w for w in re.findall(r"\w+", query.lower()) if w not in cls._STOPWORDS
+        }
+        return " ".join(sorted(words))
+
+    def _key(self, url: str, query: str) -> Tuple[str, str, int]:
+        return (
+            url.strip(),
+            self.intent(query),
+            int(time.time() // self.bucket_seconds),
+        )
+
+    def get(self, url: str, query: str) -> Optional[CachedScreenshot]:
+        """Entry rendered for this url and intent in the current time bucket"""
+        key = self._key(url, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def find_similar(
+        self, phash: int, url: str, query: str
+    ) -> Optional[CachedScreenshot]:
+        """Earlier entry for the same url and intent whose render looks the same as `phash`"""
+        url = url.strip()
+        intent = self.intent(query)
+        with self._lock:
+            for entry in reversed(self._entries.values()):
+                if (
+                    entry.url == url
+                    and entry.intent == intent
+                    and bin(entry.phash ^ phash).count("1") <= self.phash_distance
+                ):
+                    self.phash_hits += 1
+                    return entry
+        return None
+
+    def put(
+        self, url: str, query: str, img_path: str, phash: int, vision_text: str
+    ) -> None:
+        key = self._key(url, query)
+        with self._lock:
+            self._entries[key] = CachedScreenshot(
+                url, key[1], img_path, phash, vision_text
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "phash_hits": self.phash_hits,
+                "misses": self.misses,
+            }
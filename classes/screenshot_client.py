@@ -0,0 +1,151 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import httpx
+import uuid
+import os
+
+DEFAULT_BROWSERLESS_URL = "https://production-sfo.browserless.io"
+
+
+class ScreenshotClient:
+    """Async browserless screenshot client - streams images to disk, caps concurrent renders"""
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        base_url: Optional[str] = None,
+        downloads_folder: Optional[str] = None,
+        max_concurrency: int = 4,
+        timeout: float = 240,
+        proxy: Optional[str] = "residential",
+    ):
+        self.token = token
+        self.base_url = (
+            base_url or os.getenv("BROWSERLESS_URL") or DEFAULT_BROWSERLESS_URL
+        ).rstrip("/")
+        self.downloads_folder = downloads_folder
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.proxy = proxy
+        # one pooled client and render semaphore per event loop (batch and worker
+        # processes run a loop per asyncio.run), created on first use in that loop
+        self._per_loop: Dict[
+            asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, asyncio.Semaphore]
+        ] = {}
+
+    def _new_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, connect=20),
+            limits=httpx.Limits(max_connections=self.max_concurrency),
+        )
+
+    def _loop_state(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        for closed in [l for l in self._per_loop if l.is_closed()]:
+            del self._per_loop[closed]
+        if loop not in self._per_loop:
+            self._per_loop[loop] = (
+                self._new_client(),
+                asyncio.Semaphore(self.max_concurrency),
+            )
+        return self._per_loop[loop]
+
+    async def aclose(self) -> None:
+        """Close the connection pool of the running loop (call before the loop ends)"""
+        state = self._per_loop.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].aclose()
+
+    def _output_path(self, image_type: str, downloads_folder: Optional[str]) -> str:
+        filename = f"screenshot_{uuid.uuid4().hex}.{image_type}"
+        downloads_folder = downloads_folder or self.downloads_folder
+        if downloads_folder:
+            os.makedirs(downloads_folder, exist_ok=True)
+            return os.path.join(downloads_folder, filename)
+        return os.path.abspath(filename)
+
+    @staticmethod
+    def _discard(output_path: str) -> None:
+        """Remove a partly written image"""
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    async def _capture(
+        self,
+        target_url: str,
+        *,
+        full_page: bool = True,
+        image_type: str = "png",
+        downloads_folder: Optional[str] = None,
+    ) -> str:
+        if not self.token and self.base_url == DEFAULT_BROWSERLESS_URL:
+            raise ValueError("browserless_token not set; cannot take screenshot")
+
+        params: Dict[str, str] = {}
+        if self.token:
+            params["token"] = self.token
+        if self.proxy:
+            params["proxy"] = self.proxy
+
+        payload = {
+            "url": target_url,
+            "bestAttempt": True,
+            "gotoOptions": {"waitUntil": "networkidle2"},
+            "waitForTimeout": 3000,
+            "options": {
+                "fullPage": full_page,
+                "type": image_type,
+            },
+        }
+        headers = {"Content-Type": "application/json", "Cache-Control": "no-cache"}
+
+        client, semaphore = self._loop_state()
+        output_path = self._output_path(image_type, downloads_folder)
+        async with semaphore:
+            try:
+                async with client.stream(
+                    "POST",
+                    f"{self.base_url}/screenshot",
+                    params=params,
+                    json=payload,
+                    headers=headers,
+                ) as resp:
+                    resp.raise_for_status()
+                    with open(output_path, "wb") as fh:
+                        async for chunk in resp.aiter_bytes(chunk_size=64 * 1024):
+                            fh.write(chunk)
+            except httpx.HTTPError as exc:
+                self._discard(output_path)
+                return f"Screenshot failed ({type(exc).__name__}): {exc}"
+            except BaseException:  # cancelled (or disk full) mid-download
+                self._discard(output_path)
+                raise
+
+        return output_path
+
+    async def capture(self, target_url: str, **kwargs) -> str:
+        """Screenshot one url, return the saved file path (or an error string)"""
+        return await self._capture(target_url, **kwargs)
+
+    async def capture_many(self, urls: List[str], **kwargs) -> List[str]:
+        """Screenshot many urls through a shared queue, results in input order"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in enumerate(urls):
+            queue.put_nowait(item)
+        results: List[str] = [""] * len(urls)
+
+        async def worker():
+            while True:
+                try:
+                    index, url = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    results[index] = await self._capture(url, **kwargs)
+                except Exception as e:
+                    results[index] = f"Screenshot failed ({type(e).__name__}): {e}"
+
+        await asyncio.gather(
+            *(worker() for _ in range(min(self.max_concurrency, len(urls))))
+        )
+        return results
@@ -1,17 +1,25 @@
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 from urllib.parse import unquote, urljoin, urlparse
 from classes._md_convert import (
     FileConversionException,
     MarkdownConverter,
     UnsupportedFormatException,
 )
+from classes.screenshot_client import ScreenshotClient
+from classes.price_table import TABULAR_EXTENSIONS
+from classes.cancellation import ToolCancelled, current_token
+from classes.history import BrowserHistory
 from serpapi import GoogleSearch
 from _cookies import COOKIES
+from utils import tokenizer
 import pathvalidate
 import requests
 import mimetypes
 import os
 import pathlib
+import threading
+import bisect
+import sys
 import re
 import time
 import uuid
@@ -24,6 +32,11 @@ class SimpleTextBrowser:
         self,
         start_page: Optional[str] = None,
         viewport_size: Optional[int] = 1024 * 8,
+        viewport_tokens: Optional[int] = None,
+        compact_links: bool = False,
+        screenshot_client: Optional[ScreenshotClient] = None,
+        history_size: int = 1000,
+        conversion_service: Any = None,
         downloads_folder: Optional[Union[str, None]] = None,
         serpapi_key: Optional[Union[str, None]] = None,
         browserless_token: Optional[Union[str, None]] = None,
@@ -32,17 +45,30 @@ class SimpleTextBrowser:
     ):
         self.start_page: str = start_page if start_page else "about:blank"
         self.viewport_size = viewport_size
+        self.viewport_tokens = viewport_tokens
+        self.compact_links = compact_links
+        self.page_links: List[str] = list()
         self.downloads_folder = downloads_folder
-        self.history: List[Tuple[str, float]] = list()
+        self.history: BrowserHistory = BrowserHistory(maxlen=history_size)
+        # held by the tool call using the browser, see BrowserManager.session
+        self.lock = threading.Lock()
         self.page_title: Optional[str] = None
         self.viewport_current_page = 0
         self.viewport_pages: List[Tuple[int, int]] = list()
+        self.viewport_token_counts: List[int] = list()
+        self._token_offsets: List[int] = list()
+        self._page_chunks: Optional[Iterator[str]] = None
+        self._page_scan: Optional[Callable] = None
+        self._chunks_loaded = 0
         self.set_address(self.start_page)
         self.serpapi_key = serpapi_key
         self.browserless_token = browserless_token
+        self._screenshot_client = screenshot_client or ScreenshotClient(
+            token=browserless_token, downloads_folder=downloads_folder
+        )
         self.request_kwargs = request_kwargs
         self.request_kwargs["cookies"] = COOKIES
-        self._mdconvert = MarkdownConverter()
+        self._mdconvert = MarkdownConverter(conversion_service=conversion_service)
         self._page_content: str = ""
         self.user_id = user_id
         self._find_on_page_query: Union[str, None] = None
@@ -51,29 +77,40 @@ class SimpleTextBrowser:
     @property
     def address(self) -> str:
         """Return the address of the current page."""
-        return self.history[-1][0]
+        return self.history[-1].url
 
     def set_address(self, uri_or_path: str, filter_year: Optional[int] = None) -> None:
-        # TODO:
+        link_ref = re.fullmatch(r"\[?(\d+)\]?", uri_or_path.strip())
+        if link_ref and 0 < int(link_ref.group(1)) <= len(self.page_links):
+            uri_or_path = self.page_links[int(link_ref.group(1)) - 1]
+        previous_links, self.page_links = self.page_links, []
+
+        if (
+            uri_or_path != "about:blank"
+            and not uri_or_path.startswith("google:")
+            and not uri_or_path.startswith("http:")
+            and not uri_or_path.startswith("https:")
+            and not uri_or_path.startswith("file:")
+            and len(self.history) > 0
+        ):
+            uri_or_path = urljoin(self.history[-1].url, uri_or_path)
+
         self.history.append((uri_or_path, time.time()))
 
-        if uri_or_path == "about:blank":
-            self._set_page_content("")
-        elif uri_or_path.startswith("google:"):
-            self._serpapi_search(
-                uri_or_path[len("google:") :].strip(), filter_year=filter_year
-            )
-        else:
-            if (
-                not uri_or_path.startswith("http:")
-                and not uri_or_path.startswith("https:")
-                and not uri_or_path.startswith("file:")
-            ):
-                if len(self.history) > 1:
-                    prior_address = self.history[-2][0]
-                    uri_or_path = urljoin(prior_address, uri_or_path)
-                    self.history[-1] = (uri_or_path, self.history[-1][1])
-            self._fetch_page(uri_or_path)
+        try:
+            if uri_or_path == "about:blank":
+                self._set_page_content("")
+            elif uri_or_path.startswith("google:"):
+                self._serpapi_search(
+                    uri_or_path[len("google:") :].strip(), filter_year=filter_year
+                )
+            else:
+                self._fetch_page(uri_or_path)
+        except ToolCancelled:
+            # a cancelled call leaves the browser on the page it was on
+            self.history.pop()
+            self.page_links = previous_links
+            raise
 
         self.viewport_current_page = 0
         self.find_on_page_query = None
@@ -87,17 +124,79 @@ class SimpleTextBrowser:
 
     @property
     def page_content(self) -> str:
-        """Return the full contents of the current page."""
+        """Return the contents of the current page converted so far."""
         return self._page_content
 
-    def _set_page_content(self, content: str) -> None:
-        """Sets the text content of the current page."""
+    def _set_page_content(
+        self,
+        content: str,
+        chunks: Optional[Iterator[str]] = None,
+        scan: Optional[Callable] = None,
+    ) -> None:
+        """Sets the text content of the current page; `chunks` holds the rest of a lazily converted document
+        and `scan` (optional) finds matching chunks without converting them (see DocumentConverterResult).
+        """
         self._page_content = content
+        self._page_chunks = chunks
+        self._page_scan = scan
+        self._chunks_loaded = 1
         self._split_pages()
+        self._materialize(0)
         if self.viewport_current_page >= len(self.viewport_pages):
             self.viewport_current_page = len(self.viewport_pages) - 1
 
+    def _materialize(self, viewport: Optional[int] = None) -> None:
+        """Convert lazy chunks until viewports up to `viewport` are final (the whole page if None)."""
+        while self._page_chunks is not None and (
+            viewport is None or viewport >= len(self.viewport_pages) - 1
+        ):
+            self._load_next_chunk()
+
+    def _load_next_chunk(self) -> None:
+        current_token().raise_if_cancelled()
+        try:
+            chunk = next(self._page_chunks, None)
+        except Exception as e:
+            chunk = f"\n\n[Could not convert the rest of this document: {e}]"
+            self._page_chunks = None
+        if chunk is None:
+            self._page_chunks = None
+            return
+        self._page_content += chunk
+        self._chunks_loaded += 1
+        self._split_pages(from_viewport=len(self.viewport_pages) - 1)
+
+    def _materialize_for_query(self, query: str) -> None:
+        """Convert lazy content only up to the next chunk the page's scanner says matches (everything without a scanner)."""
+        if self._page_chunks is None:
+            return
+        if self._page_scan is None:
+            self._materialize()
+            return
+        nquery = self._normalize_query(query)
+        if nquery is None:
+            return
+        target = self._page_scan(
+            lambda text: self._matches_query(nquery, text), self._chunks_loaded
+        )
+        while (
+            target is not None
+            and self._page_chunks is not None
+            and self._chunks_loaded <= target
+        ):
+            self._load_next_chunk()
+
+    def _find_in_page(self, query: str, starting_viewport: int) -> Union[int, None]:
+        """_find_next_viewport that only converts lazy content when what is loaded has no match ahead."""
+        if self._page_chunks is not None:
+            match = self._find_next_viewport(query, starting_viewport, wrap=False)
+            if match is not None:
+                return match
+            self._materialize_for_query(query)
+        return self._find_next_viewport(query, starting_viewport)
+
     def page_down(self) -> None:
+        self._materialize(self.viewport_current_page + 1)
         self.viewport_current_page = min(
             self.viewport_current_page + 1, len(self.viewport_pages) - 1
         )
@@ -115,7 +214,7 @@ class SimpleTextBrowser:
             return self.find_next()
 
         self._find_on_page_query = query
-        viewport_match = self._find_next_viewport(query, self.viewport_current_page)
+        viewport_match = self._find_in_page(query, self.viewport_current_page)
         if viewport_match is None:
             self._find_on_page_last_result = None
             return None
@@ -138,9 +237,7 @@ class SimpleTextBrowser:
             if starting_viewport >= len(self.viewport_pages):
                 starting_viewport = 0
 
-        viewport_match = self._find_next_viewport(
-            self._find_on_page_query, starting_viewport
-        )
+        viewport_match = self._find_in_page(self._find_on_page_query, starting_viewport)
         if viewport_match is None:
             self._find_on_page_last_result = None
             return None
@@ -149,11 +246,8 @@ class SimpleTextBrowser:
             self._find_on_page_last_result = viewport_match
             return self.viewport
 
-    def _find_next_viewport(
-        self, query: str, starting_viewport: int
-    ) -> Union[int, None]:
-        """Search for matches between the starting viewport looping when reaching the end."""
-
+    def _normalize_query(self, query: str) -> Union[str, None]:
+        """Turn a find query (with '*' wildcards) into the regex matched against normalized content."""
         if query is None:
             return None
 
@@ -164,18 +258,31 @@ class SimpleTextBrowser:
 
         if nquery.strip() == "":
             return None
+        return nquery
+
+    def _matches_query(self, nquery: str, content: str) -> bool:
+        # TODO: Remove markdown links and images
+        ncontent = " " + (" ".join(re.split(r"\W+", content))).strip().lower() + " "
+        return re.search(nquery, ncontent) is not None
+
+    def _find_next_viewport(
+        self, query: str, starting_viewport: int, wrap: bool = True
+    ) -> Union[int, None]:
+        """Search for matches between the starting viewport looping when reaching the end."""
+
+        nquery = self._normalize_query(query)
+        if nquery is None:
+            return None
 
         idxs = list()
         idxs.extend(range(starting_viewport, len(self.viewport_pages)))
-        idxs.extend(range(0, starting_viewport))
+        if wrap:
+            idxs.extend(range(0, starting_viewport))
 
         for i in idxs:
             bounds = self.viewport_pages[i]
             content = self.page_content[bounds[0] : bounds[1]]
-
-            # TODO: Remove markdown links and images
-            ncontent = " " + (" ".join(re.split(r"\W+", content))).strip().lower() + " "
-            if re.search(nquery, ncontent):
+            if self._matches_query(nquery, content):
                 return i
 
         return None
@@ -185,7 +292,18 @@ class SimpleTextBrowser:
         self.set_address(path_or_uri, filter_year=filter_year)
         return self.viewport
 
-    def _split_pages(self) -> None:
+    def _split_pages(self, from_viewport: int = 0) -> None:
+        """Split the page into viewports, keeping the ones before `from_viewport` as they are."""
+        start_idx = 0
+        if 0 < from_viewport < len(self.viewport_pages):
+            start_idx = self.viewport_pages[from_viewport][0]
+            del self.viewport_pages[from_viewport:]
+            del self.viewport_token_counts[from_viewport:]
+        else:
+            self.viewport_pages = []
+            self.viewport_token_counts = []
+            self._token_offsets = []
+
         if self.address.startswith("google:"):
             self.viewport_pages = [(0, len(self._page_content))]
             return
@@ -194,8 +312,10 @@ class SimpleTextBrowser:
             self.viewport_pages = [(0, 0)]
             return
 
-        self.viewport_pages = []
-        start_idx = 0
+        if self.viewport_tokens:
+            self._split_pages_by_tokens(start_idx)
+            return
+
         while start_idx < len(self._page_content):
             end_idx = min(start_idx + self.viewport_size, len(self._page_content))  # type: ignore[operator]
             while end_idx < len(self._page_content) and self._page_content[
@@ -205,6 +325,49 @@ class SimpleTextBrowser:
             self.viewport_pages.append((start_idx, end_idx))
             start_idx = end_idx
 
+    def _split_pages_by_tokens(self, start_idx: int = 0) -> None:
+        """Split the page from start_idx into viewports of at most `viewport_tokens` tokens.
+        A viewport ends after the last line break in its second half, else before its last
+        space (tokens start with their space, so none is cut), else on a token boundary;
+        its count is that of the text it actually holds."""
+        content = self._page_content
+        tokens = tokenizer.encode(content[start_idx:], disallowed_special=())
+        _, offsets = tokenizer.decode_with_offsets(tokens)
+        offsets = [start_idx + offset for offset in offsets]
+        keep = bisect.bisect_left(self._token_offsets, start_idx)
+        self._token_offsets = self._token_offsets[:keep] + offsets
+
+        while start_idx < len(content):
+            end_tok = bisect.bisect_left(offsets, start_idx) + self.viewport_tokens
+            if end_tok >= len(tokens):
+                end_idx = len(content)
+            else:
+                limit = offsets[end_tok]
+                nl_idx = content.rfind("\n", start_idx, limit)
+                ws_idx = max(content.rfind(c, start_idx, limit) for c in " \t")
+                if nl_idx >= (start_idx + limit) // 2:
+                    end_idx = nl_idx + 1
+                elif ws_idx > start_idx:
+                    end_idx = ws_idx
+                else:
+                    end_idx = limit
+                end_idx = max(end_idx, start_idx + 1)
+
+            count = len(
+                tokenizer.encode(content[start_idx:end_idx], disallowed_special=())
+            )
+            # a chunk starting inside a token can encode to a few more tokens
+            while count > self.viewport_tokens and end_idx > start_idx + 1:
+                over = count - self.viewport_tokens
+                end_tok = bisect.bisect_left(offsets, end_idx) - over
+                end_idx = max(offsets[max(end_tok, 0)], start_idx + 1)
+                count = len(
+                    tokenizer.encode(content[start_idx:end_idx], disallowed_special=())
+                )
+            self.viewport_pages.append((start_idx, end_idx))
+            self.viewport_token_counts.append(count)
+            start_idx = end_idx
+
     def _serpapi_search(self, query: str, filter_year: Optional[int] = None) -> None:
         if self.serpapi_key is None:
             raise ValueError("Missing SerpAPI key.")
@@ -237,9 +400,9 @@ class SimpleTextBrowser:
             return
 
         def _prev_visit(url):
-            for i in range(len(self.history) - 1, -1, -1):
-                if self.history[i][0] == url:
-                    return f"You previously visited this page {round(time.time() - self.history[i][1])} seconds ago.\n"
+            last_visit = self.history.last_visit(url)
+            if last_visit is not None:
+                return f"You previously visited this page {round(time.time() - last_visit)} seconds ago.\n"
             return ""
 
         web_snippets: List[str] = list()
@@ -273,71 +436,36 @@ class SimpleTextBrowser:
 
         self._set_page_content(content)
 
-    def screenshot(
+    async def screenshot_async(
         self,
         target_url: str,
         *,
         full_page: bool = True,
         image_type: str = "png",
     ) -> str:
-        """
-        Save a screenshot of `target_url` into `downloads_folder`
-        and return the absolute file-path.
-
-        Requires `self.browserless_token` to be set (see BrowserManager).
-        """
-        if not self.browserless_token:
-            raise ValueError("browserless_token not set; cannot take screenshot")
-
-        api_url = (
-            f"https://production-sfo.browserless.io/screenshot"
-            f"?token={self.browserless_token}&proxy=residential"
+        """Screenshot `target_url` through the browserless client: streams the image
+        into `downloads_folder` and returns the file-path (or an error string)."""
+        return await self._screenshot_client.capture(
+            target_url,
+            full_page=full_page,
+            image_type=image_type,
+            downloads_folder=self.downloads_folder,
         )
 
-        payload = {
-            "url": target_url,
-            "bestAttempt": True,
-            "gotoOptions": {"waitUntil": "networkidle2"},
-            "waitForTimeout": 3000,
-            "options": {
-                "fullPage": full_page,
-                "type": image_type,
-            },
-        }
-
-        headers = {"Content-Type": "application/json", "Cache-Control": "no-cache"}
-        try:
-            resp = requests.post(
-                api_url,
-                headers=headers,
-                json=payload,
-                timeout=(20, 240),
-            )
-            resp.raise_for_status()
-        except (requests.Timeout, requests.HTTPError) as exc:
-            return f"Screenshot failed ({type(exc).__name__}): {exc}"
-
-        filename = f"screenshot_{uuid.uuid4().hex}.{image_type}"
-
-        if self.downloads_folder:
-            os.makedirs(self.downloads_folder, exist_ok=True)
-            output_path = os.path.join(self.downloads_folder, filename)
-        else:
-            output_path = os.path.abspath(filename)
-
-        with open(output_path, "wb") as fh:
-            fh.write(resp.content)
-
-        return output_path
-
     def _fetch_page(self, url: str) -> None:
         download_path = ""
+        token = current_token()
+        token.raise_if_cancelled()
+        unregister = None
         try:
             if url.startswith("file://"):
                 download_path = os.path.normcase(os.path.normpath(unquote(url[7:])))
-                res = self._mdconvert.convert_local(download_path)
+                res = self._mdconvert.convert_local(
+                    download_path, compact_links=self.compact_links
+                )
                 self.page_title = res.title
-                self._set_page_content(res.text_content)
+                self.page_links = res.links
+                self._set_page_content(res.text_content, res.chunks, res.scan)
             else:
                 request_kwargs = (
                     self.request_kwargs.copy()
@@ -345,16 +473,34 @@ class SimpleTextBrowser:
                     else {}
                 )
                 request_kwargs["stream"] = True
+                if "timeout" in request_kwargs:
+                    # never wait on a socket past the tool call's deadline
+                    timeout = request_kwargs["timeout"]
+                    request_kwargs["timeout"] = (
+                        tuple(token.timeout(t) for t in timeout)
+                        if isinstance(timeout, tuple)
+                        else token.timeout(timeout)
+                    )
 
                 response = requests.get(url, **request_kwargs)
+                # closing the response unblocks a read that is stuck on a slow site
+                unregister = token.on_cancel(response.close)
                 response.raise_for_status()
 
                 content_type = response.headers.get("content-type", "")
 
-                if "text/" in content_type.lower():
-                    res = self._mdconvert.convert_response(response)
+                # price lists are kept on disk (not converted in memory) so lookup_price can index them
+                is_tabular = "csv" in content_type.lower() or urlparse(
+                    url
+                ).path.lower().endswith(TABULAR_EXTENSIONS)
+
+                if "text/" in content_type.lower() and not is_tabular:
+                    res = self._mdconvert.convert_response(
+                        response, compact_links=self.compact_links
+                    )
                     self.page_title = res.title
-                    self._set_page_content(res.text_content)
+                    self.page_links = res.links
+                    self._set_page_content(res.text_content, res.chunks, res.scan)
                 else:
                     fname = None
                     download_path = None
@@ -362,6 +508,10 @@ class SimpleTextBrowser:
                         fname = pathvalidate.sanitize_filename(
                             os.path.basename(urlparse(url).path)
                         ).strip()
+                        if is_tabular and not fname.lower().endswith(
+                            TABULAR_EXTENSIONS
+                        ):
+                            fname += ".csv"
                         download_path = os.path.abspath(
                             os.path.join(self.downloads_folder, fname)
                         )
@@ -389,9 +539,14 @@ class SimpleTextBrowser:
                         )
 
                     # Open a file for writing
-                    with open(download_path, "wb") as fh:
-                        for chunk in response.iter_content(chunk_size=512):
-                            fh.write(chunk)
+                    try:
+                        with open(download_path, "wb") as fh:
+                            for chunk in response.iter_content(chunk_size=512):
+                                token.raise_if_cancelled()
+                                fh.write(chunk)
+                    except ToolCancelled:
+                        os.remove(download_path)
+                        raise
 
                     local_uri = pathlib.Path(download_path).as_uri()
                     self.set_address(local_uri)
@@ -433,20 +588,55 @@ class SimpleTextBrowser:
             except NameError:
                 self.page_title = "Error"
                 self._set_page_content(f"## Error\n\n{str(request_exception)}")
+        finally:
+            if unregister is not None:
+                unregister()
+            # a read broken off by the cancellation surfaces as some other error; report the cancellation
+            token.raise_if_cancelled()
+
+    def fork(self) -> "SimpleTextBrowser":
+        """New browser with fresh navigation state (history, viewport, find) that
+        shares cookies, headers, the converter and the screenshot client with this one.
+        """
+        clone = SimpleTextBrowser(
+            start_page=self.start_page,
+            viewport_size=self.viewport_size,
+            viewport_tokens=self.viewport_tokens,
+            compact_links=self.compact_links,
+            downloads_folder=self.downloads_folder,
+            serpapi_key=self.serpapi_key,
+            browserless_token=self.browserless_token,
+            request_kwargs=dict(self.request_kwargs),
+            user_id=self.user_id,
+            screenshot_client=self._screenshot_client,
+            history_size=self.history.maxlen,
+        )
+        clone._mdconvert = self._mdconvert
+        return clone
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by page content, links and history"""
+        size = sys.getsizeof(self._page_content)
+        size += sum(sys.getsizeof(link) for link in self.page_links)
+        size += sum(sys.getsizeof(url) + 64 for url, _ in self.history)
+        size += 8 * (len(self.viewport_pages) * 2 + len(self._token_offsets))
+        return size
 
     def _state(self) -> Tuple[str, str]:
         header = f"Address: {self.address}\n"
         if self.page_title is not None:
             header += f"Title: {self.page_title}\n"
+        if self.page_links:
+            header += f"Links are shown as [n] ({len(self.page_links)} on this page); visit_url('n') follows link n.\n"
 
         current_page = self.viewport_current_page
         total_pages = len(self.viewport_pages)
+        if self._page_chunks is not None:
+            total_pages = f"{total_pages}+"
 
-        address = self.address
-        for i in range(len(self.history) - 2, -1, -1):  # Start from the second last
-            if self.history[i][0] == address:
-                header += f"You previously visited this page {round(time.time() - self.history[i][1])} seconds ago.\n"
-                break
+        previous_visit = self.history.previous_visit(self.address)
+        if previous_visit is not None:
+            header += f"You previously visited this page {round(time.time() - previous_visit)} seconds ago.\n"
 
         header += (
             f"Viewport position: Showing page {current_page + 1} of {total_pages}.\n"
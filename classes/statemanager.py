@@ -1,28 +1,122 @@
 import threading
-from typing import Dict
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+StateCallback = Callable[[str, bool], None]
+LoopEvents = Dict[asyncio.AbstractEventLoop, asyncio.Event]
 
 
 class LocalStateManager:
-    """Simple state manager - start/stop/get streaming state"""
+    """Simple state manager - start/stop/get streaming state.
+    Coroutines wait on stop signals (wait_for_stop / run_unless_stopped) instead of
+    polling get_state, and subscribers are called on every start/stop."""
 
     def __init__(self):
         self._streaming_users: Dict[str, bool] = {}
+        self._stop_events: Dict[str, LoopEvents] = {}
+        self._subscribers: Dict[Optional[str], List[StateCallback]] = {}
         self._lock = threading.Lock()
 
     def start_streaming(self, user_id: str):
         """Start streaming for a user"""
         with self._lock:
             self._streaming_users[user_id] = True
+            # stop events are not dropped here: other runs of the same user may be
+            # waiting on them; stop_streaming pops them once they have fired
+        self._notify(user_id, True)
 
     def stop_streaming(self, user_id: str):
         """Stop streaming for a user"""
         with self._lock:
             self._streaming_users[user_id] = False
+            events = self._stop_events.pop(user_id, {})
+        for loop, event in events.items():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # loop already closed
+                pass
+        self._notify(user_id, False)
+
+    def stop_local(self, user_id: str):
+        """Stop the user's runs in this process only"""
+        LocalStateManager.stop_streaming(self, user_id)
 
     def get_state(self, user_id: str) -> bool:
         """Get streaming state for a user"""
         with self._lock:
             return self._streaming_users.get(user_id, False)
 
+    def stop_event(self, user_id: str) -> asyncio.Event:
+        """Event (bound to the running loop) that is set once the user's stream stops"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._streaming_users.get(user_id, False):
+                event = asyncio.Event()
+                event.set()
+                return event
+            events = self._stop_events.setdefault(user_id, {})
+            for closed in [l for l in events if l.is_closed()]:
+                del events[closed]
+            if loop not in events:
+                events[loop] = asyncio.Event()
+            return events[loop]
+
+    async def wait_for_stop(self, user_id: str) -> None:
+        """Return as soon as the user's stream stops"""
+        await self.stop_event(user_id).wait()
+
+    async def run_unless_stopped(
+        self, user_id: str, awaitable: Awaitable
+    ) -> Tuple[bool, Any]:
+        """(False, result) of awaitable, or (True, None) when the user's stream
+        stops first, in which case the awaitable is cancelled"""
+        task = asyncio.ensure_future(awaitable)
+        stop_task = asyncio.create_task(self.wait_for_stop(user_id))
+        try:
+            await asyncio.wait({task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop_task.cancel()
+            if not task.done():
+                task.cancel()
+        if task.done() and not task.cancelled():
+            return False, task.result()
+        return True, None
+
+    def subscribe(
+        self, callback: StateCallback, user_id: Optional[str] = None
+    ) -> Callable[[], None]:
+        """Call callback(user_id, streaming) on every start/stop of user_id (of any
+        user when None), in the thread that changed the state; returns unsubscribe"""
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(user_id, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                if not callbacks:
+                    self._subscribers.pop(user_id, None)
+
+        return unsubscribe
+
+    def _notify(self, user_id: str, streaming: bool) -> None:
+        with self._lock:
+            callbacks = self._subscribers.get(user_id, []) + self._subscribers.get(
+                None, []
+            )
+        for callback in callbacks:
+            try:
+                callback(user_id, streaming)
+            except Exception as e:
+                print(f"[statemanager]: subscriber failed: {e}")
+
+
+if os.getenv("STATE_BACKEND") == "redis":
+    # shared with other worker processes; see classes/redis_state.py
+    from classes.redis_state import RedisStateManager
 
-local_state = LocalStateManager()
+    local_state = RedisStateManager()
+else:
+    local_state = LocalStateManager()
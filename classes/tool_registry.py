@@ -0,0 +1,273 @@
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from classes.cancellation import CancellationToken, ToolCancelled, run_with_token
+from classes.usage_tracker import RunUsage, run_in_scope, usage_tracker
+from classes.statemanager import local_state
+from schema import function_to_schema
+from dotenv import load_dotenv
+import inspect
+import asyncio
+import time
+import os
+
+load_dotenv()
+
+# seconds a tool call may run unless its @tool(timeout=...) needs longer; sync tools
+# are stopped through their cancellation token, async ones are cancelled
+DEFAULT_TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "120"))
+
+
+class ToolSpec:
+    """How a tool is run: sync (in a thread) or async generator, plus the
+    concurrency limit, timeout and cost class applied to it"""
+
+    __slots__ = (
+        "name",
+        "func",
+        "is_async",
+        "label",
+        "concurrency",
+        "timeout",
+        "cost",
+        "_semaphores",
+    )
+
+    def __init__(
+        self,
+        func: Callable,
+        label: str,
+        concurrency: Optional[int],
+        timeout: Optional[float],
+        cost: str,
+    ):
+        self.name = func.__name__
+        self.func = func
+        self.is_async = inspect.isasyncgenfunction(func)
+        self.label = label
+        self.concurrency = concurrency
+        self.timeout = timeout or DEFAULT_TOOL_TIMEOUT
+        self.cost = cost
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+    def slot(self) -> asyncio.Semaphore:
+        # one per event loop: batch and worker runs each bring their own loop
+        loop = asyncio.get_running_loop()
+        for closed in [l for l in self._semaphores if l.is_closed()]:
+            del self._semaphores[closed]
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency or 1_000_000)
+        return self._semaphores[loop]
+
+
+class ToolRegistry:
+    """Tools registered with @tool(...) and the executor that applies their policies"""
+
+    def __init__(self):
+        self.specs: Dict[str, ToolSpec] = {}
+
+    def tool(
+        self,
+        label: str,
+        *,
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        cost: str = "local",
+    ) -> Callable:
+        """Register the decorated function as a tool; `label` names it in progress updates.
+        cost is a coarse class ("local", "network", "vision") used for accounting."""
+
+        def register(func: Callable) -> Callable:
+            self.specs[func.__name__] = ToolSpec(
+                func, label, concurrency, timeout, cost
+            )
+            return func
+
+        return register
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        return self.specs.get(name)
+
+    def schemas(self, funcs: List[Callable]) -> List[Dict[str, Any]]:
+        return [function_to_schema(self.specs[func.__name__].func) for func in funcs]
+
+    def _done(self, spec: ToolSpec, text: str, stream_id: str) -> List[Dict[str, Any]]:
+        truncated_content = text[:100] + "..." if len(text) > 100 else text
+        return [
+            {
+                "type": "tool_progress",
+                "toolName": spec.name,
+                "progress": f"◈ {spec.label} ◈\n▸ {truncated_content}",
+                "cost": spec.cost,
+                "stream_id": stream_id,
+            },
+            {"type": "tool_result", "content": text},
+        ]
+
+    async def execute(
+        self,
+        name: str,
+        args: Dict[str, Any],
+        *,
+        creds: Any,
+        user_id: str,
+        stream_id: str,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Run a tool by name, yielding tool_progress updates and one tool_result
+        (or endOfMessage when the user stopped the call)."""
+        spec = self.specs.get(name)
+        if spec is None:
+            yield {"type": "tool_result", "content": f"Unknown tool {name}"}
+            return
+
+        # model calls made by the tool are booked on the run, under the site it works on
+        run = usage_tracker.get(user_id, stream_id)
+        site = run.visit(name, args.get("url")) if run is not None else None
+
+        # the user's stop signal cancels the call as it happens, not at the next turn
+        stop_task = asyncio.create_task(local_state.wait_for_stop(user_id))
+        try:
+            async with spec.slot():
+                if spec.is_async:
+                    text = None
+                    async for update in self._run_async(
+                        spec,
+                        args,
+                        stop_task,
+                        run,
+                        site,
+                        creds=creds,
+                        user_id=user_id,
+                        stream_id=stream_id,
+                    ):
+                        if update.get("type") == "tool_result":
+                            text = update["content"]
+                        elif update.get("type") in ("endOfMessage", "tool_progress"):
+                            yield update
+                            if update["type"] == "endOfMessage":
+                                return
+                    if text is None:
+                        text = f"{name} returned no result"
+                else:
+                    text = await self._run_sync(
+                        spec,
+                        args,
+                        stop_task,
+                        run,
+                        site,
+                        creds=creds,
+                        user_id=user_id,
+                        stream_id=stream_id,
+                    )
+                    if text is None:
+                        yield {
+                            "type": "endOfMessage",
+                            "sources": [],
+                            "stream_id": stream_id,
+                        }
+                        return
+        except (asyncio.TimeoutError, ToolCancelled):
+            text = f"{name} timed out after {spec.timeout} seconds."
+            yield {
+                "type": "tool_progress",
+                "toolName": name,
+                "progress": f"◈ Tool Timeout ◈\n▸ {text}",
+                "stream_id": stream_id,
+            }
+            yield {"type": "tool_result", "content": text}
+            return
+        except Exception as e:
+            yield {
+                "type": "tool_progress",
+                "toolName": name,
+                "progress": f"◈ Tool Error ◈\n▸ {str(e)[:100]}",
+                "stream_id": stream_id,
+            }
+            yield {"type": "tool_result", "content": f"Error executing {name}: {e}"}
+            return
+        finally:
+            stop_task.cancel()
+
+        for update in self._done(spec, text, stream_id):
+            yield update
+
+    async def _run_sync(
+        self,
+        spec: ToolSpec,
+        args: Dict[str, Any],
+        stop_task: asyncio.Task,
+        run: Optional[RunUsage],
+        site: Optional[str],
+        **kwargs: Any,
+    ) -> Optional[str]:
+        """Run a sync tool in a thread with a cancellation token that fires on stop or
+        at the deadline, so its fetches and conversions unwind; None when stopped"""
+        token = CancellationToken(spec.timeout)
+        work = run_in_scope(
+            asyncio.to_thread(run_with_token, token, spec.func, **args, **kwargs),
+            run,
+            spec.name,
+            site,
+        )
+        # an abandoned call finishes with ToolCancelled that nobody awaits; until it
+        # has unwound it keeps its browser locked (BrowserManager.session)
+        work.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            done, _ = await asyncio.wait(
+                {work, stop_task},
+                timeout=token.remaining(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            if not work.done():
+                token.cancel("stopped" if stop_task.done() else "deadline exceeded")
+        if work in done:
+            text, *_ = work.result()
+            return text
+        if stop_task in done:
+            return None
+        raise asyncio.TimeoutError()
+
+    async def _run_async(
+        self,
+        spec: ToolSpec,
+        args: Dict[str, Any],
+        stop_task: asyncio.Task,
+        run: Optional[RunUsage],
+        site: Optional[str],
+        **kwargs: Any,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Iterate an async tool, cancelling it on stop or when spec.timeout runs out"""
+        updates = spec.func(**args, **kwargs)
+        deadline = time.monotonic() + spec.timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                step = run_in_scope(updates.__anext__(), run, spec.name, site)
+                done, _ = await asyncio.wait(
+                    {step, stop_task},
+                    timeout=remaining,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if step not in done:
+                    step.cancel()
+                    await asyncio.gather(step, return_exceptions=True)
+                    if stop_task in done:
+                        yield {
+                            "type": "endOfMessage",
+                            "sources": [],
+                            "stream_id": kwargs.get("stream_id"),
+                        }
+                        return
+                    raise asyncio.TimeoutError()
+                try:
+                    update = step.result()
+                except StopAsyncIteration:
+                    return
+                yield update
+        finally:
+            await updates.aclose()
+
+
+tool_registry = ToolRegistry()
+tool = tool_registry.tool
@@ -0,0 +1,194 @@
+from classes.findings_store import SiteFindings
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+from contextvars import ContextVar, copy_context
+from dotenv import load_dotenv
+import threading
+import asyncio
+import json
+import os
+
+load_dotenv()
+
+# USD per 1M tokens: (input, cached input, output); MODEL_PRICES='{"gpt-4.1": [2, 0.5, 8]}' overrides
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "o3-mini": (1.10, 0.55, 4.40),
+    "o4-mini": (1.10, 0.275, 4.40),
+}
+MODEL_PRICES.update(
+    {
+        model: tuple(prices)
+        for model, prices in json.loads(os.getenv("MODEL_PRICES", "{}")).items()
+    }
+)
+
+# tools whose `url` argument is the page they go to, i.e. the site being worked on
+# (record_finding's url names a product page of a site that is done)
+SITE_TOOLS = ("visit_url", "screenshot")
+
+COUNTERS = (
+    "calls",
+    "input_tokens",
+    "cached_tokens",
+    "output_tokens",
+    "reasoning_tokens",
+    "image_tokens",
+    "cost_usd",
+)
+
+
+def call_cost(model: str, input_tokens: int, cached_tokens: int, output_tokens: int):
+    """USD cost of one call; 0 for models without a price"""
+    price_in, price_cached, price_out = MODEL_PRICES.get(model, (0.0, 0.0, 0.0))
+    return (
+        (input_tokens - cached_tokens) * price_in
+        + cached_tokens * price_cached
+        + output_tokens * price_out
+    ) / 1_000_000
+
+
+def _empty() -> Dict[str, float]:
+    return dict.fromkeys(COUNTERS, 0)
+
+
+class RunUsage:
+    """Model usage of one product run, broken down by (tool, site)"""
+
+    def __init__(self, product: str, websites: Optional[List[str]] = None):
+        self.product = product
+        self.finder = SiteFindings(websites or [])
+        self.current_site: Optional[str] = None
+        self.breakdown: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def visit(self, tool: str, url: Optional[str]) -> Optional[str]:
+        """Site a tool call works on, judged by the url of a SITE_TOOLS call; the
+        last visited site otherwise"""
+        listed = self.finder.match(url) if url and tool in SITE_TOOLS else None
+        if listed:
+            self.current_site = listed
+        return self.current_site
+
+    def finish(self, site: str) -> None:
+        """The agent recorded site: later calls are no longer booked on it"""
+        if self.current_site == site:
+            self.current_site = None
+
+    def add(self, tool: str, site: Optional[str], **counts: float) -> None:
+        with self._lock:
+            entry = self.breakdown.setdefault((tool, site or ""), _empty())
+            for name, value in counts.items():
+                entry[name] += value
+
+    def merge(self, other: "RunUsage", share: float = 1.0) -> None:
+        """Add `share` of another run's usage (e.g. of a synthesis call over several products)"""
+        with other._lock:
+            items = [(key, dict(entry)) for key, entry in other.breakdown.items()]
+        for (tool, site), entry in items:
+            self.add(
+                tool, site, **{name: value * share for name, value in entry.items()}
+            )
+
+    def totals(self) -> Dict[str, float]:
+        totals = _empty()
+        with self._lock:
+            for entry in self.breakdown.values():
+                for name, value in entry.items():
+                    totals[name] += value
+        return totals
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals plus one row per (tool, site), json-ready"""
+        summary = {name: round(value, 6) for name, value in self.totals().items()}
+        with self._lock:
+            summary["breakdown"] = [
+                {
+                    "tool": tool,
+                    "site": site,
+                    **{name: round(value, 6) for name, value in entry.items()},
+                }
+                for (tool, site), entry in self.breakdown.items()
+            ]
+        return summary
+
+
+class _Scope:
+    __slots__ = ("run", "tool", "site")
+
+    def __init__(self, run: RunUsage, tool: str, site: Optional[str]):
+        self.run = run
+        self.tool = tool
+        self.site = site
+
+
+_scope: ContextVar[Optional[_Scope]] = ContextVar("usage_scope", default=None)
+
+
+def run_in_scope(
+    awaitable: Awaitable, run: Optional[RunUsage], tool: str, site: str = None
+) -> asyncio.Task:
+    """Task for awaitable whose model calls (also in threads and tasks it starts)
+    are booked on run under tool / site"""
+    context = copy_context()
+    if run is not None:
+        context.run(_scope.set, _Scope(run, tool, site))
+    return asyncio.get_running_loop().create_task(awaitable, context=context)
+
+
+class UsageTracker:
+    """RunUsage of the running product runs, keyed by (user, stream) like findings_store"""
+
+    def __init__(self):
+        self._runs: Dict[Tuple[str, Optional[str]], RunUsage] = {}
+        self.unattributed = RunUsage("")
+        self._lock = threading.Lock()
+
+    def start(
+        self, user_id: str, stream_id: Optional[str], product: str, websites: List[str]
+    ) -> RunUsage:
+        run = RunUsage(product, websites)
+        with self._lock:
+            self._runs[(user_id, stream_id)] = run
+        return run
+
+    def get(self, user_id: str, stream_id: Optional[str]) -> Optional[RunUsage]:
+        with self._lock:
+            return self._runs.get((user_id, stream_id))
+
+    def pop(self, user_id: str, stream_id: Optional[str]) -> Optional[RunUsage]:
+        with self._lock:
+            return self._runs.pop((user_id, stream_id), None)
+
+    def record(self, model: str, usage: Any, image_tokens: int = 0) -> None:
+        """Book the `usage` of a responses API call on the current scope"""
+        if usage is None:
+            return
+        input_details = getattr(usage, "input_tokens_details", None)
+        output_details = getattr(usage, "output_tokens_details", None)
+        input_tokens = usage.input_tokens or 0
+        cached_tokens = getattr(input_details, "cached_tokens", 0) or 0
+        output_tokens = usage.output_tokens or 0
+        scope = _scope.get()
+        run, tool, site = (
+            (scope.run, scope.tool, scope.site)
+            if scope is not None
+            else (self.unattributed, "", None)
+        )
+        run.add(
+            tool,
+            site,
+            calls=1,
+            input_tokens=input_tokens,
+            cached_tokens=cached_tokens,
+            output_tokens=output_tokens,
+            reasoning_tokens=getattr(output_details, "reasoning_tokens", 0) or 0,
+            image_tokens=image_tokens,
+            cost_usd=call_cost(model, input_tokens, cached_tokens, output_tokens),
+        )
+
+
+usage_tracker = UsageTracker()
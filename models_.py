@@ -1,9 +1,29 @@
+from classes.usage_tracker import usage_tracker
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from utils import tokenizer
 import asyncio
 
 load_dotenv()
 
+# set by worker processes to share one request budget (see classes/rate_limiter.py)
+rate_limiter = None
+
+
+def _image_tokens(input: list, usage) -> int:
+    """usage doesn't split out image tokens; estimate them as input tokens minus the text's"""
+    if usage is None:
+        return 0
+    text_tokens = 0
+    for msg in input:
+        content = msg.get("content", "") if isinstance(msg, dict) else ""
+        parts = content if isinstance(content, list) else [{"text": content}]
+        for part in parts:
+            text_tokens += len(
+                tokenizer.encode(str(part.get("text", "")), disallowed_special=())
+            )
+    return max(0, (usage.input_tokens or 0) - text_tokens)
+
 
 async def model_call(
     input: list | str,
@@ -14,6 +34,7 @@ async def model_call(
     store=False,
     stream=False,
     json=False,
+    json_schema: dict = None,
     client_timeout: int = 100,
 ):
     """OAI endpoint"""
@@ -74,15 +95,26 @@ async def model_call(
     if tools:
         api_parameters["tools"] = tools
         api_parameters["tool_choice"] = "auto"
-    if json == "json":
+    if json_schema:
+        api_parameters["text"] = {
+            "format": {
+                "type": "json_schema",
+                "name": json_schema.get("title", "response"),
+                "schema": json_schema,
+                "strict": True,
+            }
+        }
+    elif json == "json":
         api_parameters["text"] = {"format": {"type": "json_object"}}
     else:
         api_parameters["text"] = {"format": {"type": "text"}}
 
     for attempt in range(retries):
         try:
+            if rate_limiter is not None:
+                await rate_limiter.acquire()
             response = await client.responses.create(**api_parameters)
-            return response
+            break
 
         except Exception as e:
             print(f"\n[model_call]: {e}")
@@ -92,9 +124,19 @@ async def model_call(
                 await asyncio.sleep(sleep_time)
             else:
                 print(f"\n[model_call]: Failed after {retries} attempts")
-                break
+                return None
 
-    return None
+    # accounting must never fail (or re-send) a call that went through
+    try:
+        usage = getattr(response, "usage", None)
+        usage_tracker.record(
+            model,
+            usage,
+            image_tokens=_image_tokens(input, usage) if encoded_image else 0,
+        )
+    except Exception as e:
+        print(f"\n[model_call]: usage not recorded: {e}")
+    return response
 
 
 ############################################################################################################
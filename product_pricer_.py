@@ -1,10 +1,15 @@
 from classes.keyboardmanager import keyboard_listener
 from classes.statemanager import local_state
+from classes.findings_store import findings_store
+from classes.usage_tracker import run_in_scope, usage_tracker
 from utils import ensure_user_workspace
-from schema import function_to_schema
+from classes.tool_registry import tool_registry
+from schema import precompute_schemas
 from typing import Any, Dict, List
+from synthesis_ import ResearchNotes, synthesize
 from models_ import model_call
 from web_tools_ import (
+    browser_manager,
     visit_url,
     web_search,
     find_on_page,
@@ -12,23 +17,32 @@ from web_tools_ import (
     page_down,
     page_up,
     screenshot,
+    lookup_price,
+    record_finding,
 )
 import asyncio
 import json
 import os
 
+TOOLS = [
+    web_search,
+    visit_url,
+    find_on_page,
+    find_next,
+    page_down,
+    page_up,
+    screenshot,
+    lookup_price,
+    record_finding,
+]
+
 
 def _get_tool_schemas() -> List[Dict[str, Any]]:
     """Convert selected tools into OpenAI function-schemas."""
-    return [
-        function_to_schema(web_search),
-        function_to_schema(visit_url),
-        function_to_schema(find_on_page),
-        function_to_schema(find_next),
-        function_to_schema(page_down),
-        function_to_schema(page_up),
-        function_to_schema(screenshot),
-    ]
+    return tool_registry.schemas(TOOLS)
+
+
+precompute_schemas(*TOOLS)
 
 
 async def _execute_tool_call(
@@ -37,118 +51,25 @@ async def _execute_tool_call(
     """
     Runs the requested tool and yields progress updates and final results.
     """
-    name = tool_call.name
-    raw_args = tool_call.arguments
     try:
-        args: Dict[str, Any] = json.loads(raw_args)
+        args: Dict[str, Any] = json.loads(tool_call.arguments)
     except Exception:
         args = {}
 
-    try:
-        if name == "screenshot":
-            async for update in screenshot(
-                **args, creds=creds, user_id=user_id, stream_id=stream_id
-            ):
-                if update.get("type") == "tool_result":
-                    content = update["content"]
-                    truncated_content = (
-                        content[:100] + "..." if len(content) > 100 else content
-                    )
-                    yield {
-                        "type": "tool_progress",
-                        "toolName": name,
-                        "progress": f"◈ Screenshot Analysis Complete ◈\n▸ {truncated_content}",
-                        "stream_id": stream_id,
-                    }
-                    yield {"type": "tool_result", "content": content}
-                elif update.get("type") == "endOfMessage":
-                    yield update
-                    return
-                elif update.get("type") == "tool_progress":
-                    yield update
-            return
-
-        elif name == "web_search":
-            text, *_ = web_search(**args, creds=creds, user_id=user_id)
-            truncated_content = text[:100] + "..." if len(text) > 100 else text
-            yield {
-                "type": "tool_progress",
-                "toolName": name,
-                "progress": f"◈ Web Search Complete ◈\n▸ {truncated_content}",
-                "stream_id": stream_id,
-            }
-            yield {"type": "tool_result", "content": text}
-
-        elif name == "visit_url":
-            text, *_ = visit_url(**args, creds=creds, user_id=user_id)
-            truncated_content = text[:100] + "..." if len(text) > 100 else text
-            yield {
-                "type": "tool_progress",
-                "toolName": name,
-                "progress": f"◈ Page Visit Complete ◈\n▸ {truncated_content}",
-                "stream_id": stream_id,
-            }
-            yield {"type": "tool_result", "content": text}
-
-        elif name == "find_on_page":
-            text, *_ = find_on_page(**args, creds=creds, user_id=user_id)
-            truncated_content = text[:100] + "..." if len(text) > 100 else text
-            yield {
-                "type": "tool_progress",
-                "toolName": name,
-                "progress": f"◈ Content Search Complete ◈\n▸ {truncated_content}",
-                "stream_id": stream_id,
-            }
-            yield {"type": "tool_result", "content": text}
-
-        elif name == "find_next":
-            text, *_ = find_next(**args, creds=creds, user_id=user_id)
-            truncated_content = text[:100] + "..." if len(text) > 100 else text
-            yield {
-                "type": "tool_progress",
-                "toolName": name,
-                "progress": f"◈ Search Continue Complete ◈\n▸ {truncated_content}",
-                "stream_id": stream_id,
-            }
-            yield {"type": "tool_result", "content": text}
-
-        elif name == "page_down":
-            text, *_ = page_down(**args, creds=creds, user_id=user_id)
-            truncated_content = text[:100] + "..." if len(text) > 100 else text
-            yield {
-                "type": "tool_progress",
-                "toolName": name,
-                "progress": f"◈ Page Down Complete ◈\n▸ {truncated_content}",
-                "stream_id": stream_id,
-            }
-            yield {"type": "tool_result", "content": text}
-
-        elif name == "page_up":
-            text, *_ = page_up(**args, creds=creds, user_id=user_id)
-            truncated_content = text[:100] + "..." if len(text) > 100 else text
-            yield {
-                "type": "tool_progress",
-                "toolName": name,
-                "progress": f"◈ Page Up Complete ◈\n▸ {truncated_content}",
-                "stream_id": stream_id,
-            }
-            yield {"type": "tool_result", "content": text}
-
-        else:
-            yield {"type": "tool_result", "content": f"Unknown tool {name}"}
-
-    except Exception as e:
-        yield {
-            "type": "tool_progress",
-            "toolName": name,
-            "progress": f"◈ Tool Error ◈\n▸ {str(e)[:100]}",
-            "stream_id": stream_id,
-        }
-        yield {"type": "tool_result", "content": f"Error executing {name}: {e}"}
+    async for update in tool_registry.execute(
+        tool_call.name, args, creds=creds, user_id=user_id, stream_id=stream_id
+    ):
+        yield update
 
 
-def _build_system_prompt(product: str, sites: List[str]) -> str:
+def _build_system_prompt(
+    product: str, sites: List[str], recorded: Dict[str, Dict[str, str]] = None
+) -> str:
     sites_str = "\n".join(f"• {s}" for s in sites)
+    if recorded:
+        sites_str += "\n\nAlready recorded, do not research these again:\n" + "\n".join(
+            f"• {s}: {f['status']} {f['price']}".rstrip() for s, f in recorded.items()
+        )
     return f"""You are an expert e-commerce research agent.
 
 Goal: For every site below, find the exact product page for
@@ -170,13 +91,23 @@ Rules:
 - Experiment also with searching for the product category and then filtering for the specific product.
 - Once you have a candidate URL, call visit_url to read the page to get the details. 
 - Do a deep research on each page, use find_on_page, find_next, page_down and page_up to navigate the page. 
+- If a site offers its prices as a CSV/XLSX price list, open it with visit_url and then use lookup_price instead of paging through it.
 - Some pages will have bot blockers and you will receive no content back or error. Use screenshot tool on those urls and you will receive back description produced by vision model.
 - If product truly not found, mark status 'fail' and leave price/availability empty.
 - After each tool call, write down your findings for each product as you move along.
+- As soon as you are done with a site, call record_finding for it (also when the product was not found there).
 - When you have finished researching ALL sites, end your message with: "RESEARCH_COMPLETE
 """
 
 
+def _end_run(user_id: str, stream_id: str):
+    """Drop the run's per-stream state (findings, usage, browser); returns its findings"""
+    recorded = findings_store.pop(user_id, stream_id)
+    usage_tracker.pop(user_id, stream_id)
+    browser_manager.release(user_id, stream_id)
+    return recorded
+
+
 async def product_pricer_(
     product: str,
     websites: List[str] | str,
@@ -185,9 +116,12 @@ async def product_pricer_(
     creds,
     user_id: str,
     stream_id: str,
+    defer_synthesis: bool = False,
 ):
     """
     automated tool that scrapes product prices from multiple websites.
+    with defer_synthesis the run ends with a "research_notes" event instead of the
+    per-site JSON, so the caller can batch several products into one synthesis call.
     #parameters:
     product: str #product name
     websites: List[str] | str #list of websites or a string with websites separated by commas
@@ -197,6 +131,8 @@ async def product_pricer_(
     if isinstance(websites, str):
         websites = [w.strip() for w in websites.split(",") if w.strip()]
 
+    findings_store.start(user_id, stream_id, websites)
+    usage = usage_tracker.start(user_id, stream_id, product, websites)
     system_msg = _build_system_prompt(product, websites)
     msgs: List[Dict[str, str]] = [
         {"role": "developer", "content": system_msg},
@@ -207,28 +143,30 @@ async def product_pricer_(
     ]
     tool_schemas = _get_tool_schemas()
 
-    for step in range(no_turns):
+    turns_used = 0
+    stop_reason = "turn_limit"
+    resolved_count = 0
 
-        resp = await model_call(
-            input=msgs,
-            model="gpt-4.1",
-            tools=tool_schemas,
-            store=False,
-            stream=False,
-        )
-        if not resp:
-            yield {
-                "type": "tool_result",
-                "toolName": "product_pricer",
-                "result": "Model call failed – aborting.",
-                "content": "",
-                "stream_id": stream_id,
-            }
-            return
-
-        if resp.output and isinstance(resp.output, list):
-
-            if not local_state.get_state(user_id):
+    try:
+        for step in range(no_turns):
+            turns_used = step + 1
+
+            stopped, resp = await local_state.run_unless_stopped(
+                user_id,
+                run_in_scope(
+                    model_call(
+                        input=msgs,
+                        model="gpt-4.1",
+                        tools=tool_schemas,
+                        store=False,
+                        stream=False,
+                    ),
+                    usage,
+                    "agent",
+                    usage.current_site,
+                ),
+            )
+            if stopped:
                 yield {
                     "type": "endOfMessage",
                     "sources": [],
@@ -236,108 +174,156 @@ async def product_pricer_(
                 }
                 return
 
-            for item in resp.output:
+            if not resp:
+                yield {
+                    "type": "tool_result",
+                    "toolName": "product_pricer",
+                    "result": "Model call failed – aborting.",
+                    "content": "",
+                    "stream_id": stream_id,
+                }
+                return
 
-                if item.type == "message" and getattr(item, "role", "") == "assistant":
-                    msgs.append({"role": "assistant", "content": item.content[0].text})
+            if resp.output and isinstance(resp.output, list):
 
-                    yield {
-                        "type": "tool_progress",
-                        "toolName": "product_pricer",
-                        "progress": f"◈ agent's thinking ◈ \n... {item.content[0].text}",
-                        "content": item.content[0].text,
-                        "stream_id": stream_id,
-                    }
+                for item in resp.output:
 
-                    continue
+                    if (
+                        item.type == "message"
+                        and getattr(item, "role", "") == "assistant"
+                    ):
+                        msgs.append(
+                            {"role": "assistant", "content": item.content[0].text}
+                        )
+
+                        yield {
+                            "type": "tool_progress",
+                            "toolName": "product_pricer",
+                            "progress": f"◈ agent's thinking ◈ \n... {item.content[0].text}",
+                            "content": item.content[0].text,
+                            "stream_id": stream_id,
+                        }
 
-                if item.type == "function_call":
+                        continue
 
-                    yield {
-                        "type": "tool_progress",
-                        "toolName": item.name,
-                        "progress": f"◇ initiating tool ◇ {item.name}...",
-                        "percentage": 0,
-                        "stream_id": stream_id,
-                    }
+                    if item.type == "function_call":
 
-                    tool_output = None
-                    async for update in _execute_tool_call(
-                        item, creds=creds, user_id=user_id, stream_id=stream_id
-                    ):
-                        if update["type"] == "tool_progress":
-                            yield update
-                        else:
-                            tool_output = update["content"]
-
-                    msgs.append(item)
-                    msgs.append(
-                        {
-                            "type": "function_call_output",
-                            "call_id": item.call_id,
-                            "output": tool_output,
+                        yield {
+                            "type": "tool_progress",
+                            "toolName": item.name,
+                            "progress": f"◇ initiating tool ◇ {item.name}...",
+                            "args": item.arguments,
+                            "percentage": 0,
+                            "stream_id": stream_id,
                         }
-                    )
 
-            if resp.output_text and resp.output_text.strip():
-                msgs.append({"role": "assistant", "content": resp.output_text})
-                if "RESEARCH_COMPLETE" in resp.output_text:
-                    break
+                        tool_output = None
+                        async for update in _execute_tool_call(
+                            item, creds=creds, user_id=user_id, stream_id=stream_id
+                        ):
+                            if update["type"] == "tool_progress":
+                                yield update
+                            elif update["type"] == "endOfMessage":
+                                yield update
+                                return
+                            else:
+                                tool_output = update["content"]
+
+                        msgs.append(item)
+                        msgs.append(
+                            {
+                                "type": "function_call_output",
+                                "call_id": item.call_id,
+                                "output": tool_output,
+                            }
+                        )
+
+                if resp.output_text and resp.output_text.strip():
+                    msgs.append({"role": "assistant", "content": resp.output_text})
+                    if "RESEARCH_COMPLETE" in resp.output_text:
+                        stop_reason = "research_complete"
+                        break
+
+                run = findings_store.get(user_id, stream_id)
+                if run is not None and len(run.results) > resolved_count:
+                    resolved_count = len(run.results)
+                    remaining = run.missing()
+                    if not remaining:
+                        stop_reason = "all_sites_resolved"
+                        yield {
+                            "type": "tool_progress",
+                            "toolName": "product_pricer",
+                            "progress": f"◆ All sites resolved ◆\n▸ stopped after {turns_used} of {no_turns} turns",
+                            "stream_id": stream_id,
+                        }
+                        break
+                    # drop resolved sites from the task so the agent doesn't re-verify them
+                    msgs[0] = {
+                        "role": "developer",
+                        "content": _build_system_prompt(
+                            product, remaining, run.results
+                        ),
+                    }
 
-            continue
-
-    yield {
-        "type": "tool_progress",
-        "toolName": "product_pricer",
-        "progress": "◆ Synthesis Phase ◆\n▸ Consolidating market data into structured insights...",
-        "percentage": 90,
-        "stream_id": stream_id,
-    }
+                continue
+    finally:
+        # also when the consumer closes the generator early or a call raises
+        recorded = _end_run(user_id, stream_id)
 
     assistant_notes = "\n\n".join(
         m["content"]
         for m in msgs
         if isinstance(m, dict) and m.get("role") == "assistant"
     )
+    notes = ResearchNotes(
+        product=product,
+        websites=websites,
+        notes=assistant_notes,
+        recorded=recorded.results if recorded else {},
+        usage=usage,
+    )
+    metrics = {
+        "turns_budget": no_turns,
+        "turns_used": turns_used,
+        # only the early stop on recorded findings counts as saved; RESEARCH_COMPLETE
+        # (the agent giving up or finishing by itself) was possible before
+        "turns_saved": (
+            no_turns - turns_used if stop_reason == "all_sites_resolved" else 0
+        ),
+        "stop_reason": stop_reason,
+        "sites_recorded": len(notes.recorded),
+    }
 
-    jsonize_prompt = [
-        {
-            "role": "developer",
-            "content": f"""
-Your task is to convert findings of a web agent to json. 
-From the research notes below, produce a JSON object with these exact website keys: {websites}.
-
-For each website, extract any price and availability info found. If no info was found, mark status as 'fail'.
-
-Return ONLY this JSON format:
-{{
-  "<website>": {{"status": "success|fail", "price": "...", "availability": "...", "url": "...", "notes": "..."}},
-  ...
-}}""",
-        },
-        {"role": "user", "content": f"Research notes:\n{assistant_notes}"},
-    ]
+    if defer_synthesis:
+        yield {
+            "type": "research_notes",
+            "toolName": "product_pricer",
+            "content": notes,
+            "metrics": metrics,
+            "stream_id": stream_id,
+        }
+        return
 
-    try:
-        jsonize_resp = await model_call(
-            input=jsonize_prompt,
-            model="gpt-4.1-mini",
-            store=False,
-            stream=False,
-        )
-        result_json = json.loads(jsonize_resp.output_text)
-    except Exception:
-        result_json = {
-            site: {"status": "fail", "price": "", "availability": "", "url": ""}
-            for site in websites
+    if notes.missing():
+        yield {
+            "type": "tool_progress",
+            "toolName": "product_pricer",
+            "progress": "◆ Synthesis Phase ◆\n▸ Consolidating market data into structured insights...",
+            "percentage": 90,
+            "stream_id": stream_id,
         }
 
+    (result_json,) = await synthesize([notes])
+    totals = usage.totals()
+
     yield {
         "type": "tool_result",
         "toolName": "product_pricer",
         "result": "Completed product pricer module.",
         "content": json.dumps(result_json, ensure_ascii=False, indent=2),
         "sources": "",
-        "tokens": 0,
+        "tokens": int(totals["input_tokens"] + totals["output_tokens"]),
+        "usage": usage.summary(),
+        "metrics": metrics,
         "stream_id": stream_id,
     }
@@ -1,7 +1,11 @@
-from typing import Any, Dict, get_type_hints, get_origin, get_args
+from typing import Any, Callable, Dict, List, get_type_hints, get_origin, get_args
 from pydantic import create_model, Field
+import threading
+import hashlib
 import inspect
+import copy
 import json
+import os
 
 
 def ensure_strict_json_schema(schema):
@@ -30,8 +34,69 @@ def ensure_strict_json_schema(schema):
     return schema
 
 
+SCHEMA_CACHE_PATH = os.getenv("TOOL_SCHEMA_CACHE")
+
+_schema_cache: Dict[str, Dict[str, Any]] = {}
+_schema_cache_loaded = False
+_schema_cache_lock = threading.Lock()
+
+
+def _schema_key(func: callable) -> str:
+    """changes whenever the tool's name, signature or docstring changes"""
+    parts = [
+        func.__module__,
+        func.__qualname__,
+        str(inspect.signature(func)),
+        inspect.getdoc(func) or "",
+    ]
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def _load_schema_cache() -> None:
+    global _schema_cache_loaded
+    _schema_cache_loaded = True
+    if not SCHEMA_CACHE_PATH or not os.path.exists(SCHEMA_CACHE_PATH):
+        return
+    try:
+        with open(SCHEMA_CACHE_PATH, "r", encoding="utf-8") as fh:
+            _schema_cache.update(json.load(fh))
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[schema]: ignoring schema cache {SCHEMA_CACHE_PATH}: {e}")
+
+
+def _save_schema_cache() -> None:
+    if not SCHEMA_CACHE_PATH:
+        return
+    try:
+        tmp_path = SCHEMA_CACHE_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(_schema_cache, fh)
+        os.replace(tmp_path, SCHEMA_CACHE_PATH)
+    except OSError as e:
+        print(f"[schema]: could not write schema cache {SCHEMA_CACHE_PATH}: {e}")
+
+
 def function_to_schema(func: callable) -> Dict[str, Any]:
-    """Convert a function to an OpenAI-compatible function schema."""
+    """Convert a function to an OpenAI-compatible function schema.
+    Schemas are built once per (name, signature, docstring) and cached,
+    on disk as well when TOOL_SCHEMA_CACHE points to a file."""
+    key = _schema_key(func)
+    with _schema_cache_lock:
+        if not _schema_cache_loaded:
+            _load_schema_cache()
+        schema = _schema_cache.get(key)
+        if schema is None:
+            schema = _schema_cache[key] = _build_function_schema(func)
+            _save_schema_cache()
+    return copy.deepcopy(schema)
+
+
+def precompute_schemas(*funcs: Callable) -> List[Dict[str, Any]]:
+    """Build (or load) the schemas of funcs up front, e.g. at import time"""
+    return [function_to_schema(func) for func in funcs]
+
+
+def _build_function_schema(func: callable) -> Dict[str, Any]:
     func_name = func.__name__
     sig = inspect.signature(func)
     doc = inspect.getdoc(func) or ""
@@ -0,0 +1,205 @@
+from classes.usage_tracker import RunUsage, run_in_scope
+from pydantic import BaseModel, ConfigDict, ValidationError
+from typing import Dict, List, Literal, Optional
+from utils import truncate_to_tokens
+from models_ import model_call
+from dotenv import load_dotenv
+import json
+import os
+
+load_dotenv()
+
+SYNTHESIS_MODEL = os.getenv("SYNTHESIS_MODEL", "gpt-4.1-mini")
+SYNTHESIS_BATCH = int(os.getenv("SYNTHESIS_BATCH", "5"))
+SYNTHESIS_RETRIES = int(os.getenv("SYNTHESIS_RETRIES", "2"))
+MAX_NOTES_TOKENS = 20000
+
+
+class SiteFinding(BaseModel):
+    website: str
+    status: Literal["success", "fail"]
+    price: str
+    availability: str
+    url: str
+    notes: str
+
+
+class ProductFindings(BaseModel):
+    product_index: int
+    sites: List[SiteFinding]
+
+
+class SynthesisBatch(BaseModel):
+    products: List[ProductFindings]
+
+
+class ResearchNotes(BaseModel):
+    """what one product_pricer_ run hands to synthesis"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    product: str
+    websites: List[str]
+    notes: str
+    recorded: Dict[str, Dict[str, str]] = {}
+    usage: Optional[RunUsage] = None
+
+    def missing(self) -> List[str]:
+        """websites without a finding recorded through record_finding"""
+        return [w for w in self.websites if w not in self.recorded]
+
+
+def _strict_schema(schema: dict) -> dict:
+    """pydantic schema -> OpenAI strict json_schema (every property required, no extras)"""
+    if isinstance(schema, dict):
+        if schema.get("type") == "object" and "properties" in schema:
+            schema["required"] = list(schema["properties"])
+            schema["additionalProperties"] = False
+        for value in schema.values():
+            if isinstance(value, (dict, list)):
+                _strict_schema(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            _strict_schema(value)
+    return schema
+
+
+SYNTHESIS_SCHEMA = _strict_schema(SynthesisBatch.model_json_schema())
+
+
+def _site_key(website: str) -> str:
+    return website.strip().lower().rstrip("/")
+
+
+def _fail(notes: str = "") -> Dict[str, str]:
+    return {
+        "status": "fail",
+        "price": "",
+        "availability": "",
+        "url": "",
+        "notes": notes,
+    }
+
+
+def _build_prompt(batch: List[ResearchNotes]) -> List[Dict[str, str]]:
+    sections = []
+    for index, item in enumerate(batch):
+        notes = truncate_to_tokens(item.notes, MAX_NOTES_TOKENS)
+        sections.append(
+            f"### product_index {index}: {item.product}\n"
+            f"Websites: {item.missing()}\n\n"
+            f"Research notes:\n{notes}"
+        )
+    return [
+        {
+            "role": "developer",
+            "content": """
+Your task is to convert findings of a web agent to json.
+Below are research notes for one or more products, each under its product_index.
+For every product return its product_index and one entry per listed website, using the website exactly as listed.
+
+For each website, extract any price and availability info found. If no info was found, mark status as 'fail' and leave price/availability empty.""",
+        },
+        {"role": "user", "content": "\n\n".join(sections)},
+    ]
+
+
+def _accept(
+    item: ResearchNotes, findings: ProductFindings
+) -> Optional[Dict[str, Dict[str, str]]]:
+    """per-site dict for the product, or None when a website is missing"""
+    by_site = {_site_key(f.website): f for f in findings.sites}
+    synthesized = {}
+    for website in item.missing():
+        finding = by_site.get(_site_key(website))
+        if finding is None:
+            return None
+        synthesized[website] = finding.model_dump(exclude={"website"})
+    return _merge(item, synthesized)
+
+
+def _merge(
+    item: ResearchNotes, synthesized: Dict[str, Dict[str, str]]
+) -> Dict[str, Dict[str, str]]:
+    """recorded findings plus synthesized ones, in the order the websites were given"""
+    return {
+        website: item.recorded.get(website) or synthesized[website]
+        for website in item.websites
+    }
+
+
+async def _synthesize_batch(
+    batch: List[ResearchNotes],
+) -> Dict[int, Dict[str, Dict[str, str]]]:
+    """one structured-output call; returns the entries that came back valid, by batch index"""
+    resp = await model_call(
+        input=_build_prompt(batch),
+        model=SYNTHESIS_MODEL,
+        json_schema=SYNTHESIS_SCHEMA,
+        store=False,
+        stream=False,
+    )
+    if not resp:
+        return {}
+    try:
+        entries = json.loads(resp.output_text).get("products", [])
+    except (json.JSONDecodeError, AttributeError) as e:
+        print(f"[synthesis]: unparseable response: {e}")
+        return {}
+
+    accepted = {}
+    for entry in entries:
+        try:
+            findings = ProductFindings.model_validate(entry)
+        except ValidationError as e:
+            print(f"[synthesis]: invalid entry: {e}")
+            continue
+        if not 0 <= findings.product_index < len(batch):
+            continue
+        result = _accept(batch[findings.product_index], findings)
+        if result is not None:
+            accepted[findings.product_index] = result
+    return accepted
+
+
+async def synthesize(
+    items: List[ResearchNotes],
+    batch_size: int = SYNTHESIS_BATCH,
+    retries: int = SYNTHESIS_RETRIES,
+) -> List[Dict[str, Dict[str, str]]]:
+    """Turn research notes into per-site results, batch_size products per call.
+    Products whose websites all have a recorded finding need no call at all.
+    Only entries that come back malformed or incomplete are retried; what still
+    fails after `retries` extra calls is marked 'fail' site by site."""
+    results: List[Optional[Dict[str, Dict[str, str]]]] = [
+        None if item.missing() else _merge(item, {}) for item in items
+    ]
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    for _ in range(retries + 1):
+        if not pending:
+            break
+        for start in range(0, len(pending), batch_size):
+            indexes = pending[start : start + batch_size]
+            batch = [items[i] for i in indexes]
+            # one call serves the whole batch; each product carries an equal share
+            batch_usage = RunUsage("synthesis")
+            accepted = await run_in_scope(
+                _synthesize_batch(batch), batch_usage, "synthesis"
+            )
+            for item in batch:
+                if item.usage is not None:
+                    item.usage.merge(batch_usage, share=1 / len(batch))
+            for batch_index, result in accepted.items():
+                results[indexes[batch_index]] = result
+        pending = [i for i in pending if results[i] is None]
+
+    for i in pending:
+        results[i] = _merge(
+            items[i],
+            {
+                website: _fail("could not structure the research notes")
+                for website in items[i].missing()
+            },
+        )
+    return results
@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from classes.job_queue import RedisJobQueue
+
+
+@pytest.fixture
+def job_queue():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    return RedisJobQueue(client, name="test:jobs", lease_seconds=30, max_attempts=2)
+
+
+def _expire(job_queue, job):
+    job_queue.client.zadd(job_queue.leases_key, {job.id: time.time() - 1})
+    job_queue._next_requeue = 0.0
+
+
+def test_enqueue_products_one_job_per_pair(job_queue):
+    job_ids = job_queue.enqueue_products(
+        ["milk", "bread"], ["a.at", "b.at"], no_turns=3
+    )
+    assert len(job_ids) == 4
+    job = job_queue.lease()
+    assert job.payload == {"product": "milk", "website": "a.at", "no_turns": 3}
+    assert job.attempts == 1
+    assert job_queue.stats() == {"pending": 3, "processing": 1, "done": 0, "dead": 0}
+
+
+def test_complete_stores_result(job_queue):
+    (job_id,) = job_queue.enqueue_products(["milk"], ["a.at"])
+    job = job_queue.lease()
+    assert job_queue.complete(job, {"price": "1"})
+    assert job_queue.results([job_id])[job_id]["result"] == {"price": "1"}
+    assert job_queue.stats()["processing"] == 0
+    assert job_queue.remaining([job_id]) == 0
+
+
+def test_expired_lease_is_requeued_and_old_owner_loses_it(job_queue):
+    job_queue.enqueue_products(["milk"], ["a.at"])
+    first = job_queue.lease()
+    _expire(job_queue, first)
+
+    second = job_queue.lease()
+    assert second.id == first.id
+    assert second.attempts == 2
+    assert not job_queue.complete(first, {"price": "stale"})
+    assert not job_queue.extend(first)
+    assert not job_queue.fail(first, "stale")
+    assert job_queue.complete(second, {"price": "1"})
+    assert job_queue.results()[second.id]["result"] == {"price": "1"}
+
+
+def test_extend_keeps_the_lease(job_queue):
+    job_queue.enqueue_products(["milk"], ["a.at"])
+    job = job_queue.lease()
+    _expire(job_queue, job)
+    assert job_queue.extend(job)
+    assert job_queue.requeue_expired() == 0
+    assert job_queue.lease() is None
+
+
+def test_fail_retries_then_dead_letters(job_queue):
+    (job_id,) = job_queue.enqueue_products(["milk"], ["a.at"])
+    assert job_queue.fail(job_queue.lease(), "boom")
+    assert job_queue.stats()["pending"] == 1
+    assert job_queue.fail(job_queue.lease(), "boom again")
+    assert job_queue.lease() is None
+    (dead,) = job_queue.dead_jobs()
+    assert dead["job_id"] == job_id
+    assert dead["attempts"] == 2
+    assert dead["error"] == "boom again"
+    assert job_queue.remaining([job_id]) == 0
+
+
+def test_release_hands_back_without_counting_an_attempt(job_queue):
+    job_queue.enqueue_products(["milk", "bread"], ["a.at"])
+    first = job_queue.lease()
+    for _ in range(job_queue.max_attempts + 1):
+        assert job_queue.release(first)
+        # back at the front of the queue, attempts unchanged
+        first = job_queue.lease()
+        assert first.payload["product"] == "milk"
+        assert first.attempts == 1
+    assert job_queue.stats() == {"pending": 1, "processing": 1, "done": 0, "dead": 0}
+
+
+def test_orphaned_processing_job_gets_a_lease(job_queue):
+    (job_id,) = job_queue.enqueue_products(["milk"], ["a.at"])
+    # a worker died between moving the job and writing its lease
+    job_queue.client.lmove(
+        job_queue.pending_key, job_queue.processing_key, "RIGHT", "LEFT"
+    )
+    job_queue.requeue_expired()
+    assert job_queue.client.zscore(job_queue.leases_key, job_id) is not None
+
+
+def test_requeue_is_throttled_between_leases(job_queue):
+    job_queue.enqueue_products(["milk"], ["a.at", "b.at"])
+    job = job_queue.lease()
+    job_queue.client.zadd(job_queue.leases_key, {job.id: time.time() - 1})
+    # within requeue_interval of the last sweep, lease() doesn't look at leases
+    assert job_queue.lease().id != job.id
+    assert job_queue.lease() is None
+    job_queue._next_requeue = 0.0
+    assert job_queue.lease().id == job.id
+
+
+def test_clear(job_queue):
+    job_queue.enqueue_products(["milk"], ["a.at"])
+    job_queue.clear()
+    assert job_queue.stats() == {"pending": 0, "processing": 0, "done": 0, "dead": 0}
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from classes.redis_state import RedisStateManager
+
+
+@pytest.fixture
+def managers():
+    """Two managers on one server, as in two worker processes"""
+    server = fakeredis.FakeServer()
+    pair = [
+        RedisStateManager(
+            fakeredis.FakeRedis(server=server, decode_responses=True), prefix="test"
+        )
+        for _ in range(2)
+    ]
+    yield pair
+    for manager in pair:
+        manager.close()
+
+
+def _seen(manager, user_id, streaming):
+    """Event set once `manager` is told (through its listener) that user_id's stream started/stopped"""
+    event = threading.Event()
+    manager.subscribe(
+        lambda _, state: state == streaming and event.set(), user_id=user_id
+    )
+    return event
+
+
+def test_stop_reaches_other_manager(managers):
+    a, b = managers
+    started, stopped = _seen(b, "u", True), _seen(b, "u", False)
+    a.start_streaming("u")
+    assert started.wait(2)
+    assert b.get_state("u")
+
+    a.stop_streaming("u")
+    assert stopped.wait(2)
+    assert not b.get_state("u")
+
+
+def test_stop_local_stays_in_its_process(managers):
+    a, b = managers
+    a.start_streaming("u")
+    a.stop_local("u")
+    assert b.get_state("u")
+
+
+def test_wait_for_stop_returns_on_remote_stop(managers):
+    a, b = managers
+    a.start_streaming("u")
+
+    async def main():
+        waiter = asyncio.create_task(b.wait_for_stop("u"))
+        await asyncio.sleep(0.2)
+        assert not waiter.done()
+        a.stop_streaming("u")
+        await asyncio.wait_for(waiter, 2)
+
+    asyncio.run(main())
+
+
+def test_wait_for_stop_returns_at_once_when_not_streaming(managers):
+    a, b = managers
+    a.start_streaming("u")
+    a.stop_streaming("u")
+
+    async def main():
+        await asyncio.wait_for(b.wait_for_stop("u"), 0.5)
+        await asyncio.wait_for(b.wait_for_stop("never-started"), 0.5)
+
+    asyncio.run(main())
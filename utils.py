@@ -1,16 +1,30 @@
 from difflib import get_close_matches
-from typing import List, Dict
-from PIL import Image
+from typing import List, Dict, Optional, Tuple
+from PIL import Image, ImageStat
+import numpy as np
 import tiktoken
 import base64
 import io
 import os
+import re
 
 ############################################################################################################
 ##tokenizer
 
 tokenizer = tiktoken.get_encoding("cl100k_base")
 
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens"""
+    tokens = tokenizer.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return (
+        tokenizer.decode(tokens[:max_tokens])
+        + "\n\n[... truncated to fit token budget]"
+    )
+
+
 ############################################################################################################
 
 
@@ -24,13 +38,99 @@ def ensure_user_workspace(user_id: str) -> str:
 ############################################################################################################
 
 
-def sanitize_and_encode_image(file_path):
+_CURRENCY = r"(€|EUR|\$|USD|£|GBP|CHF|Fr\.)"
+_AMOUNT = r"\d+(?:[.,'’]\d{3})*[.,]\d{2}"
+_PRICE_RE = re.compile(
+    rf"{_CURRENCY}\s*{_AMOUNT}|{_AMOUNT}\s*{_CURRENCY}", re.IGNORECASE
+)
+# easyocr is optional (see readme): None until first use, False if it isn't installed
+_ocr_reader = None
+
+
+def _find_price_region(
+    img: Image.Image, margin: int = 400
+) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box around price-like text found by OCR, None if easyocr is not installed or nothing matched"""
+    global _ocr_reader
+    if _ocr_reader is False:
+        return None
+    try:
+        import easyocr
+    except ImportError:
+        print(
+            "[utils]: easyocr is not installed, screenshots are not cropped to the price region"
+        )
+        _ocr_reader = False
+        return None
+    if _ocr_reader is None:
+        _ocr_reader = easyocr.Reader(["de", "en"], gpu=False, verbose=False)
+
+    boxes = [
+        bbox
+        for bbox, text, _ in _ocr_reader.readtext(np.array(img))
+        if _PRICE_RE.search(text)
+    ]
+    if not boxes:
+        return None
+    xs = [p[0] for bbox in boxes for p in bbox]
+    ys = [p[1] for bbox in boxes for p in bbox]
+    return (
+        max(0, int(min(xs)) - margin),
+        max(0, int(min(ys)) - margin),
+        min(img.width, int(max(xs)) + margin),
+        min(img.height, int(max(ys)) + margin),
+    )
+
+
+def image_dhash(file_path: str, hash_size: int = 16) -> int:
+    """Perceptual difference hash (hash_size * hash_size bits) - near-identical renders differ in only a few bits"""
+    with Image.open(file_path) as img:
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def prepare_screenshot_images(
+    file_path: str,
+    max_width: int = 768,
+    tile_height: int = 1536,
+    max_tiles: int = 8,
+    crop_to_prices: bool = False,
+    blank_stddev: float = 4.0,
+    quality: int = 80,
+) -> Tuple[List[str], int]:
+    """Downscale a (full-page) screenshot to the vision model's working resolution,
+    cut it into tiles, drop blank ones and return the first max_tiles as jpeg data
+    uris, plus the number of non-blank tiles cut off below them"""
     with Image.open(file_path) as img:
         img = img.convert("RGB")
+
+    if crop_to_prices:
+        region = _find_price_region(img)
+        if region:
+            img = img.crop(region)
+
+    if img.width > max_width:
+        img = img.resize(
+            (max_width, round(img.height * max_width / img.width)), Image.LANCZOS
+        )
+
+    tiles = [
+        img.crop((0, top, img.width, min(top + tile_height, img.height)))
+        for top in range(0, img.height, tile_height)
+    ]
+    kept = [
+        t for t in tiles if ImageStat.Stat(t.convert("L")).stddev[0] >= blank_stddev
+    ] or tiles[:1]
+
+    encoded = []
+    for tile in kept[:max_tiles]:
         buffer = io.BytesIO()
-        img.save(buffer, format="JPEG")
+        tile.save(buffer, format="JPEG", quality=quality, optimize=True)
         base64_encoded = base64.b64encode(buffer.getvalue()).decode("utf-8")
-        return f"data:image/jpeg;base64,{base64_encoded}"
+        encoded.append(f"data:image/jpeg;base64,{base64_encoded}")
+    return encoded, max(0, len(kept) - max_tiles)
 
 
 #############################################################################################################
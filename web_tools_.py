@@ -1,170 +1,372 @@
+from classes.price_table import TABULAR_EXTENSIONS, price_tables
+from classes.screenshot_cache import ScreenshotCache
+from classes.findings_store import findings_store
+from classes.usage_tracker import usage_tracker
+from classes.tool_registry import tool
 from classes.browser_manager import BrowserManager
 from classes.statemanager import local_state
-from utils import sanitize_and_encode_image
+from utils import image_dhash, prepare_screenshot_images, truncate_to_tokens
 from models_ import model_call
+from urllib.parse import unquote
 from typing import Any
 import asyncio
 import time
+import os
 
 browser_manager = BrowserManager()
+screenshot_cache = ScreenshotCache()
 
+MAX_TOOL_TOKENS = 30000
 
-def web_search(query: str, filter_year: int = None, *, creds: Any, user_id: str) -> str:
+
+async def closing_connections(awaitable):
+    """Await an entry point's coroutine, then close the pooled screenshot
+    connections of its event loop (wrap what is passed to asyncio.run)"""
+    try:
+        return await awaitable
+    finally:
+        await browser_manager.screenshot_client.aclose()
+
+
+def _render_state(browser, max_tokens: int) -> str:
+    """header + current viewport, capped at max_tokens"""
+    header, content = browser._state()
+    result = header.strip() + "\n=======================\n" + content
+    return truncate_to_tokens(result, max_tokens)
+
+
+@tool("Web Search Complete", cost="network")
+def web_search(
+    query: str,
+    filter_year: int = None,
+    *,
+    creds: Any,
+    user_id: str,
+    stream_id: str = None,
+) -> str:
     """search the web for information
     #parameters:
     query: a text query to search for in the web
     filter_year: OPTIONAL year filter (e.g., 2020)
     """
-    max_tokens = 30000
-    browser = browser_manager.get_browser(user_id)
-    browser.visit_page(f"google: {query}", filter_year=None)
-    header, content = browser._state()
-    result = header.strip() + "\n=======================\n" + content
-    return result, result, "", max_tokens
+    max_tokens = MAX_TOOL_TOKENS
+    with browser_manager.session(user_id, stream_id) as browser:
+        browser.visit_page(f"google: {query}", filter_year=None)
+        result = _render_state(browser, max_tokens)
+        return result, result, "", max_tokens
 
 
-def visit_url(url: str, *, creds: Any, user_id: str) -> str:
+# downloads and converts whole files (PDF price lists), so it gets more than the default
+@tool("Page Visit Complete", timeout=180, cost="network")
+def visit_url(url: str, *, creds: Any, user_id: str, stream_id: str = None) -> str:
     """Visit a webpage at a given URL and return its text. Given a url to a YouTube video, this returns the transcript. if you give this file url like "https://example.com/file.pdf", it will download that file and then you can use text_file tool on it.
     #parameters:
-    url: the relative or absolute url of the webapge to visit
+    url: the relative or absolute url of the webapge to visit, or a link number like "3" from the current page
     """
-    max_tokens = 30000
-    browser = browser_manager.get_browser(user_id)
-    browser.visit_page(url)
-    header, content = browser._state()
-    result = header.strip() + "\n=======================\n" + content
-    return result, result, url, max_tokens
+    max_tokens = MAX_TOOL_TOKENS
+    with browser_manager.session(user_id, stream_id) as browser:
+        browser.visit_page(url)
+        result = _render_state(browser, max_tokens)
+        return result, result, url, max_tokens
 
 
-def page_up(creds: Any, user_id: str) -> str:
+@tool("Page Up Complete")
+def page_up(creds: Any, user_id: str, stream_id: str = None) -> str:
     """Scroll up one page."""
-    max_tokens = 30000
-    browser = browser_manager.get_browser(user_id)
-    browser.page_up()
-    header, content = browser._state()
-    result = header.strip() + "\n=======================\n" + content
-    return result, result, "", max_tokens
+    max_tokens = MAX_TOOL_TOKENS
+    with browser_manager.session(user_id, stream_id) as browser:
+        browser.page_up()
+        result = _render_state(browser, max_tokens)
+        return result, result, "", max_tokens
 
 
-def page_down(creds: Any, user_id: str) -> str:
+@tool("Page Down Complete")
+def page_down(creds: Any, user_id: str, stream_id: str = None) -> str:
     """Scroll down one page."""
-    max_tokens = 30000
-    browser = browser_manager.get_browser(user_id)
-    browser.page_down()
-    header, content = browser._state()
-    result = header.strip() + "\n=======================\n" + content
-    return result, result, "", max_tokens
+    max_tokens = MAX_TOOL_TOKENS
+    with browser_manager.session(user_id, stream_id) as browser:
+        browser.page_down()
+        result = _render_state(browser, max_tokens)
+        return result, result, "", max_tokens
 
 
-def find_on_page(search_string: str, *, creds: Any, user_id: str) -> str:
+@tool("Content Search Complete")
+def find_on_page(
+    search_string: str, *, creds: Any, user_id: str, stream_id: str = None
+) -> str:
     """Scroll the viewport to the first occurrence of the search string. This is equivalent to Ctrl+F.
     #parameters:
     search_string: The string to search for; supports wildcards like '*'
     """
-    max_tokens = 30000
-    browser = browser_manager.get_browser(user_id)
-    result = browser.find_on_page(search_string)
-    header, content = browser._state()
-    if result is None:
-        return (
-            (
-                header.strip()
-                + f"\n=======================\nThe search string '{search_string}' was not found on this page."
-            ),
-            "",
-            "",
-            5000,
-        )
-    end_result = header.strip() + "\n=======================\n" + content
-    return end_result, end_result, "", max_tokens
+    max_tokens = MAX_TOOL_TOKENS
+    with browser_manager.session(user_id, stream_id) as browser:
+        result = browser.find_on_page(search_string)
+        if result is None:
+            header, _ = browser._state()
+            return (
+                (
+                    header.strip()
+                    + f"\n=======================\nThe search string '{search_string}' was not found on this page."
+                ),
+                "",
+                "",
+                5000,
+            )
+        end_result = _render_state(browser, max_tokens)
+        return end_result, end_result, "", max_tokens
 
 
-def find_next(creds: Any, user_id: str) -> str:
-    max_tokens = 30000
-    browser = browser_manager.get_browser(user_id)
-    result = browser.find_next()
-    header, content = browser._state()
-    if result is None:
+@tool("Search Continue Complete")
+def find_next(creds: Any, user_id: str, stream_id: str = None) -> str:
+    max_tokens = MAX_TOOL_TOKENS
+    with browser_manager.session(user_id, stream_id) as browser:
+        result = browser.find_next()
+        if result is None:
+            header, _ = browser._state()
+            return (
+                (
+                    header.strip()
+                    + "\n=======================\nNo further occurrences found."
+                ),
+                "",
+                "",
+                max_tokens,
+            )
+        end_result = _render_state(browser, max_tokens)
         return (
-            (
-                header.strip()
-                + "\n=======================\nNo further occurrences found."
-            ),
-            "",
+            end_result,
+            end_result,
             "",
             max_tokens,
         )
-    end_result = header.strip() + "\n=======================\n" + content
-    return (
-        end_result,
-        end_result,
-        "",
-        max_tokens,
-    )
 
 
+def _find_price_list(browser, file: str = None) -> str:
+    """explicit file, else the tabular file open in the browser, else the newest tabular download"""
+    if file:
+        if file.startswith("file://"):
+            return os.path.normpath(unquote(file[7:]))
+        if not os.path.isabs(file) and browser.downloads_folder:
+            return os.path.join(browser.downloads_folder, os.path.basename(file))
+        return file
+    if browser.address.startswith("file://") and browser.address.lower().endswith(
+        TABULAR_EXTENSIONS
+    ):
+        return os.path.normpath(unquote(browser.address[7:]))
+    if browser.downloads_folder and os.path.isdir(browser.downloads_folder):
+        downloads = [
+            os.path.join(browser.downloads_folder, f)
+            for f in os.listdir(browser.downloads_folder)
+            if f.lower().endswith(TABULAR_EXTENSIONS)
+        ]
+        if downloads:
+            return max(downloads, key=os.path.getmtime)
+    return None
+
+
+@tool("Price Lookup Complete")
+def lookup_price(
+    product: str, file: str = None, *, creds: Any, user_id: str, stream_id: str = None
+) -> str:
+    """Look up a product in a downloaded CSV/XLSX price list and return the best matching rows with their prices, instead of paging through the list.
+    #parameters:
+    product: the product name to look up (fuzzy matched against the product-name column)
+    file: OPTIONAL file name or url of the price list; defaults to the price list currently open, or the last one downloaded
+    """
+    max_tokens = MAX_TOOL_TOKENS
+    with browser_manager.session(user_id, stream_id) as browser:
+        path = _find_price_list(browser, file)
+        if path is None:
+            result = "No CSV/XLSX price list has been downloaded yet. Use visit_url on the price list url first."
+            return result, "", "", max_tokens
+        try:
+            table = price_tables.get(path)
+        except FileNotFoundError:
+            result = f"Price list not found: {path}"
+            return result, "", "", max_tokens
+        except Exception as e:
+            result = f"Could not read price list {path}: {e}"
+            return result, "", "", max_tokens
+        result = truncate_to_tokens(table.format_matches(product), max_tokens)
+        return result, result, path, max_tokens
+
+
+@tool("Finding Recorded")
+def record_finding(
+    website: str,
+    price: str,
+    availability: str,
+    url: str,
+    notes: str,
+    *,
+    creds: Any,
+    user_id: str,
+    stream_id: str = None,
+) -> str:
+    """Record the final finding for one of the websites you were asked to research. Call it once per website as soon as you are done with it, also when the product was not found there (leave price empty).
+    #parameters:
+    website: the website as listed in your task
+    price: the price with currency, empty if not found
+    availability: e.g. 'in-stock', 'sold out', empty if not found
+    url: the exact url of the product page, empty if not found
+    notes: any additional notes about your research
+    """
+    max_tokens = MAX_TOOL_TOKENS
+    finding = {
+        "status": "success" if price.strip() else "fail",
+        "price": price.strip(),
+        "availability": availability.strip(),
+        "url": url.strip(),
+        "notes": notes.strip(),
+    }
+    listed = findings_store.record(user_id, stream_id, website, finding)
+    usage = usage_tracker.get(user_id, stream_id)
+    if usage is not None and listed is not None:
+        usage.finish(listed)
+    run = findings_store.get(user_id, stream_id)
+    if run is None:
+        result = "No product research is running; nothing was recorded."
+    elif listed is None:
+        result = f"'{website}' is not one of the websites to research: {run.websites}"
+    else:
+        missing = run.missing()
+        result = f"Recorded {finding['status']} for {listed}. " + (
+            f"Still to research: {missing}" if missing else "All websites are recorded."
+        )
+    return result, result, "", max_tokens
+
+
+@tool(
+    "Screenshot Analysis Complete",
+    concurrency=int(os.getenv("VISION_CONCURRENCY", "4")),
+    timeout=300,  # the render alone may take 240s, plus the vision call
+    cost="vision",
+)
 async def screenshot(url: str, query: str, *, creds: Any, user_id: str, stream_id: str):
     """Take a screenshot of a given url.
     #parameters:
     url: url of the web to take screenshot of
     query: what are you looking for in the screenshot
     """
-    max_tokens = 30000
-    browser = browser_manager.get_browser(user_id)
-    img_path = browser.screenshot(url)
+    max_tokens = MAX_TOOL_TOKENS
+
+    cached = screenshot_cache.get(url, query)
+    if cached is not None:
+        yield {
+            "type": "tool_result",
+            "toolName": "screenshot",
+            "result": f"Screenshot model analysis (cached):\n {cached.vision_text}",
+            "content": cached.vision_text,
+            "sources": "",
+            "tokens": max_tokens,
+            "stream_id": stream_id,
+        }
+        return
+
+    browser = browser_manager.get_browser(user_id, stream_id)
+    img_path = await browser.screenshot_async(url)
+    if not os.path.isfile(img_path):  # capture returns an error message instead
+        yield {
+            "type": "tool_result",
+            "toolName": "screenshot",
+            "result": img_path,
+            "content": img_path,
+            "sources": "",
+            "tokens": max_tokens,
+            "stream_id": stream_id,
+        }
+        return
     try:
-        encoded_string = sanitize_and_encode_image(img_path)
+        phash = image_dhash(img_path)
+        similar = screenshot_cache.find_similar(phash, url, query)
+        if similar is not None:
+            screenshot_cache.put(url, query, img_path, phash, similar.vision_text)
+            yield {
+                "type": "tool_result",
+                "toolName": "screenshot",
+                "result": f"Screenshot model analysis (identical render):\n {similar.vision_text}",
+                "content": similar.vision_text,
+                "sources": "",
+                "tokens": max_tokens,
+                "stream_id": stream_id,
+            }
+            return
+
+        # decoding, resizing and encoding a full-page render is CPU work, keep it off the loop
+        encoded_images, cut_off = await asyncio.to_thread(
+            prepare_screenshot_images, img_path, crop_to_prices=True
+        )
+        prompt = query
+        if cut_off:
+            prompt += (
+                f"\n\nNote: the page is longer than shown; the lowest {cut_off} part(s)"
+                " of it were cut off. If the price isn't visible, say so instead of guessing."
+            )
         model_task = asyncio.create_task(
             model_call(
-                input=query,
-                encoded_image=encoded_string,
+                input=prompt,
+                encoded_image=encoded_images,
                 client_timeout=240,
             )
         )
         percentage = 10
-        start_time = time.time()
         timeout = 240
         delay_between_updates = 5
+        deadline = time.monotonic() + timeout
+        stop_task = asyncio.create_task(local_state.wait_for_stop(user_id))
 
-        while not model_task.done():
-            yield {
-                "type": "tool_progress",
-                "toolName": "screenshot",
-                "progress": f"◈ vision model working on the screenshot... ◈ ({percentage}%)",
-                "percentage": percentage,
-                "stream_id": stream_id,
-            }
-
-            if not local_state.get_state(user_id):
-                model_task.cancel()
+        try:
+            while True:
                 yield {
-                    "type": "endOfMessage",
-                    "sources": [],
+                    "type": "tool_progress",
+                    "toolName": "screenshot",
+                    "progress": f"◈ vision model working on the screenshot... ◈ ({percentage}%)",
+                    "percentage": percentage,
                     "stream_id": stream_id,
                 }
-                return
 
-            await asyncio.sleep(delay_between_updates)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield {
+                        "type": "tool_result",
+                        "toolName": "screenshot",
+                        "result": f"Screenshot model timed out after {timeout} seconds",
+                        "content": f"Screenshot model timed out after {timeout} seconds",
+                        "sources": "",
+                        "tokens": max_tokens,
+                        "stream_id": stream_id,
+                    }
+                    return
+
+                done, _ = await asyncio.wait(
+                    {model_task, stop_task},
+                    timeout=min(delay_between_updates, remaining),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if stop_task in done:
+                    yield {
+                        "type": "endOfMessage",
+                        "sources": [],
+                        "stream_id": stream_id,
+                    }
+                    return
+
+                if model_task in done:
+                    break
 
-            if time.time() - start_time > timeout:
+                if percentage >= 90:
+                    percentage = 50
+                else:
+                    percentage = min(percentage + 10, 90)
+        finally:
+            stop_task.cancel()
+            if not model_task.done():
                 model_task.cancel()
-                yield {
-                    "type": "tool_result",
-                    "toolName": "screenshot",
-                    "result": f"Screenshot model timed out after 3 minutes",
-                    "content": f"Screenshot model timed out after 3 minutes",
-                    "sources": "",
-                    "tokens": max_tokens,
-                    "stream_id": stream_id,
-                }
-                return
 
-            if percentage >= 90:
-                percentage = 50
-            else:
-                percentage = min(percentage + 10, 90)
         response = await model_task
         vision_result = response.output_text
+        screenshot_cache.put(url, query, img_path, phash, vision_result)
         yield {
             "type": "tool_result",
             "toolName": "screenshot",
@@ -0,0 +1,480 @@
+from agent_ import console, create_results_table, save_results
+from synthesis_ import SYNTHESIS_BATCH, synthesize
+from product_pricer_ import product_pricer_
+from web_tools_ import closing_connections
+from classes.keyboardmanager import keyboard_listener
+from classes.rate_limiter import SharedRateLimiter
+from classes.statemanager import local_state
+from classes.job_queue import Job, RedisJobQueue
+from rich.prompt import Prompt, IntPrompt
+from rich.panel import Panel
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+import multiprocessing
+import models_
+import threading
+import asyncio
+import queue
+import sys
+import os
+
+load_dotenv()
+
+# with STATE_BACKEND=redis the products go through a RedisJobQueue, one job per
+# (product, website), so consumers on other machines can share the work
+USE_JOB_QUEUE = os.getenv("STATE_BACKEND") == "redis"
+JOB_QUEUE = os.getenv("JOB_QUEUE", "pricer:jobs")
+
+
+############################################################################################################
+## worker side
+
+
+async def _synthesize_and_report(pending: List[Tuple], events) -> None:
+    if not pending:
+        return
+    results = await synthesize([notes for notes, _ in pending])
+    for (notes, metrics), data in zip(pending, results):
+        usage = notes.usage.summary() if notes.usage else None
+        events.put(("result", notes.product, data, metrics, usage))
+    pending.clear()
+
+
+def _watch_stop(stop, user_id: str) -> None:
+    """the parent's stop reaches this process' runs through local_state (only
+    here: with STATE_BACKEND=redis the same user may run on other machines)"""
+    threading.Thread(
+        target=lambda: (stop.wait(), local_state.stop_local(user_id)),
+        daemon=True,
+    ).start()
+
+
+async def _price(
+    product: str, websites: List[str], no_turns: int, user_id: str, stream_id: str
+) -> Optional[Tuple]:
+    """(research notes, metrics) of one product_pricer_ run; None when it was stopped"""
+    async for out in product_pricer_(
+        product=product,
+        websites=websites,
+        no_turns=no_turns,
+        creds=None,
+        user_id=user_id,
+        stream_id=stream_id,
+        defer_synthesis=True,
+    ):
+        if out["type"] == "research_notes":
+            return out["content"], out["metrics"]
+        if out["type"] == "endOfMessage":
+            return None
+        if out["type"] == "tool_result":
+            raise RuntimeError(out["result"])
+    return None
+
+
+async def _worker_loop(
+    index: int,
+    jobs,
+    events,
+    stop,
+    websites: List[str],
+    no_turns: int,
+    user_id: str,
+    runs_per_process: int,
+) -> None:
+    _watch_stop(stop, user_id)
+    pending: List[Tuple] = []
+
+    async def run(slot: int) -> None:
+        while not stop.is_set():
+            try:
+                product = await asyncio.to_thread(jobs.get, True, 0.5)
+            except queue.Empty:
+                continue
+            if product is None:
+                return
+            events.put(("started", index, product))
+            try:
+                priced = await _price(
+                    product, websites, no_turns, user_id, f"worker{index}-{slot}"
+                )
+            except Exception as e:
+                events.put(("error", index, product, str(e)))
+                continue
+            if priced is None:
+                return
+            pending.append(priced)
+            if len(pending) >= SYNTHESIS_BATCH:
+                await _synthesize_and_report(pending, events)
+
+    await asyncio.gather(*(run(slot) for slot in range(runs_per_process)))
+    await _synthesize_and_report(pending, events)
+
+
+async def _job_worker_loop(
+    index: int, queue_name: str, events, stop, runs_per_process: int
+) -> None:
+    """Lease (product, website) jobs from the Redis queue until none are left anywhere.
+    Leases are renewed while a job is researched or waits for its synthesis batch."""
+    job_queue = RedisJobQueue(name=queue_name)
+    held: Dict[str, Job] = {}
+    pending: List[Tuple] = []
+    watched_users = set()
+
+    async def keep_leases() -> None:
+        while True:
+            await asyncio.sleep(job_queue.lease_seconds / 3)
+            for job in list(held.values()):
+                if not await asyncio.to_thread(job_queue.extend, job):
+                    held.pop(job.id, None)
+
+    async def flush() -> None:
+        if not pending:
+            return
+        batch = pending[:]
+        pending.clear()
+        try:
+            results = await synthesize([notes for notes, _, _ in batch])
+        except Exception as e:
+            for notes, _, job in batch:
+                held.pop(job.id, None)
+                await asyncio.to_thread(job_queue.fail, job, str(e))
+                events.put(("error", index, notes.product, str(e)))
+            return
+        for (notes, metrics, job), data in zip(batch, results):
+            held.pop(job.id, None)
+            usage = notes.usage.summary() if notes.usage else None
+            result = {"data": data, "metrics": metrics, "usage": usage}
+            if await asyncio.to_thread(job_queue.complete, job, result):
+                events.put(("result", notes.product, data, metrics, usage))
+            else:
+                events.put(("error", index, notes.product, "lease lost"))
+
+    async def run(slot: int) -> None:
+        while not stop.is_set():
+            job = await asyncio.to_thread(job_queue.lease, 1)
+            if job is None:
+                # our own batch keeps jobs in processing; settle it before deciding
+                await flush()
+                stats = await asyncio.to_thread(job_queue.stats)
+                if not stats["pending"] and not stats["processing"]:
+                    return
+                continue
+            held[job.id] = job
+            payload = job.payload
+            user_id = payload.get("user_id", "localUser")
+            if user_id not in watched_users:
+                watched_users.add(user_id)
+                _watch_stop(stop, user_id)
+            events.put(
+                ("started", index, f"{payload['product']} @ {payload['website']}")
+            )
+            try:
+                priced = await _price(
+                    payload["product"],
+                    [payload["website"]],
+                    int(payload.get("no_turns", 10)),
+                    user_id,
+                    f"worker{index}-{slot}",
+                )
+            except Exception as e:
+                held.pop(job.id, None)
+                await asyncio.to_thread(job_queue.fail, job, str(e))
+                events.put(("error", index, payload["product"], str(e)))
+                continue
+            if priced is None:  # stopped: hand the job back, not as a failed attempt
+                held.pop(job.id, None)
+                await asyncio.to_thread(job_queue.release, job)
+                return
+            pending.append((*priced, job))
+            if len(pending) >= SYNTHESIS_BATCH:
+                await flush()
+
+    renew = asyncio.create_task(keep_leases())
+    try:
+        await asyncio.gather(*(run(slot) for slot in range(runs_per_process)))
+        await flush()
+    finally:
+        renew.cancel()
+
+
+def _worker_process(
+    index: int,
+    jobs,
+    events,
+    stop,
+    rate_limiter: SharedRateLimiter,
+    websites: List[str],
+    no_turns: int,
+    user_id: str,
+    runs_per_process: int,
+) -> None:
+    """Entry point of one worker process: its own event loop of product_pricer_ runs.
+    `jobs` is the product mp.Queue, or the name of the Redis job queue to consume."""
+    # the processes already run in parallel; don't give each its own conversion pool
+    os.environ.setdefault("CONVERSION_WORKERS", "0")
+    models_.rate_limiter = rate_limiter
+    try:
+        if isinstance(jobs, str):
+            asyncio.run(
+                closing_connections(
+                    _job_worker_loop(index, jobs, events, stop, runs_per_process)
+                )
+            )
+        else:
+            asyncio.run(
+                closing_connections(
+                    _worker_loop(
+                        index,
+                        jobs,
+                        events,
+                        stop,
+                        websites,
+                        no_turns,
+                        user_id,
+                        runs_per_process,
+                    )
+                )
+            )
+    except Exception as e:
+        events.put(("error", index, None, str(e)))
+    finally:
+        events.put(("done", index))
+
+
+############################################################################################################
+## parent side
+
+
+def _merge_job_results(
+    job_queue: RedisJobQueue, job_ids: List[str], products: List[str]
+) -> Tuple[List[dict], List[Dict]]:
+    """Per-product results from the per-(product, website) job results, in input order"""
+    merged: Dict[str, dict] = {}
+    run_metrics: List[Dict] = []
+    for stored in job_queue.results(job_ids).values():
+        product, result = stored["payload"]["product"], stored["result"]
+        item = merged.setdefault(
+            product, {"product": product, "data": {}, "usage": None}
+        )
+        item["data"].update(result["data"])
+        run_metrics.append(result["metrics"])
+        usage = result.get("usage")
+        if usage:
+            if item["usage"] is None:
+                item["usage"] = {**usage, "breakdown": list(usage["breakdown"])}
+            else:
+                for name, value in usage.items():
+                    if name == "breakdown":
+                        item["usage"]["breakdown"].extend(value)
+                    else:
+                        item["usage"][name] += value
+    return [merged[p] for p in dict.fromkeys(products) if p in merged], run_metrics
+
+
+def _run_workers(
+    processes: int,
+    jobs,
+    websites: List[str],
+    no_turns: int,
+    *,
+    runs_per_process: int,
+    requests_per_minute: float,
+    user_id: str,
+    ctx,
+) -> Tuple[List[dict], List[Dict]]:
+    """Start the worker processes on `jobs` and collect their results until all exit"""
+    events, stop = ctx.Queue(), ctx.Event()
+    rate_limiter = SharedRateLimiter(requests_per_minute, ctx=ctx)
+
+    # 'q' stops the parent's stream; pass it on to every worker
+    local_state.start_streaming(user_id)
+    unsubscribe = local_state.subscribe(
+        lambda _, streaming: None if streaming else stop.set(), user_id=user_id
+    )
+    keyboard_listener.start_listening(user_id)
+
+    workers = [
+        ctx.Process(
+            target=_worker_process,
+            args=(
+                index,
+                jobs,
+                events,
+                stop,
+                rate_limiter,
+                websites,
+                no_turns,
+                user_id,
+                runs_per_process,
+            ),
+            daemon=True,
+        )
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    cum_json: List[dict] = []
+    run_metrics: List[Dict] = []
+    running = len(workers)
+    try:
+        while running:
+            try:
+                event = events.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+            kind = event[0]
+            if kind == "done":
+                running -= 1
+            elif kind == "started":
+                console.print(f"[dim]worker {event[1]} ▸ {event[2]}[/dim]")
+            elif kind == "error":
+                console.print(
+                    f"[bright_red]worker {event[1]} ✗ {event[2]}: {event[3]}[/bright_red]"
+                )
+            elif kind == "result":
+                _, product, data, metrics, usage = event
+                console.print(create_results_table(product, data))
+                cum_json.append({"product": product, "data": data, "usage": usage})
+                run_metrics.append(metrics)
+    except KeyboardInterrupt:
+        stop.set()
+        console.print(Panel("◆ Process interrupted", style="bold red"))
+    finally:
+        unsubscribe()
+        keyboard_listener.stop_listening()
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+    return cum_json, run_metrics
+
+
+def run_worker_pool(
+    products: List[str],
+    websites: List[str],
+    no_turns: int,
+    save_format: str,
+    *,
+    processes: int = None,
+    runs_per_process: int = None,
+    requests_per_minute: float = None,
+    user_id: str = "localUser",
+) -> str:
+    """Price `products` with a pool of processes pulling from one product queue
+    (with STATE_BACKEND=redis: from the shared Redis job queue, one job per
+    product and website). Model calls of all processes share one rate limit;
+    results are aggregated into a single save_results file, whose path is returned."""
+    processes = processes or int(
+        os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1))
+    )
+    runs_per_process = runs_per_process or int(os.getenv("RUNS_PER_PROCESS", "4"))
+    requests_per_minute = requests_per_minute or float(
+        os.getenv("MODEL_REQUESTS_PER_MINUTE", "500")
+    )
+    ctx = multiprocessing.get_context("spawn")
+
+    if USE_JOB_QUEUE:
+        job_queue = RedisJobQueue(name=JOB_QUEUE)
+        job_ids = job_queue.enqueue_products(
+            products, websites, user_id=user_id, no_turns=no_turns
+        )
+        processes = max(1, min(processes, len(job_ids)))
+        jobs = JOB_QUEUE
+    else:
+        processes = max(1, min(processes, len(products)))
+        jobs = ctx.Queue()
+        for product in products:
+            jobs.put(product)
+        for _ in range(processes * runs_per_process):
+            jobs.put(None)
+
+    cum_json, run_metrics = _run_workers(
+        processes,
+        jobs,
+        websites,
+        no_turns,
+        runs_per_process=runs_per_process,
+        requests_per_minute=requests_per_minute,
+        user_id=user_id,
+        ctx=ctx,
+    )
+    if USE_JOB_QUEUE:
+        # also picks up the jobs that consumers on other machines completed
+        cum_json, run_metrics = _merge_job_results(job_queue, job_ids, products)
+        for dead in job_queue.dead_jobs():
+            if dead["job_id"] in job_ids:
+                console.print(
+                    f"[bright_red]✗ {dead['payload']} failed {dead['attempts']}x: {dead['error']}[/bright_red]"
+                )
+
+    if not cum_json:
+        return None
+    saved_path = save_results(cum_json, user_id, save_format)
+    turns_saved = sum(m["turns_saved"] for m in run_metrics)
+    cost = sum(item["usage"]["cost_usd"] for item in cum_json if item["usage"])
+    console.print(
+        Panel(
+            f"◆ Results saved to: {saved_path}\n"
+            f"◆ {len(cum_json)}/{len(products)} products by {processes} processes, "
+            f"turns saved: {turns_saved}, estimated cost: ${cost:.4f}",
+            style="bright_green",
+            title="╭─ Complete ─╮",
+        )
+    )
+    return saved_path
+
+
+def consume_jobs(processes: int = None, runs_per_process: int = None) -> None:
+    """Join the work on the Redis job queue from another machine, until it is empty"""
+    processes = processes or int(
+        os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1))
+    )
+    _run_workers(
+        processes,
+        JOB_QUEUE,
+        [],
+        0,
+        runs_per_process=runs_per_process or int(os.getenv("RUNS_PER_PROCESS", "4")),
+        requests_per_minute=float(os.getenv("MODEL_REQUESTS_PER_MINUTE", "500")),
+        user_id="jobConsumer",
+        ctx=multiprocessing.get_context("spawn"),
+    )
+
+
+def _workers_entry_():
+    products_input = Prompt.ask(
+        "[bright_cyan]Enter products to analyze (separate with ' | ')[/bright_cyan]",
+        default="nöm Joghurt gerührt 3,6% | Danone Dany Sahne Schokolade",
+    )
+    products = [p.strip() for p in products_input.split("|") if p.strip()]
+
+    websites_input = Prompt.ask(
+        "[bright_cyan]Enter websites to search (separate with ' | ')[/bright_cyan]",
+        default="https://shop.billa.at/ | https://www.gurkerl.at/ | https://hausbrot.at/",
+    )
+    websites = [w.strip() for w in websites_input.split("|") if w.strip()]
+
+    save_format = Prompt.ask(
+        "[bright_cyan]Choose output format[/bright_cyan]",
+        choices=["json", "excel"],
+        default="json",
+    )
+    no_turns = IntPrompt.ask(
+        "[bright_cyan]Enter number of turns[/bright_cyan]", default=10
+    )
+    processes = IntPrompt.ask(
+        "[bright_cyan]Enter number of worker processes[/bright_cyan]",
+        default=min(4, os.cpu_count() or 1),
+    )
+
+    run_worker_pool(products, websites, no_turns, save_format, processes=processes)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["consume"]:
+        consume_jobs()
+    else:
+        _workers_entry_()